@@ -43,9 +43,9 @@ srcpath = dir+'/src'
 sys.path.append(srcpath)
 
 import pYINmain
-import essentia.standard as ess
 import numpy as np
 from YinUtil import RMS
+from AudioStream import WavReader, streamFrames
 
 if __name__ == "__main__":
 
@@ -59,8 +59,9 @@ if __name__ == "__main__":
     pYinInst.initialise(channels = 1, inputSampleRate = fs, stepSize = hopSize, blockSize = frameSize,
                    lowAmp = 0.25, onsetSensitivity = 0.7, pruneThresh = 0.1)
 
-    # frame-wise calculation
-    audio = ess.MonoLoader(filename = filename1, sampleRate = fs)()
+    # frame-wise calculation, the frames are cut from blocks read from the file
+    # (pYinInst.processStream(WavReader(filename1).blocks()) does the same in batches of frames)
+    reader = WavReader(filename1)
 
     # rms mean
     # rms = []
@@ -69,8 +70,9 @@ if __name__ == "__main__":
     # rmsMean = np.mean(rms)
     # print 'rmsMean', rmsMean
 
-    for frame in ess.FrameGenerator(audio, frameSize=frameSize, hopSize=hopSize):
-        fs = pYinInst.process(frame)
+    for frames in streamFrames(reader.blocks(), frameSize, hopSize):
+        for frame in frames:
+            fs = pYinInst.process(frame)
 
     # calculate smoothed pitch and mono note
     monoPitch = pYinInst.getSmoothedPitchTrack()
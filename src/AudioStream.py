@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+'''
+ * Copyright (C) 2015  Music Technology Group - Universitat Pompeu Fabra
+ *
+ * This file is part of pypYIN
+ *
+ * pypYIN is free software: you can redistribute it and/or modify it under
+ * the terms of the GNU Affero General Public License as published by the Free
+ * Software Foundation (FSF), either version 3 of the License, or (at your
+ * option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but WITHOUT
+ * ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+ * FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+ * details.
+ *
+ * You should have received a copy of the Affero GNU General Public License
+ * version 3 along with this program.  If not, see http://www.gnu.org/licenses/
+ *
+ * If you have any problem about this python version code, please contact: Rong Gong
+ * rong.gong@upf.edu
+ *
+ * If you have any problem about this algorithm, I suggest you to contact: Matthias Mauch
+ * m.mauch@qmul.ac.uk who is the original C++ version author of this algorithm
+ *
+ * If you want to refer this code, please consider this article:
+ *
+ * M. Mauch and S. Dixon,
+ * “pYIN: A Fundamental Frequency Estimator Using Probabilistic Threshold Distributions”,
+ * in Proceedings of the IEEE International Conference on Acoustics,
+ * Speech, and Signal Processing (ICASSP 2014), 2014.
+ *
+ * M. Mauch, C. Cannam, R. Bittner, G. Fazekas, J. Salamon, J. Dai, J. Bello and S. Dixon,
+ * “Computer-aided Melody Note Transcription Using the Tony Software: Accuracy and Efficiency”,
+ * in Proceedings of the First International Conference on Technologies for
+ * Music Notation and Representation, 2015.
+'''
+
+import os
+import struct
+import numpy as np
+from YinUtil import frameSignal
+
+class WavReader(object):
+
+    # PCM (8, 16, 24, 32 bit) and float (32, 64 bit) WAV file, read in blocks of mono samples
+    # (channels mixed like ess.MonoLoader) so that the file is never in memory as a whole
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.sampleRate = 0
+        self.channels = 0
+        self.sampleWidth = 0  # bytes per sample of one channel
+        self.isFloat = False
+        self.dataOffset = 0
+        self.nSample = 0  # samples per channel
+
+        with open(fileName, 'rb') as f:
+            riff, riffSize, wave = struct.unpack('<4sI4s', f.read(12))
+            if riff != 'RIFF' or wave != 'WAVE':
+                raise ValueError(fileName + ' is not a WAV file')
+            fileSize = os.fstat(f.fileno()).st_size
+
+            # chunks are padded to an even size
+            format = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError(fileName + ' has no data chunk')
+                chunkId, chunkSize = struct.unpack('<4sI', header)
+                if chunkId == 'fmt ':
+                    fmt = f.read(chunkSize)
+                    format, self.channels, self.sampleRate = struct.unpack('<HHI', fmt[:8])
+                    self.sampleWidth = struct.unpack('<H', fmt[14:16])[0] // 8
+                    if format == 0xFFFE and len(fmt) >= 26:  # WAVE_FORMAT_EXTENSIBLE, the format is in the sub format
+                        format = struct.unpack('<H', fmt[24:26])[0]
+                    f.seek(chunkSize % 2, 1)
+                elif chunkId == 'data':
+                    if format is None:
+                        raise ValueError(fileName + ' has no fmt chunk before its data')
+                    self.dataOffset = f.tell()
+                    # the size of unfinished recordings is often wrong, trust the file size
+                    dataSize = min(chunkSize, fileSize - self.dataOffset)
+                    break
+                else:
+                    f.seek(chunkSize + chunkSize % 2, 1)
+
+        if not ((format == 1 and self.sampleWidth in (1, 2, 3, 4)) or (format == 3 and self.sampleWidth in (4, 8))) \
+                or self.channels < 1:
+            raise ValueError(fileName + ': only PCM and float WAV files can be read')
+        self.isFloat = format == 3
+        self.nSample = dataSize // (self.sampleWidth * self.channels)
+
+    def __len__(self):
+        return self.nSample
+
+    def blocks(self, blockLength = 262144):
+
+        # generator of the mono float32 samples, blockLength per block (the last one shorter)
+        frameBytes = self.sampleWidth * self.channels
+        with open(self.fileName, 'rb') as f:
+            f.seek(self.dataOffset)
+            for iStart in range(0, self.nSample, blockLength):
+                nSample = min(blockLength, self.nSample - iStart)
+                yield self.decode(f.read(nSample * frameBytes), nSample)
+
+    def read(self):
+        # all the samples at once
+        return np.concatenate([np.zeros((0,), dtype=np.float32)] + list(self.blocks()))
+
+    def decode(self, data, nSample):
+
+        # samples as float32 in [-1, 1), one row per sample and one column per channel, then mixed
+        if self.isFloat:
+            samples = np.frombuffer(data, dtype='<f%d' % self.sampleWidth).astype(np.float32)
+        elif self.sampleWidth == 1:
+            samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / np.float32(128)
+        elif self.sampleWidth == 3:
+            # little endian 24 bit, put in the upper bytes of an int32 to keep the sign
+            byte = np.frombuffer(data, dtype=np.uint8).reshape((-1, 3)).astype(np.int32)
+            value = (byte[:, 0] << 8) | (byte[:, 1] << 16) | (byte[:, 2] << 24)
+            samples = (value >> 8).astype(np.float32) / np.float32(8388608)
+        else:
+            bits = 8 * self.sampleWidth
+            samples = np.frombuffer(data, dtype='<i%d' % self.sampleWidth).astype(np.float32) / np.float32(2 ** (bits-1))
+        samples = samples.reshape((nSample, self.channels))
+
+        if self.channels == 1:
+            return samples[:, 0]
+        return np.mean(samples, axis=1, dtype=np.float32)
+
+def streamFrames(blocks, frameSize, hopSize):
+
+    # frames of the concatenated blocks like frameSignal(audio, frameSize, hopSize): centred on multiples
+    # of hopSize and zero padded at both ends. Yields the frames that are complete after every block as a
+    # 2-D view, only valid until the next one is asked for. Between blocks, only the last frameSize - hopSize
+    # samples (or fewer) are kept, in a buffer that is reused
+    buffer = np.zeros((frameSize,), dtype=np.float32)
+    nBuffered = frameSize // 2  # the zero padding before the first frame
+    nSample = 0
+    nFrameDone = 0
+
+    for block in blocks:
+        block = np.asarray(block)
+        nSample += len(block)
+        if nBuffered + len(block) > len(buffer) or np.result_type(buffer, block) != buffer.dtype:
+            grown = np.zeros((nBuffered + len(block),), dtype=np.result_type(buffer, block))
+            grown[:nBuffered] = buffer[:nBuffered]
+            buffer = grown
+        buffer[nBuffered:nBuffered+len(block)] = block
+        nBuffered += len(block)
+
+        nFrame = max(0, (nBuffered - frameSize) // hopSize + 1)
+        if nFrame > 0:
+            yield frameSignal(buffer[:nBuffered], frameSize, hopSize, startFromZero=True)
+            # the overlap with the next frame moves to the front
+            nKept = nBuffered - nFrame * hopSize
+            buffer[:nKept] = buffer[nFrame*hopSize:nBuffered].copy()
+            nBuffered = nKept
+            nFrameDone += nFrame
+
+    # the frames that go past the end of the audio, up to the one centred on the last sample
+    nFrameTotal = (nSample + hopSize - 1) // hopSize
+    if nFrameTotal > nFrameDone:
+        tail = np.zeros((nBuffered + frameSize + hopSize * (nFrameTotal - nFrameDone),), dtype=buffer.dtype)
+        tail[:nBuffered] = buffer[:nBuffered]
+        yield frameSignal(tail, frameSize, hopSize, startFromZero=True)[:nFrameTotal - nFrameDone]
\ No newline at end of file
@@ -49,26 +49,68 @@ class FrameOutput(object):
         self.pitch = pitch
         self.noteState = noteState
 
+class FrameOutputs(object):
+
+    # FrameOutput of a sequence of frames, as one array per field; indexing gives a FrameOutput
+    def __init__(self, frameNumber = None, pitch = None, noteState = None):
+        self.frameNumber = np.array([], dtype=np.int) if frameNumber is None else frameNumber
+        self.pitch = np.array([], dtype=np.float64) if pitch is None else pitch
+        self.noteState = np.array([], dtype=np.int) if noteState is None else noteState
+
+    def __len__(self):
+        return len(self.frameNumber)
+
+    def __getitem__(self, i):
+        return FrameOutput(self.frameNumber[i], self.pitch[i], self.noteState[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
 class MonoNote(object):
 
     def __init__(self):
         self.hmm = MonoNoteHMM()
+        # log probabilities instead of scaled ones (equally likely paths can be broken otherwise), and the
+        # float type of delta, transitions and observations, see SparseHMM.decodeViterbi
+        self.logDomain = False
+        self.decodeDtype = np.float64
+        # no segment-parallel decoding like MonoPitch.decodeJobs: the silent states remember the last
+        # note, so the delta of a segment never joins the true one and every segment is decoded twice
 
     def process(self, pitchProb):
-        obsProb = [self.hmm.calculatedObsProb(pitchProb[0]), ]
-        for iFrame in range(1, len(pitchProb)):
-            obsProb += [self.hmm.calculatedObsProb(pitchProb[iFrame])]
-        out = []
+        obsProb = self.hmm.calculatedSparseObsProb(pitchProb, self.decodeDtype)
+        path, scale = self.hmm.decodeViterbi(obsProb, storeScale=False, logDomain=self.logDomain,
+                                             dtype=self.decodeDtype)
+
+        # getFrameOutput of every frame
+        currPitch = self.hmm.par.minPitch + (path // self.hmm.par.nSPP) * 1.0/self.hmm.par.nPPS
+        stateKind = path % self.hmm.par.nSPP + 1
+        return FrameOutputs(np.arange(len(path)), currPitch, stateKind)
+
+    def getFrameOutput(self, iFrame, state):
+        currPitch = -1.0
+        stateKind = 0
+
+        currPitch = self.hmm.par.minPitch + (state/self.hmm.par.nSPP) * 1.0/self.hmm.par.nPPS
+        stateKind = (state) % self.hmm.par.nSPP + 1
 
-        path, scale = self.hmm.decodeViterbi(obsProb)
+        return FrameOutput(iFrame, currPitch, stateKind)
 
-        for iFrame in range(len(path)):
-            currPitch = -1.0
-            stateKind = 0
+    def initialiseOnline(self, maxLag = None):
+        # frame by frame decoding, see SparseHMM.OnlineViterbi
+        self.online = self.hmm.onlineViterbi(maxLag)
+        self.onlineFrame = 0  # first frame not returned yet
 
-            currPitch = self.hmm.par.minPitch + (path[iFrame]/self.hmm.par.nSPP) * 1.0/self.hmm.par.nPPS
-            stateKind = (path[iFrame]) % self.hmm.par.nSPP + 1
+    def processOnline(self, framePitchProb):
+        # returns the FrameOutput of the frames decided after this frame, in frame order
+        return self.onlineOutput(self.online.process(self.hmm.calculatedObsProb(framePitchProb)))
 
-            out.append(FrameOutput(iFrame, currPitch, stateKind))
+    def finaliseOnline(self):
+        # FrameOutput of all the frames not returned yet
+        return self.onlineOutput(self.online.finalise())
 
+    def onlineOutput(self, path):
+        out = [self.getFrameOutput(self.onlineFrame + iFrame, path[iFrame]) for iFrame in range(len(path))]
+        self.onlineFrame += len(path)
         return out
\ No newline at end of file
@@ -38,69 +38,110 @@
 '''
 
 import numpy as np
-from SparseHMM import SparseHMM
+from SparseHMM import SparseHMM, sparseObsFromDense, concatenateSparseObs
 from MonoNoteParameters import MonoNoteParameters
 from math import *
-from scipy.stats import norm
 
 class MonoNoteHMM(SparseHMM):
     def __init__(self):
         SparseHMM.__init__(self)
         self.par = MonoNoteParameters()
-        self.pitchDistr = []
-        self.build()
+        # means and standard deviations of the gaussian observation distributions
+        self.pitchMean = np.array([], dtype=np.float64)
+        self.pitchSigma = np.array([], dtype=np.float64)
+        self.frameBatchSize = 256  # frames per batch in calculatedObsProbFrames
+        self.buildCached()
 
     def calculatedObsProb(self, pitchProb):
         # pitchProb is a list of pairs (pitches and their probabilities)
+        return self.calculatedObsProbFrames([pitchProb])[0]
+
+    def calculatedObsProbFrames(self, pitchProbs):
+        # observation probabilities of a list of frames (pitchProb lists), array nFrame x n
+        # for every pitched state the nearest candidate (first one on ties) is weighted with the
+        # gaussian of the state, computed frameBatchSize frames x candidates x pitches at a time
+
+        nFrame = len(pitchProbs)
+        out = np.zeros((nFrame, self.par.n), dtype=np.float64)
+        if nFrame == 0:
+            return out
+
+        # candidates as nFrame x maxCandidate arrays, missing candidates have probability 0
+        nCandidate = np.array([len(pitchProb) for pitchProb in pitchProbs], dtype=np.intp)
+        maxCandidate = max(np.max(nCandidate), 1)
+        candPitch = np.zeros((nFrame, maxCandidate), dtype=np.float64)
+        candProb = np.zeros((nFrame, maxCandidate), dtype=np.float64)
+        isCandidate = np.arange(maxCandidate)[np.newaxis, :] < nCandidate[:, np.newaxis]
+        if np.sum(nCandidate) > 0:
+            candidates = np.concatenate([np.reshape(np.asarray(pitchProb, dtype=np.float64), (-1, 2))
+                                         for pitchProb in pitchProbs if len(pitchProb) > 0])
+            candPitch[isCandidate] = candidates[:, 0]
+            candProb[isCandidate] = candidates[:, 1]
+
+        # what is the probability of pitched (summed in candidate order), check Ryynanen's paper
+        pIsPitched = np.cumsum(candProb, axis=1)[:, -1]
+        pIsPitched = pIsPitched * (1-self.par.priorWeight) + self.par.priorPitchedProb * self.par.priorWeight
 
-        nCandidate = len(pitchProb)
+        isPitched = np.arange(self.par.n) % self.par.nSPP != 2
+        pitchedMean = self.pitchMean[isPitched]
+        pitchedSigma = self.pitchSigma[isPitched]
+        # attack and stable states of a pitch have the same mean
+        noteMean = self.pitchMean[::self.par.nSPP]
+        noteOfPitched = np.nonzero(isPitched)[0] // self.par.nSPP
+
+        tempProb = np.ones((nFrame, len(pitchedMean)), dtype=np.float64)
+        for iStart in range(0, nFrame, self.frameBatchSize):
+            iEnd = min(iStart + self.frameBatchSize, nFrame)
+            dist = np.fabs(noteMean[np.newaxis, np.newaxis, :] - candPitch[iStart:iEnd, :, np.newaxis])
+            dist[~isCandidate[iStart:iEnd]] = np.inf
+            minDistCandidate = np.argmin(dist, axis=1)  # batch x nPitch
+            hasMinDist = np.min(dist, axis=1) < 10000.0
+
+            rows = np.arange(iEnd-iStart)[:, np.newaxis]
+            minDistCandidate = minDistCandidate[:, noteOfPitched]
+            minDistProb = np.where(hasMinDist[:, noteOfPitched], candProb[iStart:iEnd][rows, minDistCandidate], 0.0)
+            z = (candPitch[iStart:iEnd][rows, minDistCandidate] - pitchedMean) / pitchedSigma
+            batchProb = np.power(minDistProb, self.par.yinTrust) * (np.exp(-z**2/2.0) / np.sqrt(2*np.pi) / pitchedSigma)
+
+            hasCandidate = nCandidate[iStart:iEnd] > 0
+            tempProb[iStart:iEnd][hasCandidate] = batchProb[hasCandidate]
+
+        # normalised in state order like the sequential sum, left as it is if the sum is 0
+        tempProbSum = np.cumsum(tempProb, axis=1)[:, -1]
+        isNormalised = tempProbSum > 0
+        tempProb[isNormalised] = tempProb[isNormalised] / tempProbSum[isNormalised, np.newaxis] \
+                                 * pIsPitched[isNormalised, np.newaxis]
+
+        out[:, isPitched] = tempProb
+        # the prob of non pitched
+        out[:, ~isPitched] = ((1-pIsPitched) / (self.par.nPPS * self.par.nS))[:, np.newaxis]
 
-        # what is the probability of pitched
-        pIsPitched = 0.0
-        for iCandidate in range(nCandidate):
-            # pIsPitched = pitchProb[iCandidate].second > pIsPitched ? pitchProb[iCandidate].second : pIsPitched;
-            pIsPitched += pitchProb[iCandidate][1]
+        return out
 
-        # the pitched probability, check Ryynanen's paper
-        pIsPitched = pIsPitched * (1-self.par.priorWeight) + self.par.priorPitchedProb * self.par.priorWeight
+    def calculatedSparseObsProb(self, pitchProbs, dtype = np.float64):
+        # calculatedObsProbFrames as a SparseObsProb, made frameBatchSize frames at a time (in float64,
+        # stored in dtype). The silent states share one probability, and so do all the others in frames
+        # without candidates
+        parts = [sparseObsFromDense(self.calculatedObsProbFrames(pitchProbs[iStart:iStart+self.frameBatchSize]),
+                                    self.obsClassStates()).astype(dtype)
+                 for iStart in range(0, max(len(pitchProbs), 1), self.frameBatchSize)]
+        return concatenateSparseObs(parts)
 
-        out = np.zeros((self.par.n,), dtype=np.float64)
-        tempProbSum = 0
-        for i in range(self.par.n):
-            if i % self.par.nSPP != 2:
-                # std::cerr << getMidiPitch(i) << std::endl;
-                tempProb = 0.0
-                if nCandidate > 0:
-                    minDist = 10000.0
-                    minDistProb = 0.0
-                    minDistCandidate = 0
-                    for iCandidate in range(nCandidate):
-                        currDist = fabs(self.getMidiPitch(i)-pitchProb[iCandidate][0])
-                        if (currDist < minDist):
-                            minDist = currDist
-                            minDistProb = pitchProb[iCandidate][1]
-                            minDistCandidate = iCandidate
-                    tempProb = pow(minDistProb, self.par.yinTrust) * self.pitchDistr[i].pdf(pitchProb[minDistCandidate][0])
-                else:
-                    tempProb = 1
-                tempProbSum += tempProb
-                out[i] = tempProb
-
-        for i in range(self.par.n):
-            if i % self.par.nSPP != 2:
-                if tempProbSum > 0:
-                    out[i] = out[i] / tempProbSum * pIsPitched
-            else:
-                # the prob of non pitched
-                out[i] = (1-pIsPitched) / (self.par.nPPS * self.par.nS)
+    def obsClassStates(self):
+        # attack, stable and silent states
+        return [slice(iKind, self.par.n, self.par.nSPP) for iKind in range(self.par.nSPP)]
 
-        return out
+    def modelKey(self):
+        return tuple(sorted((name, value) for name, value in vars(self.par).items() if np.isscalar(value)))
+
+    def modelTables(self):
+        return SparseHMM.modelTables(self) + ['pitchMean', 'pitchSigma']
 
     def getMidiPitch(self, index):
-        return self.pitchDistr[index].mean()
+        return self.pitchMean[index]
 
     def getFrequency(self, index):
-        return 440 * pow(2.0, (self.pitchDistr[index].mean()-69)/12)
+        return 440 * pow(2.0, (self.pitchMean[index]-69)/12)
 
     def build(self):
         # the states are organised as follows:
@@ -111,77 +152,53 @@ class MonoNoteHMM(SparseHMM):
         # 3-5. second-lowest pitch
         #    3. attack state
         #    ...
-
-        # observation distributions
-        for iState in range(self.par.n):
-            self.pitchDistr.append(norm(loc=0, scale=1))
-            if iState % self.par.nSPP == 2:
-                # silent state starts tracking
-                self.init = np.append(self.init, np.float64(1.0/(self.par.nS * self.par.nPPS)))
-            else:
-                self.init = np.append(self.init, np.float64(0.0))
-
-        for iPitch in range(self.par.nS * self.par.nPPS):
-            index = iPitch * self.par.nSPP   # each pitch has 3 state
-            mu = self.par.minPitch + iPitch * 1.0/self.par.nPPS
-            self.pitchDistr[index] = norm(loc=mu, scale=self.par.sigmaYinPitchAttack)
-            self.pitchDistr[index+1] = norm(loc=mu, scale=self.par.sigmaYinPitchStable)
-            self.pitchDistr[index+2] = norm(loc=mu, scale=1.0) # dummy
-
-        # this might be the note transition probability function
-        noteDistanceDistr = norm(loc=0, scale=self.par.sigma2Note)
-
-        for iPitch in range(self.par.nS * self.par.nPPS):
-            # loop through all notes and set sparse transition probabilities
-            index = iPitch * self.par.nSPP
-
-            # transitions from attack state
-            self.fromIndex = np.append(self.fromIndex, np.uint64(index))
-            self.toIndex = np.append(self.toIndex, np.uint64(index))
-            self.transProb = np.append(self.transProb, np.float64(self.par.pAttackSelftrans))
-
-            self.fromIndex = np.append(self.fromIndex, np.uint64(index))
-            self.toIndex = np.append(self.toIndex, np.uint64(index+1))
-            self.transProb = np.append(self.transProb, np.float64(1-self.par.pAttackSelftrans))
-
-            # transitions from stable state
-            self.fromIndex = np.append(self.fromIndex, np.uint64(index+1))
-            self.toIndex = np.append(self.toIndex, np.uint64(index+1)) # to itself
-            self.transProb = np.append(self.transProb, np.float64(self.par.pStableSelftrans))
-
-            self.fromIndex = np.append(self.fromIndex, np.uint64(index+1))
-            self.toIndex = np.append(self.toIndex, np.uint64(index+2)) # to silent
-            self.transProb = np.append(self.transProb, np.float64(self.par.pStable2Silent))
-
-            # the "easy" transitions from silent state
-            self.fromIndex = np.append(self.fromIndex, np.uint64(index+2))
-            self.toIndex = np.append(self.toIndex, np.uint64(index+2))
-            self.transProb = np.append(self.transProb, np.float64(self.par.pSilentSelftrans))
-
-            # the more complicated transitions from the silent
-            # this prob only applies to transitions from silent to non silent
-            # which is the note transition
-            probSumSilent = 0.0
-
-            tempTransProbSilent = []
-            for jPitch in range(self.par.nS * self.par.nPPS):
-                fromPitch = iPitch
-                toPitch = jPitch
-                semitoneDistance = fabs(fromPitch - toPitch) * 1.0 / self.par.nPPS
-
-                if semitoneDistance == 0 or \
-                        (semitoneDistance > self.par.minSemitoneDistance and semitoneDistance < self.par.maxJump):
-
-                    toIndex = jPitch * self.par.nSPP  # note attack index
-
-                    tempWeightSilent = noteDistanceDistr.pdf(semitoneDistance)
-                    probSumSilent += tempWeightSilent
-
-                    tempTransProbSilent.append(tempWeightSilent)
-
-                    self.fromIndex = np.append(self.fromIndex, np.uint64(index+2))  # from a silence
-                    self.toIndex = np.append(self.toIndex, np.uint64(toIndex))  # to an attack
-
-            for i in range(len(tempTransProbSilent)):
-                self.transProb = np.append(self.transProb,
-                                          np.float64(((1-self.par.pSilentSelftrans) * tempTransProbSilent[i]/probSumSilent)))
\ No newline at end of file
+        nPitch = self.par.nS * self.par.nPPS
+        stateKind = np.arange(self.par.n) % self.par.nSPP
+
+        # silent state starts tracking
+        self.init = np.where(stateKind == 2, np.float64(1.0/(self.par.nS * self.par.nPPS)), 0.0)
+
+        # observation distributions, gaussians around the pitch of the state (dummy for the silent state)
+        self.pitchMean = self.par.minPitch + (np.arange(self.par.n) // self.par.nSPP) * 1.0/self.par.nPPS
+        self.pitchSigma = np.choose(stateKind, [self.par.sigmaYinPitchAttack, self.par.sigmaYinPitchStable, 1.0]) \
+            .astype(np.float64)
+
+        # the more complicated transitions from the silent state to the attack states of the
+        # other notes: this might be the note transition probability function
+        fromPitch = np.arange(nPitch)[:, np.newaxis]
+        toPitch = np.arange(nPitch)[np.newaxis, :]
+        semitoneDistance = np.fabs(fromPitch - toPitch) * 1.0 / self.par.nPPS
+        isJump = (semitoneDistance == 0) | \
+                 ((semitoneDistance > self.par.minSemitoneDistance) & (semitoneDistance < self.par.maxJump))
+        x = semitoneDistance / self.par.sigma2Note
+        weightSilent = np.where(isJump, np.exp(-x**2/2.0) / np.sqrt(2*np.pi) / self.par.sigma2Note, 0.0)
+        probSumSilent = np.cumsum(weightSilent, axis=1)[:, -1]  # summed in note order
+        jumpFrom, jumpTo = np.nonzero(isJump)
+
+        # per pitch: 2 transitions from the attack state, 2 from the stable state,
+        # the silent self transition and the jumps from the silent state
+        nJump = np.sum(isJump, axis=1)
+        blockStart = np.zeros((nPitch,), dtype=np.intp)
+        np.cumsum(5 + nJump[:-1], out=blockStart[1:])
+        nTrans = blockStart[-1] + 5 + nJump[-1]
+
+        self.fromIndex = np.zeros((nTrans,), dtype=np.uint64)
+        self.toIndex = np.zeros((nTrans,), dtype=np.uint64)
+        self.transProb = np.zeros((nTrans,), dtype=np.float64)
+
+        index = np.arange(nPitch) * self.par.nSPP
+        fixed = [(0, 0, self.par.pAttackSelftrans),
+                 (0, 1, 1-self.par.pAttackSelftrans),
+                 (1, 1, self.par.pStableSelftrans),  # to itself
+                 (1, 2, self.par.pStable2Silent),  # to silent
+                 (2, 2, self.par.pSilentSelftrans)]
+        for k, (fromState, toState, prob) in enumerate(fixed):
+            self.fromIndex[blockStart+k] = index + fromState
+            self.toIndex[blockStart+k] = index + toState
+            self.transProb[blockStart+k] = prob
+
+        # this prob only applies to transitions from silent to non silent, which is the note transition
+        jumpPos = blockStart[jumpFrom] + 5 + np.arange(len(jumpFrom)) - np.repeat(np.cumsum(nJump) - nJump, nJump)
+        self.fromIndex[jumpPos] = jumpFrom * self.par.nSPP + 2  # from a silence
+        self.toIndex[jumpPos] = jumpTo * self.par.nSPP  # to an attack
+        self.transProb[jumpPos] = (1-self.par.pSilentSelftrans) * weightSilent[jumpFrom, jumpTo] / probSumSilent[jumpFrom]
\ No newline at end of file
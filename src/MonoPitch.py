@@ -44,32 +44,86 @@ from math import *
 class MonoPitch(object):
     def __init__(self):
         self.hmm = MonoPitchHMM()
+        # log probabilities instead of scaled ones (equally likely paths can be broken otherwise), and the
+        # float type of delta, transitions and observations, see SparseHMM.decodeViterbi
+        self.logDomain = False
+        self.decodeDtype = np.float64
+        # exact decoding in segments on decodeJobs processes, split at frames without candidates,
+        # see SparseHMM.decodeViterbiSegments (linear float64 decoding only); segmentReport is set by process
+        self.decodeJobs = None
+        self.decodeTolerance = 0.0
+        self.segmentReport = None
 
     def process(self, pitchProb):
-        obsProb = [self.hmm.calculatedObsProb(pitchProb[0]),]
-        for iFrame in range(1,len(pitchProb)):
-            obsProb += [self.hmm.calculatedObsProb(pitchProb[iFrame])]
+        candidateBins = self.hmm.binCandidates(pitchProb)
+        obsProb = self.hmm.calculatedSparseObsProb(pitchProb, candidateBins, self.decodeDtype)
 
-        out = np.array([], dtype=np.float32)
+        if self.decodeJobs is not None and not self.logDomain and np.dtype(self.decodeDtype) == np.float64:
+            isAnchor = np.diff(candidateBins.frameOffsets) == 0
+            path, self.segmentReport = self.hmm.decodeViterbiAnchored(obsProb, isAnchor, self.decodeJobs,
+                                                                      tolerance=self.decodeTolerance)
+        else:
+            path, scale = self.hmm.decodeViterbi(obsProb, storeScale=False, logDomain=self.logDomain,
+                                                 dtype=self.decodeDtype)
 
-        path, scale = self.hmm.decodeViterbi(obsProb)
+        return self.getFrequencies(path, candidateBins)
 
+    def getFrequencies(self, path, candidateBins):
+        # getFrequency of every frame of the path, from the candidate frequencies of binCandidates
+        hmmFreq = self.hmm.m_freqs[path]
+        candFreq = candidateBins.padded(candidateBins.freq, np.inf)
+        dist = np.fabs(hmmFreq[:, np.newaxis] - candFreq)
+        nearest = np.argmin(dist, axis=1)  # first one on ties
+        hasNearest = dist[np.arange(len(path)), nearest] < 10000.0
+        bestFreq = np.where(hasNearest, candFreq[np.arange(len(path)), nearest], 0.0)
+        return np.where(hmmFreq > 0, bestFreq, hmmFreq)
+
+    def getFrequency(self, state, framePitchProb):
+        hmmFreq = self.hmm.m_freqs[state]
+        bestFreq = 0.0
+        leastDist = 10000.0
+        if hmmFreq > 0:
+            # This was a Yin estimate, so try to get original pitch estimate back
+            # ... a bit hacky, since we could have direclty saved the frequency
+            # that was assigned to the HMM bin in hmm.calculateObsProb -- but would
+            # have had to rethink the interface of that method.
+            for iPitch in range(len(framePitchProb)):
+                freq = 440. * pow(2.0, (framePitchProb[iPitch][0] - 69)/12.0)
+                dist = fabs(hmmFreq-freq)
+                if dist < leastDist:
+                    leastDist = dist
+                    bestFreq = freq
+        else:
+            bestFreq = hmmFreq
+        return bestFreq
+
+    def initialiseOnline(self, maxLag = None):
+        # frame by frame decoding, see SparseHMM.OnlineViterbi
+        self.online = self.hmm.onlineViterbi(maxLag)
+        self.onlinePitchProb = []  # pitch candidates of the frames not decided yet
+        self.lastOnlinePitch = 0.0  # smoothed pitch of the last frame decided
+
+    def processOnline(self, framePitchProb):
+        # returns the smoothed pitch of the frames decided after this frame, in frame order
+        self.onlinePitchProb.append(framePitchProb)
+        return self.onlineOutput(self.online.process(self.hmm.calculatedObsProb(framePitchProb)))
+
+    def finaliseOnline(self):
+        # smoothed pitch of all the frames not returned yet
+        return self.onlineOutput(self.online.finalise())
+
+    def provisionalOnline(self):
+        # smoothed pitch of the last frame given to processOnline on the currently best path,
+        # it can still change with the next frames
+        if len(self.onlinePitchProb) == 0:
+            return self.lastOnlinePitch
+        return self.getFrequency(self.online.bestState(), self.onlinePitchProb[-1])
+
+    def onlineOutput(self, path):
+        out = np.zeros((len(path),), dtype=np.float64)
         for iFrame in range(len(path)):
-            hmmFreq = self.hmm.m_freqs[path[iFrame]]
-            bestFreq = 0.0
-            leastDist = 10000.0
-            if hmmFreq > 0:
-                # This was a Yin estimate, so try to get original pitch estimate back
-                # ... a bit hacky, since we could have direclty saved the frequency
-                # that was assigned to the HMM bin in hmm.calculateObsProb -- but would
-                # have had to rethink the interface of that method.
-                for iPitch in range(len(pitchProb[iFrame])):
-                    freq = 440. * pow(2.0, (pitchProb[iFrame][iPitch][0] - 69)/12.0)
-                    dist = fabs(hmmFreq-freq)
-                    if dist < leastDist:
-                        leastDist = dist
-                        bestFreq = freq
-            else:
-                bestFreq = hmmFreq
-            out = np.append(out, bestFreq)
+            out[iFrame] = self.getFrequency(path[iFrame], self.onlinePitchProb[iFrame])
+        del self.onlinePitchProb[:len(path)]
+        if len(out) > 0:
+            self.lastOnlinePitch = out[-1]
         return out
\ No newline at end of file
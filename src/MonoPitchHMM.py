@@ -37,7 +37,7 @@
  * Music Notation and Representation, 2015.
 '''
 
-from SparseHMM import SparseHMM
+from SparseHMM import SparseHMM, SparseObsProb
 from math import *
 import numpy as np
 
@@ -53,84 +53,236 @@ class MonoPitchHMM(SparseHMM):
         self.m_yinTrust = 0.5
         self.m_transitionWidth = 5*(np.uint64(self.m_nBPS/2)) + 1  # 2 semi-tones of frame jump
         self.m_nPitch = 69 * self.m_nBPS  # 69 semi-tone, each semi-tone divided to 5, step is 20 cents
+        self.bandProb = None
         self.m_freqs = np.zeros(2*self.m_nPitch, dtype=np.float64)
         for iPitch in range(self.m_nPitch):
             self.m_freqs[iPitch] = self.m_minFreq * pow(2, iPitch * 1.0 / (12 * self.m_nBPS))  # 0 to m_nPitch-1 positive pitch
             self.m_freqs[iPitch+self.m_nPitch] = -self.m_freqs[iPitch]  # m_nPitch to 2*m_nPitch-1 negative pitch
-        self.build()
+        self.buildCached()
+
+    class CandidateBins(object):
+
+        # the pitch candidates of a list of frames, the candidates of frame i are
+        # frameOffsets[i] to frameOffsets[i+1]: frequency, probability, and the pitch bin
+        # they were assigned to in the observation (-1 if none)
+        def __init__(self, freq, prob, pitchBin, frameOffsets):
+            self.freq = freq
+            self.prob = prob
+            self.pitchBin = pitchBin
+            self.frameOffsets = frameOffsets
+
+        def padded(self, values, fillValue):
+            # nFrame x maxCandidate array of the candidate values, in candidate order
+            nCandidate = np.diff(self.frameOffsets)
+            nFrame = len(nCandidate)
+            out = np.empty((nFrame, max(np.max(nCandidate) if nFrame > 0 else 0, 1)), dtype=values.dtype)
+            out[:] = fillValue
+            iCandidate = np.arange(len(values)) - np.repeat(self.frameOffsets[:-1], nCandidate)
+            out[np.repeat(np.arange(nFrame), nCandidate), iCandidate] = values
+            return out
+
+    def binCandidates(self, pitchProbs):
+        # pitchProbs is the pitch candidates (midi pitch, probability) of a list of frames.
+        # Every candidate goes to the nearest pitch bin (the upper one on ties), candidates
+        # at or below m_minFreq or nearest to the highest bin are not binned
+        nCandidate = np.array([len(pitchProb) for pitchProb in pitchProbs], dtype=np.intp)
+        frameOffsets = np.zeros((len(pitchProbs)+1,), dtype=np.intp)
+        np.cumsum(nCandidate, out=frameOffsets[1:])
+        if frameOffsets[-1] > 0:
+            candidates = np.concatenate([np.reshape(np.asarray(pitchProb, dtype=np.float64), (-1, 2))
+                                         for pitchProb in pitchProbs if len(pitchProb) > 0])
+        else:
+            candidates = np.zeros((0, 2), dtype=np.float64)
+
+        freq = 440. * np.power(2.0, (candidates[:, 0] - 69)/12.0)
+        pitchFreqs = self.m_freqs[:self.m_nPitch]
+
+        # first bin at or above freq, and the distances to it and to the bin below
+        upper = np.searchsorted(pitchFreqs, freq)
+        lower = np.maximum(upper-1, 0)
+        upperBin = np.minimum(upper, self.m_nPitch-1)
+        isLower = np.fabs(freq-pitchFreqs[upperBin]) > np.fabs(freq-pitchFreqs[lower])
+        pitchBin = np.where(isLower, lower, upper)
+        pitchBin[(freq <= self.m_minFreq) | (pitchBin >= self.m_nPitch-1)] = -1
+
+        return MonoPitchHMM.CandidateBins(freq, candidates[:, 1].copy(), pitchBin, frameOffsets)
 
     def calculatedObsProb(self, pitchProb):
         # pitchProb is the pitch candidates of one frame
-        out = np.zeros((2*self.m_nPitch+1,), dtype=np.float64)
-        probYinPitched = 0.0
-        # BIN THE PITCHES
-        for iPair in range(len(pitchProb)):
-            freq = 440. * pow(2.0, (pitchProb[iPair][0] - 69)/12.0)
-            if freq <= self.m_minFreq: continue
-            d = 0
-            oldd = 1000
-            for iPitch in range(self.m_nPitch):
-                d = fabs(freq-self.m_freqs[iPitch])
-                if oldd < d and iPitch > 0:
-                    # previous bin must have been the closest
-                    # when iPitch move far away from freq candidate
-                    # add pitch prob to probYinPitched, break
-                    out[iPitch-1] = pitchProb[iPair][1]
-                    probYinPitched += out[iPitch-1]
-                    break
-                oldd = d
+        return self.calculatedObsProbFrames([pitchProb])[0]
+
+    def calculatedObsProbFrames(self, pitchProbs, candidateBins = None):
+        # observation probabilities of a list of frames, array nFrame x (2*m_nPitch+1)
+        # candidateBins: binCandidates(pitchProbs) if it has been computed already
+        if candidateBins is None:
+            candidateBins = self.binCandidates(pitchProbs)
+
+        nFrame = len(candidateBins.frameOffsets) - 1
+        out = np.zeros((nFrame, 2*self.m_nPitch+1), dtype=np.float64)
+
+        # BIN THE PITCHES, a bin holds the probability of its last candidate
+        # but probYinPitched counts all of them, summed in candidate order
+        isBinned = candidateBins.pitchBin >= 0
+        binnedFrame = np.repeat(np.arange(nFrame), np.diff(candidateBins.frameOffsets))
+        out[binnedFrame[isBinned], candidateBins.pitchBin[isBinned]] = candidateBins.prob[isBinned]
+        binnedProb = candidateBins.padded(np.where(isBinned, candidateBins.prob, 0.0), 0.0)
+        probYinPitched = np.cumsum(binnedProb, axis=1)[:, -1]
 
         probReallyPitched = self.m_yinTrust * probYinPitched
         # damn, I forget what this is all about...
         # don't understand this part, inspired by note tracking method
-        for iPitch in range(self.m_nPitch):
-            if probYinPitched > 0: out[iPitch] *= (probReallyPitched/probYinPitched) # times self.m_yinTrust
-            #  non voiced pitch obs
-            #  1 - sum(pitchProb)*0.5
-            #  this observation prob is very small, but equal for every unvoiced state
-            #  so that the sum of them are 1 - sum(pitchProb)*0.5
-            out[iPitch+self.m_nPitch] = (1 - probReallyPitched) / self.m_nPitch
+        isPitched = probYinPitched > 0
+        out[isPitched, :self.m_nPitch] *= (probReallyPitched[isPitched]/probYinPitched[isPitched])[:, np.newaxis]
+        #  non voiced pitch obs
+        #  1 - sum(pitchProb)*0.5
+        #  this observation prob is very small, but equal for every unvoiced state
+        #  so that the sum of them are 1 - sum(pitchProb)*0.5
+        out[:, self.m_nPitch:2*self.m_nPitch] = ((1 - probReallyPitched) / self.m_nPitch)[:, np.newaxis]
 
         return out
 
+    def calculatedSparseObsProb(self, pitchProbs, candidateBins = None, dtype = np.float64):
+        # calculatedObsProbFrames as a SparseObsProb: the voiced states are 0 apart from the bins
+        # of the candidates, the unvoiced states all have the same probability. Computed in float64,
+        # stored in dtype
+        if candidateBins is None:
+            candidateBins = self.binCandidates(pitchProbs)
+
+        nFrame = len(candidateBins.frameOffsets) - 1
+        isBinned = candidateBins.pitchBin >= 0
+        binnedFrame = np.repeat(np.arange(nFrame), np.diff(candidateBins.frameOffsets))[isBinned]
+        binnedProb = candidateBins.padded(np.where(isBinned, candidateBins.prob, 0.0), 0.0)
+        probYinPitched = np.cumsum(binnedProb, axis=1)[:, -1]
+        probReallyPitched = self.m_yinTrust * probYinPitched
+
+        value = candidateBins.prob[isBinned]
+        isPitched = probYinPitched[binnedFrame] > 0
+        value[isPitched] *= (probReallyPitched[binnedFrame[isPitched]]/probYinPitched[binnedFrame[isPitched]])
+
+        background = np.zeros((nFrame, 2), dtype=np.float64)
+        background[:, 1] = (1 - probReallyPitched) / self.m_nPitch
+        frameOffsets = np.zeros((nFrame+1,), dtype=np.intp)
+        np.cumsum(np.bincount(binnedFrame, minlength=nFrame), out=frameOffsets[1:])
+
+        return SparseObsProb(background, candidateBins.pitchBin[isBinned], value, frameOffsets,
+                             self.obsClassStates()).astype(dtype)
+
+    def obsClassStates(self):
+        # voiced and unvoiced states
+        return [slice(0, self.m_nPitch), slice(self.m_nPitch, 2*self.m_nPitch)]
+
+    def modelKey(self):
+        return (self.m_nPitch, int(self.m_transitionWidth), self.m_selfTrans)
+
     def build(self):
 
         # initial vector, uniform distribution
         self.init = np.ones((2*self.m_nPitch), dtype=np.float64) * 1.0/2*self.m_nPitch
 
-        # transitions
-        for iPitch in range(self.m_nPitch):
-            theoreticalMinNextPitch = int(iPitch)-int(self.m_transitionWidth/2)
-            minNextPitch = iPitch-int(self.m_transitionWidth/2) if iPitch>self.m_transitionWidth/2 else 0
-            maxNextPitch = iPitch+int(self.m_transitionWidth/2) if iPitch<self.m_nPitch-self.m_transitionWidth/2 else self.m_nPitch-1
-
-            # weight vector, triangle, maximum is at iPitch
-            weightSum = 0
-            weights = np.array([], dtype=np.float64)
-            for i in range(minNextPitch, maxNextPitch+1):
-                if i <= iPitch:
-                    weights = np.append(weights, np.float64(i-theoreticalMinNextPitch+1))
-                else:
-                    weights = np.append(weights, np.float64(iPitch-theoreticalMinNextPitch+1-(i-iPitch)))
-                weightSum += weights[len(weights)-1]
-
-            for i in range(minNextPitch, maxNextPitch+1):
-                # from voiced to voiced
-                self.fromIndex = np.append(self.fromIndex, np.uint64(iPitch))
-                self.toIndex = np.append(self.toIndex, np.uint64(i))
-                self.transProb = np.append(self.transProb, np.float64(weights[i-minNextPitch] / weightSum * self.m_selfTrans))
-
-                # from voiced to non voiced
-                self.fromIndex = np.append(self.fromIndex, np.uint64(iPitch))
-                self.toIndex = np.append(self.toIndex, np.uint64(i+self.m_nPitch))
-                self.transProb = np.append(self.transProb, np.float64(weights[i-minNextPitch] / weightSum * (1-self.m_selfTrans)))
-
-                # from non voiced to non voiced
-                self.fromIndex = np.append(self.fromIndex, np.uint64(iPitch+self.m_nPitch))
-                self.toIndex = np.append(self.toIndex, np.uint64(i+self.m_nPitch))
-                self.transProb = np.append(self.transProb, np.float64(weights[i-minNextPitch] / weightSum * self.m_selfTrans))
-
-                # from non voiced to voiced
-                self.fromIndex = np.append(self.fromIndex, np.uint64(iPitch+self.m_nPitch))
-                self.toIndex = np.append(self.toIndex, np.uint64(i))
-                self.transProb = np.append(self.transProb, np.float64(weights[i-minNextPitch] / weightSum * (1-self.m_selfTrans)))
+        # transitions from every pitch to the pitches within half the transition width
+        halfWidth = int(self.m_transitionWidth/2)
+        fromPitch = np.arange(self.m_nPitch)
+        minNextPitch = np.maximum(fromPitch-halfWidth, 0)
+        maxNextPitch = np.minimum(fromPitch+halfWidth, self.m_nPitch-1)
+        nNext = maxNextPitch - minNextPitch + 1
+        iPitch = np.repeat(fromPitch, nNext)
+        i = np.repeat(minNextPitch - np.cumsum(nNext) + nNext, nNext) + np.arange(np.sum(nNext))
+
+        # weight vector, triangle, maximum is at iPitch
+        theoreticalMinNextPitch = iPitch - halfWidth
+        weights = np.where(i <= iPitch, i-theoreticalMinNextPitch+1,
+                           iPitch-theoreticalMinNextPitch+1-(i-iPitch)).astype(np.float64)
+        weightSum = np.bincount(iPitch, weights)[iPitch]
+        weights = weights / weightSum
+
+        # per pair of pitches: voiced to voiced, voiced to non voiced,
+        # non voiced to non voiced, non voiced to voiced
+        self.fromIndex = np.column_stack((iPitch, iPitch, iPitch+self.m_nPitch, iPitch+self.m_nPitch)) \
+            .ravel().astype(np.uint64)
+        self.toIndex = np.column_stack((i, i+self.m_nPitch, i+self.m_nPitch, i)).ravel().astype(np.uint64)
+        self.transProb = np.column_stack((weights * self.m_selfTrans, weights * (1-self.m_selfTrans),
+                                          weights * self.m_selfTrans, weights * (1-self.m_selfTrans))).ravel()
+
+    def buildTransitionIndex(self):
+
+        # the transitions of build() are a band of m_transitionWidth pitches around the source pitch,
+        # repeated for the four voiced/unvoiced combinations. bandProb[k, b, j] is the probability of
+        # the transition into state j from pitch (j % m_nPitch) + k - halfWidth of block b (0 voiced, 1 unvoiced)
+        if self.transitionIndexSource is not None \
+                and self.transitionIndexSource[0] is self.fromIndex \
+                and self.transitionIndexSource[1] is self.toIndex \
+                and self.transitionIndexSource[2] is self.transProb:
+            return
+
+        nPitch = self.m_nPitch
+        halfWidth = int(self.m_transitionWidth/2)
+        nOffset = 2*halfWidth + 1
+
+        fromState = self.fromIndex.astype(np.intp)
+        toState = self.toIndex.astype(np.intp)
+        offset = fromState % nPitch - toState % nPitch + halfWidth
+
+        isBanded = len(toState) > 0 and np.all((offset >= 0) & (offset < nOffset)) and np.all(toState < 2*nPitch)
+        if isBanded:
+            self.bandProb = np.zeros((nOffset, 2, 2*nPitch), dtype=np.float64)
+            self.bandProb[offset, fromState // nPitch, toState] = self.transProb
+            isBanded = np.count_nonzero(self.bandProb) == np.count_nonzero(self.transProb)
+
+        if not isBanded:
+            # not the structure of build(), use the general sparse decoder
+            self.bandProb = None
+            SparseHMM.buildTransitionIndex(self)
+            return
+
+        # buffers made per float type by getBandBuffers
+        self.bandBuffers = {}
+        self.transitionTables = {}
+
+        # source state of every row of the candidates, rows are in the order of the transition list:
+        # ascending source pitch, voiced before unvoiced, so argmax breaks ties like the sparse loop
+        bandRow = np.arange(2*nOffset)[:, np.newaxis]
+        bandPitch = np.arange(2*nPitch)[np.newaxis, :] % nPitch
+        self.bandSource = (bandRow % 2) * nPitch + bandPitch + bandRow // 2 - halfWidth
+
+        self.transitionIndexSource = (self.fromIndex, self.toIndex, self.transProb)
+
+    def getBandBuffers(self, dtype):
+
+        # oldDelta of both blocks with halfWidth zeros on either side, a sliding window over it:
+        # window[b, k, j] is the old delta of pitch j + k - halfWidth in block b,
+        # and the candidate values of forwardStep
+        key = np.dtype(dtype).str
+        if key not in self.bandBuffers:
+            nOffset = self.bandProb.shape[0]
+            halfWidth = nOffset // 2
+            padded = np.zeros((2, self.m_nPitch + 2*halfWidth), dtype=dtype)
+            itemSize = padded.strides[1]
+            window = np.lib.stride_tricks.as_strided(padded, shape=(2, nOffset, self.m_nPitch),
+                                                     strides=(padded.strides[0], itemSize, itemSize))
+            value = np.zeros((nOffset, 2, 2, self.m_nPitch), dtype=dtype)
+            self.bandBuffers[key] = (padded, window, value)
+        return self.bandBuffers[key]
+
+    def forwardStep(self, oldDelta, delta, psiRow, logDomain = False):
+
+        # weighted max-convolution over the band, O(states x width)
+        # (max-plus convolution with log probabilities in the log domain)
+        if self.bandProb is None:
+            return SparseHMM.forwardStep(self, oldDelta, delta, psiRow, logDomain)
+
+        nPitch = self.m_nPitch
+        nOffset = self.bandProb.shape[0]
+        halfWidth = nOffset // 2
+
+        bandProb = self.getTransitionTable('band', self.bandProb, logDomain, oldDelta.dtype)
+        padded, window, value = self.getBandBuffers(oldDelta.dtype)
+
+        # the zero padding only meets zero probabilities (-inf in the log domain)
+        padded[:, halfWidth:halfWidth+nPitch] = oldDelta.reshape((2, nPitch))
+        combine = np.add if logDomain else np.multiply
+        combine(window.transpose(1, 0, 2)[:, :, np.newaxis, :], bandProb.reshape((nOffset, 2, 2, nPitch)), out=value)
+        value = value.reshape((2*nOffset, 2*nPitch))
+
+        bestRow = np.argmax(value, axis=0)
+        delta[:] = value[bestRow, np.arange(2*nPitch)]
+        psiRow[:] = np.where(delta > (-np.inf if logDomain else 0), self.bandSource[bestRow, np.arange(2*nPitch)], 0)
\ No newline at end of file
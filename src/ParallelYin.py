@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+'''
+ * Copyright (C) 2015  Music Technology Group - Universitat Pompeu Fabra
+ *
+ * This file is part of pypYIN
+ *
+ * pypYIN is free software: you can redistribute it and/or modify it under
+ * the terms of the GNU Affero General Public License as published by the Free
+ * Software Foundation (FSF), either version 3 of the License, or (at your
+ * option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but WITHOUT
+ * ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+ * FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+ * details.
+ *
+ * You should have received a copy of the Affero GNU General Public License
+ * version 3 along with this program.  If not, see http://www.gnu.org/licenses/
+ *
+ * If you have any problem about this python version code, please contact: Rong Gong
+ * rong.gong@upf.edu
+ *
+ * If you have any problem about this algorithm, I suggest you to contact: Matthias Mauch
+ * m.mauch@qmul.ac.uk who is the original C++ version author of this algorithm
+ *
+ * If you want to refer this code, please consider this article:
+ *
+ * M. Mauch and S. Dixon,
+ * “pYIN: A Fundamental Frequency Estimator Using Probabilistic Threshold Distributions”,
+ * in Proceedings of the IEEE International Conference on Acoustics,
+ * Speech, and Signal Processing (ICASSP 2014), 2014.
+ *
+ * M. Mauch, C. Cannam, R. Bittner, G. Fazekas, J. Salamon, J. Dai, J. Bello and S. Dixon,
+ * “Computer-aided Melody Note Transcription Using the Tony Software: Accuracy and Efficiency”,
+ * in Proceedings of the First International Conference on Technologies for
+ * Music Notation and Representation, 2015.
+'''
+
+import ctypes
+import collections
+import multiprocessing
+import multiprocessing.sharedctypes
+import numpy as np
+from Yin import Yin
+from YinUtil import frameSignal
+
+# state of a worker process, see initWorker
+workerYin = None
+workerShared = None
+
+def sharedArray(shape, dtype):
+
+    # numpy array in shared memory, inherited by the worker processes of a pool
+    nByte = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    raw = multiprocessing.sharedctypes.RawArray(ctypes.c_char, max(nByte, 1))
+    return np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+def initWorker(yin, shared):
+
+    global workerYin, workerShared
+    workerYin = yin
+    workerShared = shared
+
+def analyseChunk(iChunk):
+
+    # yin analysis of the frames of chunk iChunk, read from the shared padded audio. Returns rms,
+    # frameEnergy, freqProb and frameOffsets of the chunk, and the lag of every candidate if the salience
+    # is wanted: the salience is nonzero at the candidates only, and is rebuilt from those by chunkOutput
+    shared = workerShared
+    frameStart = shared['chunkStart'][iChunk]
+    frameEnd = shared['chunkStart'][iChunk+1]
+    stepSize = shared['stepSize']
+    blockSize = shared['blockSize']
+
+    # the chunk overlaps the next one by blockSize - stepSize samples
+    chunk = shared['audio'][frameStart*stepSize:(frameEnd-1)*stepSize+blockSize]
+    frames = frameSignal(chunk, blockSize, stepSize, startFromZero=True)
+
+    outputs = []
+    for iStart in range(0, len(frames), shared['batchSize']):
+        yos = workerYin.processProbabilisticYinFrames(frames[iStart:iStart+shared['batchSize']])
+        lags = np.nonzero(yos.salience)[1].astype(np.int32) if shared['salience'] else None
+        outputs.append((yos.rms, yos.frameEnergy, yos.freqProb, np.diff(yos.frameOffsets), lags))
+
+    rms, frameEnergy, freqProb, nCandidate, lags = zip(*outputs)
+    frameOffsets = np.zeros((frameEnd-frameStart+1,), dtype=np.intp)
+    np.cumsum(np.concatenate(nCandidate), out=frameOffsets[1:])
+    return (np.concatenate(rms), np.concatenate(frameEnergy), np.concatenate(freqProb), frameOffsets,
+            np.concatenate(lags) if shared['salience'] else None)
+
+def chunkOutput(result, nLag):
+
+    # the Yin.YinFramesOutput of an analyseChunk result, with the dense salience of its frames
+    rms, frameEnergy, freqProb, frameOffsets, lags = result
+    salience = None
+    if lags is not None:
+        salience = np.zeros((len(rms), nLag), dtype=np.float64)
+        salience[np.repeat(np.arange(len(rms)), np.diff(frameOffsets)), lags] = freqProb[:, 1]
+    return Yin.YinFramesOutput(rms, salience, freqProb, frameOffsets, frameEnergy)
+
+def analyseSignal(yin, audio, blockSize, stepSize, jobs = None, chunkSize = None, batchSize = 256,
+                  salience = True, maxChunkSize = 2048):
+
+    # yin analysis of the frames of frameSignal(audio, blockSize, stepSize) on a pool of jobs processes,
+    # chunkSize frames (a multiple of batchSize, default at most maxChunkSize) per task. Yields one
+    # Yin.YinFramesOutput per chunk, in frame order, each frame exactly as yin.processProbabilisticYinFrames
+    # gives it (salience None if salience is False). Only the audio is shared with the workers; the results
+    # come back per chunk, and at most 2*jobs chunks are in flight, so the memory taken by the results
+    # does not grow with the length of the signal
+    audio = np.asarray(audio)
+    if audio.dtype != np.float32 and audio.dtype != np.float64:
+        audio = audio.astype(np.float64)
+    nFrame = (len(audio) + stepSize - 1) // stepSize
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if chunkSize is None:
+        chunkSize = min((nFrame + 4*jobs - 1) // (4*jobs), maxChunkSize)  # a few chunks per process to balance the load
+    chunkSize = max(1, (chunkSize + batchSize - 1) // batchSize) * batchSize
+    chunkStart = np.append(np.arange(0, nFrame, chunkSize), nFrame)
+    nChunk = len(chunkStart) - 1
+    if nChunk == 0:
+        return
+
+    # the audio zero padded like frameSignal, in shared memory
+    shared = dict(stepSize=stepSize, blockSize=blockSize, batchSize=batchSize, chunkStart=chunkStart,
+                  salience=salience)
+    shared['audio'] = sharedArray((len(audio) + 2*blockSize,), audio.dtype)
+    shared['audio'][:] = 0.0
+    shared['audio'][blockSize//2:blockSize//2+len(audio)] = audio
+
+    pool = multiprocessing.Pool(jobs, initWorker, (yin, shared))
+    try:
+        pending = collections.deque()
+        for iChunk in range(nChunk):
+            pending.append(pool.apply_async(analyseChunk, (iChunk,)))
+            if len(pending) >= 2*jobs:
+                yield chunkOutput(pending.popleft().get(), yin.m_yinBufferSize)
+        while pending:
+            yield chunkOutput(pending.popleft().get(), yin.m_yinBufferSize)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
\ No newline at end of file
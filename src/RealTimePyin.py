@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+'''
+ * Copyright (C) 2015  Music Technology Group - Universitat Pompeu Fabra
+ *
+ * This file is part of pypYIN
+ *
+ * pypYIN is free software: you can redistribute it and/or modify it under
+ * the terms of the GNU Affero General Public License as published by the Free
+ * Software Foundation (FSF), either version 3 of the License, or (at your
+ * option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but WITHOUT
+ * ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+ * FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+ * details.
+ *
+ * You should have received a copy of the Affero GNU General Public License
+ * version 3 along with this program.  If not, see http://www.gnu.org/licenses/
+ *
+ * If you have any problem about this python version code, please contact: Rong Gong
+ * rong.gong@upf.edu
+ *
+ * If you have any problem about this algorithm, I suggest you to contact: Matthias Mauch
+ * m.mauch@qmul.ac.uk who is the original C++ version author of this algorithm
+ *
+ * If you want to refer this code, please consider this article:
+ *
+ * M. Mauch and S. Dixon,
+ * “pYIN: A Fundamental Frequency Estimator Using Probabilistic Threshold Distributions”,
+ * in Proceedings of the IEEE International Conference on Acoustics,
+ * Speech, and Signal Processing (ICASSP 2014), 2014.
+ *
+ * M. Mauch, C. Cannam, R. Bittner, G. Fazekas, J. Salamon, J. Dai, J. Bello and S. Dixon,
+ * “Computer-aided Melody Note Transcription Using the Tony Software: Accuracy and Efficiency”,
+ * in Proceedings of the First International Conference on Technologies for
+ * Music Notation and Representation, 2015.
+'''
+
+import numpy as np
+from math import sqrt
+from timeit import default_timer
+from MonoPitch import MonoPitch
+from pYINmain import GrowingArray
+
+class RealTimePyin(object):
+
+    # real-time analysis of a stream of sample blocks of any size, with the parameters of an initialised
+    # PyinMain. The frames are those of processSignal (frame i is centred on sample i*stepSize, so it is complete
+    # blockSize/2 samples later, algorithmicLatency seconds). push() analyses every frame the block completes and
+    # gives for each one the best Yin candidate (highest probability, 0 if none) and a provisional smoothed pitch,
+    # the MonoPitch frequency of the currently most likely state (negative if unvoiced). The smoothed pitch decided
+    # by the online Viterbi decoding, at most maxLag frames late (see SparseHMM.OnlineViterbi), is collected in
+    # smoothedPitch.values. The sample ring buffer, the Yin workspace and the per hop outputs are allocated once
+    # (the outputs grow if a block completes more than maxHops frames), but a hop is not allocation free: the Yin
+    # candidates, the observation probabilities and the online Viterbi step still make numpy temporaries every
+    # hop, so its worst case time is well above the mean. hopTime has the seconds each hop took, overBudget counts
+    # the hops that took longer than hopBudget seconds. The samples are kept as dtype, that of the stream for the
+    # same low amplitude gate as processSignal
+    def __init__(self, pyin, maxLag = 32, maxHops = 64, hopBudget = None, dtype = np.float32):
+        self.pyin = pyin
+        self.blockSize = pyin.m_blockSize
+        self.stepSize = pyin.m_stepSize
+        self.algorithmicLatency = (self.blockSize - self.blockSize//2) * 1.0 / pyin.m_inputSampleRate
+
+        # ring buffer of the last blockSize samples, stored twice so that every frame is a contiguous view
+        self.buffer = np.zeros((2*self.blockSize,), dtype=dtype)
+        self.zeros = np.zeros((self.blockSize,), dtype=dtype)
+        self.nBuffered = self.blockSize//2  # samples written, the zero padding before the first frame included
+        self.nFrame = 0
+
+        self.monoPitch = MonoPitch()
+        self.monoPitch.initialiseOnline(maxLag)
+        self.smoothedPitch = GrowingArray()
+
+        self.rawPitch = np.zeros((maxHops,), dtype=np.float64)
+        self.provisionalPitch = np.zeros((maxHops,), dtype=np.float64)
+        self.level = np.zeros((maxHops,), dtype=np.float64)
+        self.hopTime = np.zeros((maxHops,), dtype=np.float64)
+
+        self.hopBudget = hopBudget
+        self.overBudget = 0
+        self.maxHopTime = 0.0
+        self.totalHopTime = 0.0
+
+    def push(self, samples):
+
+        # returns the raw and the provisional pitch of the frames completed by samples, views of the
+        # output buffers valid until the next call (level and hopTime hold the same frames)
+        samples = np.asarray(samples)
+        nHop = max(0, (self.nBuffered + len(samples) - self.blockSize) // self.stepSize + 1 - self.nFrame)
+        if nHop > len(self.rawPitch):
+            self.growOutputs(nHop)
+
+        iHop = 0
+        iSample = 0
+        while iSample < len(samples):
+            # up to the last sample of the next frame
+            nWrite = min(self.nFrame*self.stepSize + self.blockSize - self.nBuffered, len(samples) - iSample)
+            self.write(samples[iSample:iSample+nWrite])
+            iSample += nWrite
+            if self.nBuffered == self.nFrame*self.stepSize + self.blockSize:
+                self.analyseFrame(iHop)
+                iHop += 1
+
+        return self.rawPitch[:iHop], self.provisionalPitch[:iHop]
+
+    def finalise(self):
+
+        # end of the stream: the frames that go past the last sample (zero padded, like processSignal) and
+        # the smoothed pitch of all the frames not decided yet. Returns push()'s output for those frames
+        nSample = self.nBuffered - self.blockSize//2
+        nFrameTotal = (nSample + self.stepSize - 1) // self.stepSize
+        nHop = max(0, nFrameTotal - self.nFrame)
+        if nHop > len(self.rawPitch):
+            self.growOutputs(nHop)
+
+        for iHop in range(nHop):
+            nWrite = self.nFrame*self.stepSize + self.blockSize - self.nBuffered
+            while nWrite > 0:
+                self.write(self.zeros[:min(nWrite, self.blockSize)])
+                nWrite -= min(nWrite, self.blockSize)
+            self.analyseFrame(iHop)
+
+        self.smoothedPitch.extend(self.monoPitch.finaliseOnline())
+        return self.rawPitch[:nHop], self.provisionalPitch[:nHop]
+
+    def write(self, samples):
+
+        # samples into the ring buffer and its copy, only the last blockSize of them are kept
+        blockSize = self.blockSize
+        nSample = len(samples)
+        if nSample > blockSize:
+            self.nBuffered += nSample - blockSize
+            samples = samples[nSample-blockSize:]
+            nSample = blockSize
+        start = self.nBuffered % blockSize
+        nFirst = min(nSample, blockSize - start)
+        self.buffer[start:start+nFirst] = samples[:nFirst]
+        self.buffer[blockSize+start:blockSize+start+nFirst] = samples[:nFirst]
+        self.buffer[:nSample-nFirst] = samples[nFirst:]
+        self.buffer[blockSize:blockSize+nSample-nFirst] = samples[nFirst:]
+        self.nBuffered += nSample
+
+    def analyseFrame(self, iHop):
+
+        startTime = default_timer()
+
+        start = (self.nFrame*self.stepSize) % self.blockSize
+        yo = self.pyin.m_yin.processProbabilisticYin(self.buffer[start:start+self.blockSize])
+        rms = sqrt(yo.frameEnergy/self.blockSize)
+        freqProb = np.reshape(yo.freqProb, (-1, 2))
+
+        self.rawPitch[iHop] = freqProb[np.argmax(freqProb[:, 1]), 0] if len(freqProb) > 0 else 0.0
+        self.level[iHop] = yo.rms
+        self.smoothedPitch.extend(self.monoPitch.processOnline(self.pyin.framePitchProb(freqProb, rms)))
+        self.provisionalPitch[iHop] = self.monoPitch.provisionalOnline()
+        self.nFrame += 1
+
+        hopTime = default_timer() - startTime
+        self.hopTime[iHop] = hopTime
+        self.maxHopTime = max(self.maxHopTime, hopTime)
+        self.totalHopTime += hopTime
+        if self.hopBudget is not None and hopTime > self.hopBudget:
+            self.overBudget += 1
+
+    def growOutputs(self, nHop):
+        self.rawPitch = np.zeros((nHop,), dtype=np.float64)
+        self.provisionalPitch = np.zeros((nHop,), dtype=np.float64)
+        self.level = np.zeros((nHop,), dtype=np.float64)
+        self.hopTime = np.zeros((nHop,), dtype=np.float64)
+
+    def meanHopTime(self):
+        return self.totalHopTime / self.nFrame if self.nFrame > 0 else 0.0
\ No newline at end of file
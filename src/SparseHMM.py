@@ -38,8 +38,91 @@
 '''
 
 import numpy as np
+import os
+import hashlib
+import tempfile
+import multiprocessing
 from math import *
 
+# built model tables by model class and parameters, shared by all the models built
+# with the same parameters (see SparseHMM.buildCached), and the directory of the
+# optional on-disk cache of .npz files
+modelCache = {}
+modelCacheDir = None
+
+def setModelCacheDir(cacheDir):
+    # None disables the on-disk cache
+    global modelCacheDir
+    if cacheDir is not None and not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+    modelCacheDir = cacheDir
+
+def anchorSegmentStarts(isAnchor, nSegment, minLength = 1):
+
+    # start frames of up to nSegment segments of about the same length for decodeViterbiSegments,
+    # each one in the middle of a run of anchor frames (isAnchor True), at least minLength frames apart
+    isAnchor = np.asarray(isAnchor, dtype=bool)
+    nFrame = len(isAnchor)
+    edge = np.diff(np.concatenate(([0], isAnchor.astype(np.int8), [0])))
+    runMiddle = (np.nonzero(edge == 1)[0] + np.nonzero(edge == -1)[0] - 1) // 2
+    starts = []
+    for target in np.arange(1, nSegment) * nFrame // max(nSegment, 1):
+        if len(runMiddle) == 0:
+            break
+        start = runMiddle[np.argmin(np.abs(runMiddle - target))]
+        if start - (starts[-1] if starts else 0) >= minLength and nFrame - start >= minLength:
+            starts.append(start)
+    return starts
+
+# state of a worker process of decodeViterbiSegments, see initSegmentWorker
+segmentWorkerState = None
+
+def initSegmentWorker(hmm, obsProb, headFrames):
+
+    global segmentWorkerState
+    segmentWorkerState = (hmm, obsProb, headFrames)
+
+def decodeSegment(segment):
+
+    # forward pass over frames start..end-1 of the worker's observations, from the initial probabilities.
+    # Returns the normalised deltas of the first headFrames frames and of the last one, and the back
+    # pointers in a compact form: the paths from all the states of the last frame meet in one state of
+    # frame m-1, meetPath holds the states of frames 0..m-1 they share, tailPsi the psi rows of frames m..
+    # (m = 0 if they never meet)
+    hmm, obsProb, headFrames = segmentWorkerState
+    start, end = segment
+    nState = len(hmm.init)
+    nFrame = end - start
+
+    psi = np.zeros((nFrame, nState), dtype=np.min_scalar_type(max(nState-1, 0)))
+    headDelta = np.zeros((min(headFrames, nFrame), nState), dtype=np.float64)
+    delta = np.zeros((nState,), dtype=np.float64)
+
+    oldDelta = hmm.multiplyObs(hmm.init.copy(), obsProb, start)
+    deltasum = np.cumsum(oldDelta)[nState-1]
+    if deltasum > 0:
+        oldDelta /= deltasum
+    else:
+        oldDelta[:] = 1.0/nState
+    headDelta[0] = oldDelta
+
+    for iFrame in range(1, nFrame):
+        hmm.forwardFrame(oldDelta, delta, psi[iFrame], obsProb, start+iFrame)
+        if iFrame < len(headDelta):
+            headDelta[iFrame] = oldDelta
+
+    states = np.arange(nState)
+    for iFrame in reversed(range(1, nFrame)):
+        states = psi[iFrame][states]
+        if np.all(states == states[0]):
+            meetPath = np.zeros((iFrame,), dtype=np.int)
+            meetPath[iFrame-1] = states[0]
+            for jFrame in reversed(range(iFrame-1)):
+                meetPath[jFrame] = psi[jFrame+1][meetPath[jFrame+1]]
+            return headDelta, oldDelta, meetPath, psi[iFrame:].copy()
+
+    return headDelta, oldDelta, np.zeros((0,), dtype=np.int), psi
+
 class SparseHMM(object):
 
     def __init__(self):
@@ -48,13 +131,192 @@ class SparseHMM(object):
         self.fromIndex = np.array([], dtype=np.uint64)
         self.toIndex = np.array([],dtype=np.uint64)
 
+        # transitions grouped by destination state, see buildTransitionIndex,
+        # subclasses with a more regular structure can override it together with forwardStep
+        self.transitionIndexSource = None
+        self.sortedFromIndex = np.array([], dtype=np.intp)
+        self.sortedTransProb = np.array([], dtype=np.float64)
+        self.destStart = np.array([], dtype=np.intp)
+        self.destOfTrans = np.array([], dtype=np.intp)
+        self.reachedStates = np.array([], dtype=np.intp)
+        self.transitionTables = {}
+
     def calculatedObsProb(self, data):
         # to be overloaded
         return data
 
-    def decodeViterbi(self, obsProb):
+    def build(self):
+        # to be overloaded, sets the tables of modelTables()
+        pass
+
+    def modelKey(self):
+        # to be overloaded: the parameters the tables of build() depend on, None to always build
+        return None
+
+    def modelTables(self):
+        return ['init', 'fromIndex', 'toIndex', 'transProb']
+
+    def buildCached(self):
+
+        # build() through the model cache. The cached tables are shared between the models, read only
+        modelKey = self.modelKey()
+        if modelKey is None:
+            self.build()
+            return
+
+        key = (self.__class__.__name__,) + tuple(modelKey)
+        if key not in modelCache:
+            tables = None
+            if modelCacheDir is not None:
+                fileName = os.path.join(modelCacheDir, self.__class__.__name__ + '_'
+                                        + hashlib.md5(repr(key).encode('utf-8')).hexdigest() + '.npz')
+                tables = self.loadModelTables(fileName)
+            if tables is None:
+                self.build()
+                tables = dict((name, getattr(self, name)) for name in self.modelTables())
+                if modelCacheDir is not None:
+                    self.saveModelTables(fileName, tables)
+            for table in tables.values():
+                table.flags.writeable = False
+            modelCache[key] = tables
+
+        for name, table in modelCache[key].items():
+            setattr(self, name, table)
+
+    def loadModelTables(self, fileName):
+
+        # tables of an .npz file written by saveModelTables, None if it is missing or unreadable
+        if not os.path.isfile(fileName):
+            return None
+        try:
+            npz = np.load(fileName)
+            tables = dict((name, npz[name]) for name in self.modelTables())
+            npz.close()
+        except (IOError, KeyError, ValueError):
+            return None
+        return tables
+
+    def saveModelTables(self, fileName, tables):
+
+        # written to a temporary file and renamed, so that other processes never read half a file
+        try:
+            fd, tempName = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(fileName))
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **tables)
+            os.rename(tempName, fileName)
+        except (IOError, OSError):
+            print "WARNING: could not write the model cache file " + fileName
+
+    def buildTransitionIndex(self):
+
+        # CSR layout of the transitions: the transitions into state reachedStates[i] are
+        # sortedFromIndex[destStart[i]:destStart[i+1]], kept in their original order so that
+        # ties are broken like in the sequential loop (first transition wins)
+        if self.transitionIndexSource is not None \
+                and self.transitionIndexSource[0] is self.fromIndex \
+                and self.transitionIndexSource[1] is self.toIndex \
+                and self.transitionIndexSource[2] is self.transProb:
+            return
+
+        order = np.argsort(self.toIndex, kind='mergesort')
+        sortedToIndex = self.toIndex[order].astype(np.intp)
+        self.sortedFromIndex = self.fromIndex[order].astype(np.intp)
+        self.sortedTransProb = self.transProb[order].astype(np.float64)
+
+        isFirst = np.ones((len(order),), dtype=bool)
+        isFirst[1:] = sortedToIndex[1:] != sortedToIndex[:-1]
+        self.destStart = np.append(np.nonzero(isFirst)[0], len(order)).astype(np.intp)
+        self.reachedStates = sortedToIndex[isFirst]
+        self.destOfTrans = np.cumsum(isFirst) - 1
+        self.transitionTables = {}
+
+        self.transitionIndexSource = (self.fromIndex, self.toIndex, self.transProb)
+
+    def getTransitionTable(self, name, transProb, logDomain, dtype):
+
+        # transProb in the float type of the decoder, as log probabilities for the log domain,
+        # converted once per transition index
+        if not logDomain and np.dtype(dtype) == transProb.dtype:
+            return transProb
+        key = (name, logDomain, np.dtype(dtype).str)
+        if key not in self.transitionTables:
+            if logDomain:
+                with np.errstate(divide='ignore'):
+                    self.transitionTables[key] = np.log(transProb).astype(dtype)
+            else:
+                self.transitionTables[key] = transProb.astype(dtype)
+        return self.transitionTables[key]
+
+    def forwardStep(self, oldDelta, delta, psiRow, logDomain = False):
 
-        if len(obsProb) < 1: return np.array([], dtype=np.int)
+        # this is the "sparse" step: delta[j] is the max over the transitions i -> j of
+        # oldDelta[i] * transProb (oldDelta[i] + log(transProb) in the log domain), psiRow[j] the i of
+        # the first transition reaching it (rabiner 33b); both stay 0 (delta -inf in the log domain)
+        # if no transition into j has a positive probability
+        transProb = self.getTransitionTable('sparse', self.sortedTransProb, logDomain, oldDelta.dtype)
+        if logDomain:
+            currentValue = oldDelta[self.sortedFromIndex] + transProb
+            noValue = -np.inf
+        else:
+            currentValue = oldDelta[self.sortedFromIndex] * transProb
+            noValue = 0
+        bestValue = np.maximum.reduceat(currentValue, self.destStart[:-1])
+
+        nTrans = len(currentValue)
+        isBest = currentValue == bestValue[self.destOfTrans]
+        bestTrans = np.minimum.reduceat(np.where(isBest, np.arange(nTrans), nTrans), self.destStart[:-1])
+
+        isPositive = bestValue > noValue
+        delta[:] = noValue
+        delta[self.reachedStates[isPositive]] = bestValue[isPositive]
+        psiRow[:] = 0
+        psiRow[self.reachedStates[isPositive]] = self.sortedFromIndex[bestTrans[isPositive]]
+
+    def forwardFrame(self, oldDelta, delta, psiRow, obsProb, iFrame):
+
+        # one frame of the forward pass of decodeViterbi, oldDelta becomes the normalised delta of iFrame
+        self.forwardStep(oldDelta, delta, psiRow)
+        self.multiplyObs(delta, obsProb, iFrame)
+        deltasum = np.cumsum(delta)[len(delta)-1]
+
+        if deltasum > 0:
+            np.divide(delta, deltasum, out=oldDelta)
+        else:
+            print "WARNING: Viterbi has been fed some zero probabilities, at least they become zero at frame " +  str(iFrame) + " in combination with the model."
+            oldDelta[:] = 1.0/len(delta)
+
+    def obsClassStates(self):
+        # to be overloaded: groups of states (slices) whose observation probabilities are often
+        # the same within a frame, the background classes of SparseObsProb
+        return [slice(0, len(self.init))]
+
+    def multiplyObs(self, delta, obsProb, iFrame, logDomain = False):
+
+        # delta *= the observation probabilities of frame iFrame (+= their logs in the log domain),
+        # obsProb is a sequence of frames or a SparseObsProb; returns delta
+        if isinstance(obsProb, SparseObsProb):
+            obsProb.multiplyFrame(delta, iFrame, logDomain)
+        elif logDomain:
+            with np.errstate(divide='ignore'):
+                delta += np.log(obsProb[iFrame][:len(delta)])
+        else:
+            delta *= obsProb[iFrame][:len(delta)]
+        return delta
+
+    def decodeViterbi(self, obsProb, storeScale = True, logDomain = False, dtype = np.float64):
+
+        # returns the most likely state path and the scale (1/sum of delta) of every frame,
+        # scale is None if storeScale is False
+        # logDomain: delta holds log probabilities, see decodeViterbiLog
+        # dtype: float type of delta and of the transitions; the observations are best made in it too
+        # (calculatedSparseObsProb(..., dtype)), others are cast as they are read
+        # (linear float32 deltas underflow much sooner than float64, it is meant for the log domain)
+        if len(obsProb) < 1: return np.array([], dtype=np.int), np.array([], dtype=np.float64) if storeScale else None
+
+        if logDomain:
+            return self.decodeViterbiLog(obsProb, storeScale, dtype)
+
+        self.buildTransitionIndex()
 
         nState = len(self.init)
         nFrame = len(obsProb)
@@ -63,67 +325,475 @@ class SparseHMM(object):
         nTrans = len(self.transProb)
 
         # declaring variables
-        scale = np.array([], dtype=np.float64)
-        delta = np.zeros((nState,), dtype=np.float64)
-        oldDelta = np.zeros((nState,), dtype=np.float64)
+        scale = np.zeros((nFrame,), dtype=np.float64) if storeScale else None
+        delta = np.zeros((nState,), dtype=dtype)
+        oldDelta = np.zeros((nState,), dtype=dtype)
         path = np.ones(nFrame, dtype=np.int) * (nState-1)  # the final output path
 
-        deltasum = 0
+        # matrix of remembered indices of the best transitions, in the smallest type that holds a state index
+        psi = np.zeros((nFrame, nState), dtype=np.min_scalar_type(max(nState-1, 0)))
 
         # initialise first frame in time 1, rabiner 32a
-        for iState in range(nState):
-            oldDelta[iState] = self.init[iState] * obsProb[0][iState]
-            deltasum += oldDelta[iState]
+        # deltasum is summed sequentially (cumsum) to round exactly like a scalar loop
+        # obsProb frames may be longer than nState, the extra values are ignored
+        oldDelta[:] = self.multiplyObs(self.init.copy(), obsProb, 0)
+        deltasum = np.cumsum(oldDelta)[nState-1]
 
-        for iState in range(nState):
-            oldDelta[iState] /= deltasum  # normalise (scale)
+        oldDelta /= deltasum  # normalise (scale)
 
-        scale = np.append(scale, np.double(1.0/deltasum))
-        psi = [np.zeros(nState, dtype=np.int),]  # matrix of remembered indices of the best transitions
+        if storeScale: scale[0] = 1.0/deltasum
 
         # rest of forward step
         for iFrame in range(1, nFrame):
-            deltasum = 0
-            psi = psi + [np.zeros(nState, dtype=np.int)]
 
             # calculate best previous state for every current state
+            self.forwardStep(oldDelta, delta, psi[iFrame])
 
-            # this is the "sparse" loop
-            for iTrans in range(nTrans):
-                fromState = self.fromIndex[iTrans]
-                toState = self.toIndex[iTrans]
-                currentTransProb = self.transProb[iTrans]
-
-                currentValue = oldDelta[fromState] * currentTransProb
-                if (currentValue > delta[toState]):  # to find the maximum
-                    delta[toState] = currentValue  # just change the toState delta, will be multiplied by the right obs later!
-                    psi[iFrame][toState] = fromState # rabiner 33b
-
-            for jState in range(nState):
-                delta[jState] *= obsProb[iFrame][jState]
-                deltasum += delta[jState]
+            # delta will be multiplied by the right obs now
+            self.multiplyObs(delta, obsProb, iFrame)
+            deltasum = np.cumsum(delta)[nState-1]
 
             if deltasum > 0:
-                for iState in range(nState):
-                    oldDelta[iState] = delta[iState] / deltasum  # normalise (scale)
-                    delta[iState] = 0
-                scale = np.append(scale, np.double(1.0/deltasum))
+                np.divide(delta, deltasum, out=oldDelta)  # normalise (scale)
+                if storeScale: scale[iFrame] = 1.0/deltasum
             else:
                 print "WARNING: Viterbi has been fed some zero probabilities, at least they become zero at frame " +  str(iFrame) + " in combination with the model."
-                for iState in range(nState):
-                    oldDelta[iState] = 1.0/nState
-                    delta[iState] = 0
-                scale = np.append(scale, np.double(1.0/deltasum))
+                oldDelta[:] = 1.0/nState
+                if storeScale:
+                    with np.errstate(divide='ignore'):
+                        scale[iFrame] = 1.0/deltasum
 
         # initialise backward step
-        bestValue = 0
-        for iState in range(nState):
-            currentValue = oldDelta[iState]  # use directly the normalised delta
-            if currentValue > bestValue:
-                bestValue = currentValue #  rabiner 34b
-                path[nFrame-1] = iState #  path of last frame
+        # use directly the normalised delta, rabiner 34b
+        if np.max(oldDelta) > 0:
+            path[nFrame-1] = np.argmax(oldDelta) #  path of last frame
 
         for iFrame in reversed(range(nFrame-1)):
             path[iFrame] = psi[iFrame+1][path[iFrame+1]]
 
-        return path, scale
\ No newline at end of file
+        return path, scale
+
+    def decodeViterbiLog(self, obsProb, storeScale = True, dtype = np.float64):
+
+        # decodeViterbi with log probabilities: the products become sums, and as nothing underflows
+        # no scaling is needed. float32 deltas are shifted by their maximum every frame to keep their
+        # precision. scale is the same as in the linear domain, but costs a log-sum-exp per frame.
+        # The path is as likely as the linear one, but not interchangeable with it: where paths are
+        # equally likely, the rounding of the sums can break the tie otherwise
+        if len(obsProb) < 1: return np.array([], dtype=np.int), np.array([], dtype=np.float64) if storeScale else None
+
+        self.buildTransitionIndex()
+
+        nState = len(self.init)
+        nFrame = len(obsProb)
+        isShifted = np.dtype(dtype) != np.float64
+
+        scale = np.zeros((nFrame,), dtype=np.float64) if storeScale else None
+        delta = np.zeros((nState,), dtype=dtype)
+        oldDelta = np.zeros((nState,), dtype=dtype)
+        path = np.ones(nFrame, dtype=np.int) * (nState-1)  # the final output path
+
+        psi = np.zeros((nFrame, nState), dtype=np.min_scalar_type(max(nState-1, 0)))
+
+        # logSum: log of the sum of the linear deltas of the last frame, minus the shifts
+        shift = 0.0
+        logSum = 0.0
+
+        with np.errstate(divide='ignore'):
+            oldDelta[:] = self.multiplyObs(np.log(self.init), obsProb, 0, logDomain=True)
+
+        for iFrame in range(nFrame):
+            if iFrame > 0:
+                self.forwardStep(oldDelta, delta, psi[iFrame], logDomain=True)
+                self.multiplyObs(delta, obsProb, iFrame, logDomain=True)
+                oldDelta, delta = delta, oldDelta
+
+            maxDelta = np.max(oldDelta)
+            if maxDelta == -np.inf:
+                print "WARNING: Viterbi has been fed some zero probabilities, at least they become zero at frame " +  str(iFrame) + " in combination with the model."
+                oldDelta[:] = -log(nState)
+                if storeScale: scale[iFrame] = np.inf
+                shift = 0.0
+                logSum = 0.0
+                continue
+
+            if isShifted:
+                oldDelta -= maxDelta
+                shift += maxDelta
+
+            if storeScale:
+                newLogSum = log(np.sum(np.exp(oldDelta - np.max(oldDelta), dtype=np.float64))) + np.max(oldDelta) + shift
+                scale[iFrame] = exp(logSum - newLogSum)
+                logSum = newLogSum
+
+        # initialise backward step
+        if np.max(oldDelta) > -np.inf:
+            path[nFrame-1] = np.argmax(oldDelta) #  path of last frame
+
+        for iFrame in reversed(range(nFrame-1)):
+            path[iFrame] = psi[iFrame+1][path[iFrame+1]]
+
+        return path, scale
+
+    def pathLogProb(self, obsProb, path):
+
+        # log probability of the state path and the observations under the model,
+        # -inf if the path uses a transition that is not in the model
+        nState = len(self.init)
+        nFrame = len(path)
+        if nFrame < 1: return 0.0
+
+        path = np.asarray(path, dtype=np.intp)
+        transKey = self.fromIndex.astype(np.intp) * nState + self.toIndex.astype(np.intp)
+        keyOrder = np.argsort(transKey, kind='mergesort')
+        pathKey = path[:-1] * nState + path[1:]
+        keyPos = np.minimum(np.searchsorted(transKey[keyOrder], pathKey), len(keyOrder)-1)
+        isKnown = transKey[keyOrder][keyPos] == pathKey
+        transProb = np.where(isKnown, self.transProb[keyOrder][keyPos], 0)
+        if isinstance(obsProb, SparseObsProb):
+            obs = obsProb.getValues(np.arange(nFrame), path)
+        else:
+            obs = np.array([obsProb[iFrame][path[iFrame]] for iFrame in range(nFrame)], dtype=np.float64)
+
+        with np.errstate(divide='ignore'):
+            return np.log(self.init[path[0]]) + np.sum(np.log(obs)) + np.sum(np.log(transProb))
+
+    def decodeViterbiSegments(self, obsProb, segmentStarts, jobs = None, headFrames = 256, repair = True,
+                              tolerance = 0.0):
+
+        # decodeViterbi (without scale) with the segments starting at segmentStarts decoded in parallel on
+        # jobs processes (default: one per cpu), each one from the initial probabilities. The segments are
+        # then joined in order: the forward pass is run again from the true delta at the end of the previous
+        # segment until it is equal to the segment's own delta, from there on the segment's back pointers are
+        # the ones of the sequential decoding. If that does not happen within headFrames frames, the segment
+        # is decoded again sequentially (repair) or its own path is kept, which may not be the most likely
+        # one. tolerance > 0 also accepts deltas proportional within that relative tolerance: models whose
+        # states keep a long memory (like the silent states of MonoNoteHMM) often only get there, up to
+        # rounding, and the path then only differs from the exact one on near ties.
+        # Returns the path and a SegmentReport. Forks, see PyinMain.processSignalParallel
+        nState = len(self.init)
+        nFrame = len(obsProb)
+        starts = [0] + sorted(set(int(start) for start in segmentStarts if 0 < start < nFrame))
+        segments = zip(starts, starts[1:] + [nFrame])
+        if nFrame < 1:
+            return np.array([], dtype=np.int), SegmentReport([], [], [], [])
+
+        self.buildTransitionIndex()
+
+        if jobs == 1 or len(segments) == 1:
+            initSegmentWorker(self, obsProb, headFrames)
+            results = map(decodeSegment, segments)
+            initSegmentWorker(None, None, None)
+        else:
+            pool = multiprocessing.Pool(jobs, initSegmentWorker, (self, obsProb, headFrames))
+            try:
+                results = pool.map(decodeSegment, segments)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+        # forward pass over the start of every segment from the true delta: fixedPsi holds the psi rows
+        # of the frames 0..lastFixed of the segment, the later ones are the segment's own
+        delta = np.zeros((nState,), dtype=np.float64)
+        trueDelta = results[0][1]
+        fixedPsi = [None]
+        lastFixed = [0]
+        convergedAfter = []
+        proportional = []
+        repaired = []
+        for (start, end), (headDelta, finalDelta, meetPath, tailPsi) in zip(segments[1:], results[1:]):
+            oldDelta = trueDelta.copy()
+            psiRows = np.zeros((len(headDelta), nState), dtype=tailPsi.dtype)
+            converged = -1
+            isProportional = False
+            for iFrame in range(len(headDelta)):
+                self.forwardFrame(oldDelta, delta, psiRows[iFrame], obsProb, start+iFrame)
+                if np.array_equal(oldDelta, headDelta[iFrame]):
+                    converged = iFrame
+                    break
+                if tolerance > 0 and np.array_equal(oldDelta > 0, headDelta[iFrame] > 0):
+                    ratio = oldDelta[oldDelta > 0] / headDelta[iFrame][oldDelta > 0]
+                    if np.max(ratio) <= np.min(ratio) * (1 + tolerance):
+                        converged = iFrame
+                        isProportional = True
+                        break
+
+            if converged >= 0:
+                trueDelta = finalDelta
+                lastFixed.append(converged)
+            elif repair:
+                psiRows = np.concatenate((psiRows, np.zeros((end-start-len(headDelta), nState), dtype=psiRows.dtype)))
+                for iFrame in range(len(headDelta), end-start):
+                    self.forwardFrame(oldDelta, delta, psiRows[iFrame], obsProb, start+iFrame)
+                trueDelta = oldDelta
+                lastFixed.append(end-start-1)
+            else:
+                trueDelta = finalDelta
+                lastFixed.append(0)
+            fixedPsi.append(psiRows[:lastFixed[-1]+1].copy())
+            convergedAfter.append(converged)
+            proportional.append(isProportional)
+            repaired.append(converged < 0 and repair)
+
+        # backward step through the segments, from the last one
+        path = np.ones(nFrame, dtype=np.int) * (nState-1)
+        state = np.argmax(trueDelta) if np.max(trueDelta) > 0 else nState-1
+        for iSegment in reversed(range(len(segments))):
+            start, end = segments[iSegment]
+            headDelta, finalDelta, meetPath, tailPsi = results[iSegment]
+            nMeet = len(meetPath)
+            path[end-1] = state
+            for iFrame in reversed(range(1, end-start)):
+                if iFrame <= lastFixed[iSegment]:
+                    state = fixedPsi[iSegment][iFrame][state]
+                elif iFrame-1 < nMeet:
+                    state = meetPath[iFrame-1]
+                else:
+                    state = tailPsi[iFrame-nMeet][state]
+                path[start+iFrame-1] = state
+            if iSegment > 0:
+                state = fixedPsi[iSegment][0][state]
+
+        return path, SegmentReport(starts[1:], convergedAfter, proportional, repaired)
+
+    def decodeViterbiAnchored(self, obsProb, isAnchor, jobs = None, minSegmentFrames = 2000, repair = True,
+                              tolerance = 0.0):
+
+        # decodeViterbiSegments with a few segments per job, starting in runs of anchor frames
+        # (frames where the path is nearly pinned, like confident silences)
+        if jobs is None:
+            jobs = multiprocessing.cpu_count()
+        segmentStarts = anchorSegmentStarts(isAnchor, 4*jobs, minSegmentFrames)
+        return self.decodeViterbiSegments(obsProb, segmentStarts, jobs, repair=repair, tolerance=tolerance)
+
+    def onlineViterbi(self, maxLag = None):
+
+        # incremental decoder, see OnlineViterbi
+        return OnlineViterbi(self, maxLag)
+
+class SparseObsProb(object):
+
+    # observation probabilities of nFrame frames as a background value per class of states
+    # (classStates, see SparseHMM.obsClassStates) and the (index, value) pairs of the states that differ
+    # from it: state index[j] of frame i has value[j], for frameOffsets[i] <= j < frameOffsets[i+1]
+    def __init__(self, background, index, value, frameOffsets, classStates):
+        self.background = background  # nFrame x nClass
+        self.index = index
+        self.value = value
+        self.frameOffsets = frameOffsets
+        self.classStates = classStates
+
+    def __len__(self):
+        return len(self.background)
+
+    def astype(self, dtype):
+        # the observations in the float type dtype (itself if they are in it already)
+        if self.value.dtype == dtype and self.background.dtype == dtype:
+            return self
+        return SparseObsProb(self.background.astype(dtype), self.index, self.value.astype(dtype),
+                             self.frameOffsets, self.classStates)
+
+    def multiplyFrame(self, delta, iFrame, logDomain = False):
+
+        # the pairs are combined with the old delta before the backgrounds overwrite it.
+        # The backgrounds are one element arrays, not scalars, so that the product is computed in the
+        # wider type of delta and the observations, like with dense observations
+        start = self.frameOffsets[iFrame]
+        end = self.frameOffsets[iFrame+1]
+        index = self.index[start:end]
+        with np.errstate(divide='ignore'):
+            if logDomain:
+                value = delta[index] + np.log(self.value[start:end])
+                for iClass, states in enumerate(self.classStates):
+                    delta[states] += np.log(self.background[iFrame, iClass:iClass+1])
+            else:
+                value = delta[index] * self.value[start:end]
+                for iClass, states in enumerate(self.classStates):
+                    delta[states] *= self.background[iFrame, iClass:iClass+1]
+        delta[index] = value
+
+    def getFrame(self, iFrame, nState):
+        # dense observation probabilities of one frame
+        out = np.zeros((nState,), dtype=np.float64)
+        for iClass, states in enumerate(self.classStates):
+            out[states] = self.background[iFrame, iClass]
+        out[self.index[self.frameOffsets[iFrame]:self.frameOffsets[iFrame+1]]] = \
+            self.value[self.frameOffsets[iFrame]:self.frameOffsets[iFrame+1]]
+        return out
+
+    def getValues(self, iFrames, states):
+        # observation probability of states[k] in frame iFrames[k]
+        iFrames = np.asarray(iFrames, dtype=np.intp)
+        states = np.asarray(states, dtype=np.intp)
+        nState = max(np.max(self.index) + 1 if len(self.index) > 0 else 0, np.max(states) + 1)
+        stateClass = np.zeros((nState,), dtype=np.intp)
+        for iClass, classStates in enumerate(self.classStates):
+            stateClass[classStates] = iClass
+        out = self.background[iFrames, stateClass[states]]
+
+        # pairs sorted by (frame, state), the last one of a state wins like in multiplyFrame
+        pairFrame = np.repeat(np.arange(len(self)), np.diff(self.frameOffsets))
+        pairKey = pairFrame * nState + self.index
+        keyOrder = np.argsort(pairKey, kind='mergesort')
+        sortedKey = pairKey[keyOrder]
+        key = iFrames * nState + states
+        pos = np.searchsorted(sortedKey, key, side='right') - 1
+        isPair = (pos >= 0) & (sortedKey[np.maximum(pos, 0)] == key)
+        out[isPair] = self.value[keyOrder[pos[isPair]]]
+        return out
+
+def sparseObsFromDense(dense, classStates):
+
+    # SparseObsProb of a frames x states array: the background of a class is its value
+    # in a frame if all its states have the same value there, otherwise 0
+    nFrame = len(dense)
+    background = np.zeros((nFrame, len(classStates)), dtype=np.float64)
+    isBackground = np.zeros(dense.shape, dtype=bool)
+    for iClass, states in enumerate(classStates):
+        values = dense[:, states]
+        isConstant = np.all(values == values[:, :1], axis=1)
+        background[isConstant, iClass] = values[isConstant, 0]
+        isBackground[:, states] = values == background[:, iClass:iClass+1]
+
+    # only the states of the classes, other columns of dense are left out
+    inClass = np.zeros((dense.shape[1],), dtype=bool)
+    for states in classStates:
+        inClass[states] = True
+    pairFrame, index = np.nonzero(~isBackground & inClass)
+    frameOffsets = np.zeros((nFrame+1,), dtype=np.intp)
+    np.cumsum(np.bincount(pairFrame, minlength=nFrame), out=frameOffsets[1:])
+    return SparseObsProb(background, index, dense[pairFrame, index], frameOffsets, classStates)
+
+def concatenateSparseObs(parts):
+
+    # SparseObsProb of the frames of all the parts, in order (same classStates)
+    frameOffsets = [np.zeros((1,), dtype=np.intp)]
+    nPair = 0
+    for part in parts:
+        frameOffsets.append(part.frameOffsets[1:] + nPair)
+        nPair += part.frameOffsets[-1]
+    return SparseObsProb(np.concatenate([part.background for part in parts]),
+                         np.concatenate([part.index for part in parts]),
+                         np.concatenate([part.value for part in parts]),
+                         np.concatenate(frameOffsets), parts[0].classStates)
+
+class SegmentReport(object):
+
+    # how the segments of decodeViterbiSegments were joined, per boundary (start frame of a segment
+    # after the first): the frames the true delta took to join the segment's own delta (-1 if it did not),
+    # whether it only got proportional to it (tolerance) and whether the segment was decoded again
+    # sequentially. The path is the exact Viterbi path up to the next boundary if the deltas got equal or
+    # the segment was repaired, and all the boundaries before are exact too; the others are inexactBoundaries
+    def __init__(self, boundaries, convergedAfter, proportional, repaired):
+        self.boundaries = np.asarray(boundaries, dtype=np.intp)
+        self.convergedAfter = np.asarray(convergedAfter, dtype=np.intp)
+        self.proportional = np.asarray(proportional, dtype=bool)
+        self.repaired = np.asarray(repaired, dtype=bool)
+        isJoined = ((self.convergedAfter >= 0) & ~self.proportional) | self.repaired
+        self.exact = np.cumprod(isJoined).astype(bool) if len(isJoined) > 0 else isJoined
+        self.inexactBoundaries = self.boundaries[~self.exact]
+        self.isExact = len(self.inexactBoundaries) == 0
+
+class OnlineViterbi(object):
+
+    # Viterbi decoding of a stream of observation frames. process() takes one frame and returns the states
+    # of the frames that are decided: a frame is decided when the paths of all surviving states go through
+    # the same state there, so it is the state of the offline decodeViterbi path too; or, if maxLag is not
+    # None, when it is maxLag frames old, then it gets its state on the path of the currently best state
+    # (fixed-lag decisions, not always the offline path). Backpointers are only kept for the undecided frames.
+    # (after a zero probability frame the offline path may differ, both reset delta to uniform)
+
+    def __init__(self, hmm, maxLag = None):
+        self.hmm = hmm
+        self.hmm.buildTransitionIndex()
+        self.maxLag = maxLag
+
+        self.nState = len(hmm.init)
+        self.nFrame = 0  # frames processed
+        self.firstUndecided = 0  # first frame whose state has not been returned yet
+
+        self.delta = np.zeros((self.nState,), dtype=np.float64)
+        self.oldDelta = np.zeros((self.nState,), dtype=np.float64)
+
+        # ring buffer of the backpointers of the undecided frames, row frame % capacity
+        capacity = maxLag + 1 if maxLag is not None else 64
+        self.psi = np.zeros((capacity, self.nState), dtype=np.min_scalar_type(max(self.nState-1, 0)))
+
+    def process(self, obsProb):
+
+        nState = self.nState
+
+        if self.nFrame == 0:
+            np.multiply(self.hmm.init, obsProb[:nState], out=self.oldDelta)
+            self.oldDelta /= np.cumsum(self.oldDelta)[nState-1]
+        else:
+            if self.nFrame - self.firstUndecided >= len(self.psi):
+                self.growBuffer()
+            self.hmm.forwardStep(self.oldDelta, self.delta, self.psi[self.nFrame % len(self.psi)])
+
+            self.delta *= obsProb[:nState]
+            deltasum = np.cumsum(self.delta)[nState-1]
+            if deltasum > 0:
+                np.divide(self.delta, deltasum, out=self.oldDelta)
+            else:
+                print "WARNING: Viterbi has been fed some zero probabilities, at least they become zero at frame " +  str(self.nFrame) + " in combination with the model."
+                self.oldDelta[:] = 1.0/nState
+
+        self.nFrame += 1
+
+        # latest frame through which all surviving paths go (duplicates are followed rather than
+        # removed, np.unique on every undecided frame of every hop costs more)
+        lastFrame = self.nFrame - 1
+        states = np.nonzero(self.oldDelta > 0)[0]
+        iFrame = lastFrame
+        isMet = len(states) > 0 and np.all(states == states[0])
+        while len(states) > 0 and not isMet and iFrame > self.firstUndecided:
+            states = self.psi[iFrame % len(self.psi)][states]
+            iFrame -= 1
+            isMet = np.all(states == states[0])
+        if isMet:
+            return self.decide(iFrame, states[0])
+
+        # too old, take the state on the path of the currently best state
+        if self.maxLag is not None and lastFrame - self.firstUndecided >= self.maxLag:
+            decideFrame = lastFrame - self.maxLag
+            bestState = np.argmax(self.oldDelta)
+            for iFrame in range(lastFrame, decideFrame, -1):
+                bestState = self.psi[iFrame % len(self.psi)][bestState]
+            return self.decide(decideFrame, bestState)
+
+        return np.array([], dtype=np.int)
+
+    def bestState(self):
+        # most likely state of the last frame processed, the provisional end of the path
+        return np.argmax(self.oldDelta) if np.max(self.oldDelta) > 0 else self.nState-1
+
+    def finalise(self):
+
+        # states of all remaining frames, from the best state of the last frame, rabiner 34b
+        if self.nFrame == self.firstUndecided:
+            return np.array([], dtype=np.int)
+        return self.decide(self.nFrame-1, self.bestState())
+
+    def decide(self, lastFrame, state):
+
+        # path of the frames firstUndecided to lastFrame, lastFrame being in state
+        path = np.zeros((lastFrame - self.firstUndecided + 1,), dtype=np.int)
+        path[-1] = state
+        for iFrame in range(lastFrame, self.firstUndecided, -1):
+            path[iFrame - self.firstUndecided - 1] = self.psi[iFrame % len(self.psi)][path[iFrame - self.firstUndecided]]
+        self.firstUndecided = lastFrame + 1
+
+        return path
+
+    def growBuffer(self):
+
+        # only without maxLag, double the ring buffer keeping the rows of the undecided frames
+        capacity = len(self.psi)
+        psi = np.zeros((2*capacity, self.nState), dtype=self.psi.dtype)
+        for iFrame in range(self.firstUndecided, self.nFrame):
+            psi[iFrame % (2*capacity)] = self.psi[iFrame % capacity]
+        self.psi = psi
\ No newline at end of file
@@ -50,6 +50,14 @@ class Yin(object):
         self.m_threshDistr = 2
         self.m_yinBufferSize = self.m_frameSize/2
         self.m_fast = True
+        self.m_workspace = YinUtil.DifferenceWorkspace(self.m_yinBufferSize)
+
+        # lag search range, 0 means no limit, see setFrequencyRange
+        self.m_minFreq = 0.0
+        self.m_maxFreq = 0.0
+        self.m_minTau = 0
+        self.m_maxTau = 0
+        self.m_nTau = self.m_yinBufferSize
 
     def Yin(self, frameSize, inputSampleRate, thresh = 0.2, fast = True):
         self.m_frameSize = frameSize
@@ -58,6 +66,8 @@ class Yin(object):
         self.m_threshDistr = 2
         self.m_yinBufferSize = frameSize/2
         self.m_fast = fast
+        self.m_workspace = YinUtil.DifferenceWorkspace(self.m_yinBufferSize)
+        self.updateLagRange()
 
     class YinOutput(object):
 
@@ -67,37 +77,98 @@ class Yin(object):
             self.rms = rms
             self.salience = np.array([], dtype=np.float64)
             self.freqProb = np.array([], dtype=np.float64)
+            self.frameEnergy = 0.0  # sum of squares of the whole frame, rms is of its first half
+
+    class YinFramesOutput(object):
+
+        # output of a batch of frames, the candidates of frame i are the rows
+        # frameOffsets[i] to frameOffsets[i+1] of freqProb
+        def __init__(self, rms, salience, freqProb, frameOffsets, frameEnergy = None):
+            self.rms = rms
+            self.salience = salience
+            self.freqProb = freqProb
+            self.frameOffsets = frameOffsets
+            self.frameEnergy = frameEnergy
+
+        def getFrame(self, iFrame):
+            yo = Yin.YinOutput(0.0, 0.0, self.rms[iFrame])
+            if self.frameEnergy is not None:
+                yo.frameEnergy = self.frameEnergy[iFrame]
+            yo.salience = self.salience[iFrame]
+            yo.freqProb = self.freqProb[self.frameOffsets[iFrame]:self.frameOffsets[iFrame+1]]
+            return yo
 
     def processProbabilisticYin(self, input):
 
         # calculate aperiodicity function for all periods, output stores in yinBuffer
+        # input can be any float32/float64 array (view), it is not copied
         if self.m_fast:
-            yinBuffer = YinUtil.fastDifference(input, self.m_yinBufferSize)
+            yinBuffer = YinUtil.fastDifference(input, self.m_yinBufferSize, self.m_workspace)
         else:
-            yinBuffer = YinUtil.slowDifference(input, self.m_yinBufferSize)
+            YinUtil.cumulativeSquare(input, self.m_yinBufferSize, self.m_workspace)
+            yinBuffer = YinUtil.slowDifference(input, self.m_yinBufferSize, self.m_nTau)
+        cumSquare = self.m_workspace.cumSquare
 
-        yinBuffer = YinUtil.cumulativeDifference(yinBuffer ,self.m_yinBufferSize)
-
-        peakProbability = YinUtil.yinProb(yinBuffer, self.m_threshDistr, self.m_yinBufferSize, 0, 0)
+        # only the lags up to m_maxTau are needed from here on
+        yinBuffer = YinUtil.cumulativeDifference(yinBuffer[:self.m_nTau], self.m_nTau)
 
         # calculate overall "probability" from peak probability, overall "probability" probSum seems never be used
-        rms = sqrt(YinUtil.sumSquare(input, 0, self.m_yinBufferSize)/self.m_yinBufferSize)
-        yo = Yin.YinOutput(0.0, 0.0, rms)
-
-        firstStack = False
-        for iBuf in range(self.m_yinBufferSize):
-            yo.salience = np.append(yo.salience, peakProbability[iBuf])
-
-            # if peakProb > 0, a fundamental frequency candidate is generated
-            if peakProbability[iBuf] > 0:
-                currentF0 = self.m_inputSampleRate * (1.0 / YinUtil.parabolicInterpolation(yinBuffer, iBuf, self.m_yinBufferSize))
-                if firstStack == False:
-                    yo.freqProb = np.array([np.array([currentF0, peakProbability[iBuf]], dtype=np.float64),])
-                    firstStack = True
-                else:
-                    yo.freqProb = np.vstack((yo.freqProb, np.array([currentF0, peakProbability[iBuf]], dtype=np.float64)))
+        # (the energies were summed once, by the difference function)
+        rms = sqrt(cumSquare[self.m_yinBufferSize]/self.m_yinBufferSize)
+
+        yo = self.probabilisticYinFrames(yinBuffer[np.newaxis, :], np.array([rms])).getFrame(0)
+        # the float64 squares of cumSquare are those of the gate only for float64 input
+        if input.dtype == np.float64:
+            yo.frameEnergy = cumSquare[2*self.m_yinBufferSize]
+        else:
+            yo.frameEnergy = YinUtil.frameEnergy(input, 2*self.m_yinBufferSize)
         return yo
 
+    def processProbabilisticYinFrames(self, frames):
+
+        # batched processProbabilisticYin, one frame per row of frames
+        # (the gate energy of float32 frames is summed from their float32 squares, see processProbabilisticYin)
+        frames = np.asarray(frames)
+        frameEnergy = None
+        if frames.dtype == np.float32:
+            frameEnergy = YinUtil.frameEnergyFrames(frames, 2*self.m_yinBufferSize)
+        frames = np.asarray(frames, dtype=np.float64)
+
+        # aperiodicity function and its cumulative normalisation for all frames at once
+        cumSquare = YinUtil.cumulativeSquareFrames(frames, self.m_yinBufferSize)
+        if self.m_fast:
+            yinBuffers = YinUtil.fastDifferenceFrames(frames, self.m_yinBufferSize, cumSquare)
+        else:
+            yinBuffers = np.array([YinUtil.slowDifference(frame, self.m_yinBufferSize, self.m_nTau) for frame in frames])
+            yinBuffers = yinBuffers.reshape((frames.shape[0], self.m_yinBufferSize))
+
+        yinBuffers = YinUtil.cumulativeDifferenceFrames(yinBuffers[:, :self.m_nTau])
+
+        rms = np.sqrt(cumSquare[:, self.m_yinBufferSize]/self.m_yinBufferSize)
+
+        yos = self.probabilisticYinFrames(yinBuffers, rms)
+        yos.frameEnergy = frameEnergy if frameEnergy is not None else cumSquare[:, 2*self.m_yinBufferSize]
+        return yos
+
+    def probabilisticYinFrames(self, yinBuffers, rms):
+
+        # turn cumulative normalised difference functions into salience and f0 candidates
+        # the salience keeps one value per lag up to m_yinBufferSize, the lags after m_nTau are 0
+        peakProbability = np.zeros((yinBuffers.shape[0], self.m_yinBufferSize), dtype=np.float64)
+        peakProbability[:, :yinBuffers.shape[1]] = YinUtil.yinProbFrames(yinBuffers, self.m_threshDistr, self.m_minTau, self.m_maxTau)
+
+        # if peakProb > 0, a fundamental frequency candidate is generated
+        # nonzero goes through the frames in order, and through the taus in order within a frame
+        iFrame, iBuf = np.nonzero(peakProbability > 0)
+        frameOffsets = np.zeros((yinBuffers.shape[0]+1,), dtype=np.intp)
+        np.cumsum(np.bincount(iFrame, minlength=yinBuffers.shape[0]), out=frameOffsets[1:])
+
+        freqProb = np.empty((len(iFrame), 2), dtype=np.float64)
+        freqProb[:, 0] = self.m_inputSampleRate * (1.0 / YinUtil.parabolicInterpolationFrames(yinBuffers, iFrame, iBuf))
+        freqProb[:, 1] = peakProbability[iFrame, iBuf]
+
+        return Yin.YinFramesOutput(rms, peakProbability, freqProb, frameOffsets)
+
     def setThreshold(self, parameter):
 
         self.m_thresh = parameter
@@ -110,11 +181,39 @@ class Yin(object):
 
     def setFrameSize(self, parameter):
 
-        m_frameSize = parameter
-        m_yinBufferSize = m_frameSize/2
+        self.m_frameSize = parameter
+        self.m_yinBufferSize = self.m_frameSize/2
+        self.m_workspace = YinUtil.DifferenceWorkspace(self.m_yinBufferSize)
+        self.updateLagRange()
         return 0
 
     def setFast(self, parameter):
 
-        m_fast = parameter
-        return 0
\ No newline at end of file
+        self.m_fast = parameter
+        return 0
+
+    def setInputSampleRate(self, parameter):
+
+        self.m_inputSampleRate = parameter
+        self.updateLagRange()
+        return 0
+
+    def setFrequencyRange(self, minFreq, maxFreq):
+
+        # only look for f0 candidates between minFreq and maxFreq (Hz), 0 means no limit
+        self.m_minFreq = minFreq
+        self.m_maxFreq = maxFreq
+        self.updateLagRange()
+        return 0
+
+    def updateLagRange(self):
+
+        # period range in samples of the frequency range, as used by YinUtil.yinProb, 0 means no limit
+        self.m_minTau = int(self.m_inputSampleRate * 1.0 / self.m_maxFreq) if self.m_maxFreq > 0 else 0
+        self.m_maxTau = int(ceil(self.m_inputSampleRate * 1.0 / self.m_minFreq)) + 1 if self.m_minFreq > 0 else 0
+
+        # the difference function is only needed up to m_maxTau, yinProb then searches all of it
+        if self.m_minTau < self.m_maxTau < self.m_yinBufferSize:
+            self.m_nTau = self.m_maxTau + 1
+        else:
+            self.m_nTau = self.m_yinBufferSize
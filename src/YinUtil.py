@@ -1,13 +1,14 @@
 from math import *
 import numpy as np
 
-def slowDifference(input, yinBufferSize):
+def slowDifference(input, yinBufferSize, nTau = 0):
 
+    # only the first nTau lags are calculated if nTau > 0, the others stay 0
     yinBuffer = np.zeros((yinBufferSize,), dtype=np.float64)
 
     startPoint = 0
     endPoint = 0
-    for i in range(yinBufferSize):
+    for i in range(nTau if 0 < nTau < yinBufferSize else yinBufferSize):
         startPoint = yinBufferSize/2 - i/2
         endPoint = startPoint + yinBufferSize
         for j in range(startPoint,endPoint):
@@ -16,67 +17,134 @@ def slowDifference(input, yinBufferSize):
 
     return yinBuffer
 
-def fastDifference(input, yinBufferSize):
+class DifferenceWorkspace(object):
 
+    # buffers reused by fastDifference from one frame to the next
+    def __init__(self, yinBufferSize):
+        frameSize = 2 * yinBufferSize
+        self.yinBufferSize = yinBufferSize
+        self.yinBuffer = np.zeros((yinBufferSize,), dtype=np.float64)
+        self.powerTerms = np.zeros((yinBufferSize,), dtype=np.float64)
+        self.square = np.zeros((frameSize,), dtype=np.float64)
+        self.cumSquare = np.zeros((frameSize+1,), dtype=np.float64)
+        self.kernel = np.zeros((frameSize,), dtype=np.float64)
+
+def cumulativeSquare(input, yinBufferSize, workspace):
+
+    # workspace.cumSquare[i] is the energy of the first i samples of the frame, summed in order
+    # (in float64 for float32 input too)
+    np.multiply(input[:2*yinBufferSize], input[:2*yinBufferSize], out=workspace.square, dtype=np.float64)
+    np.cumsum(workspace.square, out=workspace.cumSquare[1:])
+
+    return workspace.cumSquare
+
+def cumulativeSquareFrames(frames, yinBufferSize):
+
+    # batched version of cumulativeSquare, one frame per row of frames
     frameSize = 2 * yinBufferSize
+    cumSquare = np.zeros((frames.shape[0], frameSize+1), dtype=np.float64)
+    np.cumsum(np.multiply(frames[:, :frameSize], frames[:, :frameSize], dtype=np.float64), axis=1, out=cumSquare[:, 1:])
 
-    # DECLARE AND INITIALISE
-    yinBuffer = np.zeros((yinBufferSize,), dtype=np.float64)
-    powerTerms = np.zeros((yinBufferSize,), dtype=np.float64)
+    return cumSquare
 
-    kernel = np.zeros((frameSize,), dtype=np.float64)
-    yinStyleACFReal = np.zeros((frameSize,), dtype=np.float64)
-    yinStyleACFImag = np.zeros((frameSize,), dtype=np.float64)
+def frameEnergy(input, frameSize):
 
-    # POWER TERM CALCULATION
-    # ... for the power terms in equation (7) in the Yin paper
-    for j in range(yinBufferSize):
-        powerTerms[0] += input[j] * input[j]
+    # sum of squares of the frame for the low amplitude gate, summed like RMS: the squares in the
+    # precision of the input (float32 for float32 frames), added up in float64 in order
+    return np.cumsum(np.square(input[:frameSize]), dtype=np.float64)[-1]
+
+def frameEnergyFrames(frames, frameSize):
+
+    # batched version of frameEnergy, one frame per row of frames
+    return np.cumsum(np.square(frames[:, :frameSize]), axis=1, dtype=np.float64)[:, -1]
+
+def fastDifference(input, yinBufferSize, workspace = None):
+
+    # if a workspace is given, the returned yinBuffer is its buffer and is overwritten by the next call,
+    # its cumSquare is left with the energies of the frame (see cumulativeSquare)
+    if workspace is None or workspace.yinBufferSize != yinBufferSize:
+        workspace = DifferenceWorkspace(yinBufferSize)
 
-    # now iteratively calculate all others, second term in equation (7)
-    for tau in range(1, yinBufferSize):
-        powerTerms[tau] = powerTerms[tau-1] - input[tau-1] * input[tau-1] + input[tau+yinBufferSize] * input[tau+yinBufferSize]
+    frameSize = 2 * yinBufferSize
+    yinBuffer = workspace.yinBuffer
+    powerTerms = workspace.powerTerms
+    cumSquare = workspace.cumSquare
+
+    # POWER TERM CALCULATION
+    # ... for the power terms in equation (7) in the Yin paper, powerTerms[0] is the energy of the first half,
+    # the others follow the running update powerTerms[tau-1] - input[tau-1]^2 + input[tau+yinBufferSize]^2
+    cumulativeSquare(input, yinBufferSize, workspace)
+    np.subtract(cumSquare[yinBufferSize], cumSquare[:yinBufferSize], out=powerTerms)
+    powerTerms += cumSquare[yinBufferSize+1:]
+    powerTerms -= cumSquare[yinBufferSize+1]
+    powerTerms[0] = cumSquare[yinBufferSize]
 
     # YIN-STYLE AUTOCORRELATION via FFT
     # 1. data
-    at = np.fft.fft(input, frameSize)
-    audioTransformedReal = at.real
-    audioTransformedImag = at.imag
+    at = np.fft.rfft(input[:frameSize], frameSize)
 
     # 2. half of the data, disguised as a convolution kernel
-    for j in range(yinBufferSize):
-        kernel[j] = input[yinBufferSize-1-j]
-    kt = np.fft.fft(kernel, frameSize)
-    kernelTransformedReal = kt.real
-    kernelTransformedImag = kt.imag
+    workspace.kernel[:yinBufferSize] = input[yinBufferSize-1::-1]
+    kt = np.fft.rfft(workspace.kernel, frameSize)
 
     # 3. convolution via complex multiplication
-    for j in range(frameSize):
-        yinStyleACFReal[j] = audioTransformedReal[j]*kernelTransformedReal[j] - audioTransformedImag[j]*kernelTransformedImag[j]
-        yinStyleACFImag[j] = audioTransformedReal[j]*kernelTransformedImag[j] + audioTransformedImag[j]*kernelTransformedReal[j]
-    yinStyleACF = np.array(yinStyleACFReal, dtype=np.float64) + np.array(yinStyleACFImag, dtype=np.float64)*1j
-    iat = np.fft.ifft(yinStyleACF, frameSize)
+    at *= kt
+    iat = np.fft.irfft(at, frameSize)
 
     # CALCULATION OF difference function
-    for j in range(yinBufferSize):
-        yinBuffer[j] = powerTerms[0] + powerTerms[j] - 2 * iat.real[j+yinBufferSize-1]
+    np.multiply(iat[yinBufferSize-1:frameSize-1], -2, out=yinBuffer)
+    yinBuffer += powerTerms[0]
+    yinBuffer += powerTerms
 
-    return  yinBuffer
+    return yinBuffer
 
-def cumulativeDifference(yinBuffer ,yinBufferSize):
+def fastDifferenceFrames(frames, yinBufferSize, cumSquare = None):
 
-    yinBuffer[0] = 1.0
-    runningSum = 0.0
+    # batched version of fastDifference, one frame per row of frames
+    # cumSquare: cumulativeSquareFrames(frames, yinBufferSize) if it has been computed already
+    frameSize = 2 * yinBufferSize
 
-    for tau in range(1, yinBufferSize):
-        runningSum += yinBuffer[tau]
-        if runningSum == 0:
-            yinBuffer[tau] = 1
-        else:
-            yinBuffer[tau] *= tau / runningSum
+    # POWER TERM CALCULATION
+    # same sums as the running update in fastDifference, taken from a cumulative sum of squares:
+    # powerTerms[tau] = sum(input[tau:yinBufferSize]**2) + sum(input[yinBufferSize+1:yinBufferSize+tau+1]**2)
+    if cumSquare is None:
+        cumSquare = cumulativeSquareFrames(frames, yinBufferSize)
+    powerTerms = cumSquare[:, yinBufferSize:yinBufferSize+1] - cumSquare[:, :yinBufferSize] \
+                 + cumSquare[:, yinBufferSize+1:] - cumSquare[:, yinBufferSize+1:yinBufferSize+2]
+    powerTerms[:, 0] = cumSquare[:, yinBufferSize]
+
+    # YIN-STYLE AUTOCORRELATION via FFT, the kernel is the reversed first half of each frame
+    at = np.fft.rfft(frames[:, :frameSize], frameSize, axis=1)
+    kt = np.fft.rfft(frames[:, yinBufferSize-1::-1], frameSize, axis=1)
+    iat = np.fft.irfft(at * kt, frameSize, axis=1)
+
+    # CALCULATION OF difference function, summed in the order of fastDifference
+    yinBuffers = iat[:, yinBufferSize-1:frameSize-1] * -2
+    yinBuffers += powerTerms[:, 0:1]
+    yinBuffers += powerTerms
+    return yinBuffers
+
+def cumulativeDifference(yinBuffer ,yinBufferSize):
+
+    cumulativeDifferenceFrames(yinBuffer[np.newaxis, :yinBufferSize])
 
     return yinBuffer
 
+def cumulativeDifferenceFrames(yinBuffers):
+
+    # batched version of cumulativeDifference, one yinBuffer per row, normalised in place
+    yinBufferSize = yinBuffers.shape[1]
+    runningSum = np.cumsum(yinBuffers[:, 1:], axis=1)
+    tau = np.arange(1, yinBufferSize, dtype=np.float64)
+
+    zeroSum = runningSum == 0
+    runningSum[zeroSum] = 1.0
+    yinBuffers[:, 1:] *= tau / runningSum
+    yinBuffers[:, 1:][zeroSum] = 1.0
+    yinBuffers[:, 0] = 1.0
+
+    return yinBuffers
+
 uniformDist = [0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000,0.0100000]
 betaDist1 = [0.028911,0.048656,0.061306,0.068539,0.071703,0.071877,0.069915,0.066489,0.062117,0.057199,0.052034,0.046844,0.041786,0.036971,0.032470,0.028323,0.024549,0.021153,0.018124,0.015446,0.013096,0.011048,0.009275,0.007750,0.006445,0.005336,0.004397,0.003606,0.002945,0.002394,0.001937,0.001560,0.001250,0.000998,0.000792,0.000626,0.000492,0.000385,0.000300,0.000232,0.000179,0.000137,0.000104,0.000079,0.000060,0.000045,0.000033,0.000024,0.000018,0.000013,0.000009,0.000007,0.000005,0.000003,0.000002,0.000002,0.000001,0.000001,0.000001,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000]
 betaDist2 = [0.012614,0.022715,0.030646,0.036712,0.041184,0.044301,0.046277,0.047298,0.047528,0.047110,0.046171,0.044817,0.043144,0.041231,0.039147,0.036950,0.034690,0.032406,0.030133,0.027898,0.025722,0.023624,0.021614,0.019704,0.017900,0.016205,0.014621,0.013148,0.011785,0.010530,0.009377,0.008324,0.007366,0.006497,0.005712,0.005005,0.004372,0.003806,0.003302,0.002855,0.002460,0.002112,0.001806,0.001539,0.001307,0.001105,0.000931,0.000781,0.000652,0.000542,0.000449,0.000370,0.000303,0.000247,0.000201,0.000162,0.000130,0.000104,0.000082,0.000065,0.000051,0.000039,0.000030,0.000023,0.000018,0.000013,0.000010,0.000007,0.000005,0.000004,0.000003,0.000002,0.000001,0.000001,0.000001,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000,0.000000]
@@ -86,8 +154,42 @@ single10 = [0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00
 single15 = [0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,1.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000]
 single20 = [0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,1.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000,0.00000]
 
+# threshold distributions, precomputed once, looked up by prior id in yinProb
+nThreshold = 100
+thresholds = 0.01 + np.arange(nThreshold) * 0.01
+thresholdDistrTables = {}
+
+def registerThresholdDistr(distribution, prior = None):
+
+    # distribution is the probability of each of the nThreshold thresholds 0.01, 0.02, ..., 1.0
+    # returns the prior id to give to Yin.setThresholdDistr, a new one if prior is None
+    distribution = np.array(distribution, dtype=np.float64)
+    if distribution.shape != (nThreshold,):
+        raise ValueError("a threshold distribution needs " + str(nThreshold) + " values, got " + str(distribution.shape))
+
+    # formula (4), the threshold is on y-axis, the probability of P is the cumulation of distribution
+    # when d'(tau) < threshold, summed from the highest threshold down: tailProb[k] = sum(distribution[k:])
+    tailProb = np.zeros((nThreshold+1,), dtype=np.float64)
+    tailProb[:nThreshold] = np.cumsum(distribution[::-1])[::-1]
+
+    if prior is None:
+        prior = max(thresholdDistrTables.keys()) + 1 if thresholdDistrTables else 0
+    thresholdDistrTables[prior] = (distribution, tailProb)
+
+    return prior
+
+for iPrior, priorDistribution in enumerate([uniformDist, betaDist1, betaDist2, betaDist3, betaDist4, single10, single15, single20]):
+    registerThresholdDistr(priorDistribution, iPrior)
+
 def yinProb(yinBuffer, prior, yinBufferSize, minTau0, maxTau0):
 
+    return yinProbFrames(yinBuffer[np.newaxis, :yinBufferSize], prior, minTau0, maxTau0)[0]
+
+def yinProbFrames(yinBuffers, prior, minTau0, maxTau0):
+
+    # batched yinProb, one cumulative normalised difference function per row of yinBuffers
+    nFrame, yinBufferSize = yinBuffers.shape
+
     minTau = 2
     maxTau = yinBufferSize
 
@@ -96,79 +198,59 @@ def yinProb(yinBuffer, prior, yinBufferSize, minTau0, maxTau0):
     if maxTau0 > 0 and maxTau0 < yinBufferSize and maxTau0 > minTau: maxTau = maxTau0
 
     minWeight = 0.01
-    thresholds = np.array([], dtype=np.float32)
-    distribution = np.array([], dtype=np.float32)
-    peakProb = np.zeros((yinBufferSize,), dtype=np.float64)
-
-    nThreshold = 100
-    nThresholdInt = nThreshold
-
-    for i in range(nThresholdInt):
-
-        thresholds = np.append(thresholds, np.double(0.01 + i*0.01))
-
-        if prior == 0:
-            distribution = np.append(distribution, uniformDist[i])
-        elif prior == 1:
-            distribution = np.append(distribution, betaDist1[i])
-        elif prior == 2:
-            distribution = np.append(distribution, betaDist2[i])
-        elif prior == 3:
-            distribution = np.append(distribution, betaDist3[i])
-        elif prior == 4:
-            distribution = np.append(distribution, betaDist4[i])
-        elif prior == 5:
-            distribution = np.append(distribution, single10[i])
-        elif prior == 6:
-            distribution = np.append(distribution, single15[i])
-        elif prior == 7:
-            distribution = np.append(distribution, single20[i])
-        else:
-            distribution = np.append(distribution, uniformDist[i])
-
-    tau = minTau
-    minInd = 0
-    minVal = 42.0
-    sumProb = 0.0
-
-    while tau+1 < maxTau:
-        # yinBuffer < 1 && ...
-        if yinBuffer[tau] < thresholds[len(thresholds)-1] and yinBuffer[tau+1] < yinBuffer[tau]:
-            # search for all dip points
-            while tau + 1 < maxTau and yinBuffer[tau+1] < yinBuffer[tau]:
-                tau += 1
-            # tau is now local minimum,
-            # because it's the turning point from yinBuffer[tau+1] < yinBuffer[tau] to yinBuffer[tau+1] >= yinBuffer[tau]
-            if yinBuffer[tau] < minVal and tau > 2:
-                minVal = yinBuffer[tau]  # mininum d'
-                minInd = tau
-            currThreshInd = nThresholdInt-1
-            # formula (4), the threshold is on y-axis, the probability of P is the cumulation of distribution
-            # when d'(tau) < threshold
-            while thresholds[currThreshInd] > yinBuffer[tau] and currThreshInd > -1:
-                peakProb[tau] += distribution[currThreshInd]
-                currThreshInd -= 1
-
-            sumProb += peakProb[tau]
-            tau += 1
-        else:
-            tau += 1
-
-    if peakProb[minInd] > 1:
+    peakProb = np.zeros((nFrame, yinBufferSize), dtype=np.float64)
+    if maxTau - minTau < 2:
+        return peakProb
+
+    # unknown priors fall back to the uniform distribution
+    distribution, tailProb = thresholdDistrTables.get(prior, thresholdDistrTables[0])
+
+    # dip points: tau ends a strictly falling run of d' (tau+1 does not fall any further)
+    # and the run went below the highest threshold before reaching tau
+    prev = yinBuffers[:, minTau:maxTau-1]
+    curr = yinBuffers[:, minTau+1:maxTau]
+    isPeak = np.zeros((nFrame, yinBufferSize), dtype=bool)
+    isPeak[:, minTau+1:maxTau] = (curr < prev) & (prev < thresholds[nThreshold-1])
+    isPeak[:, minTau+1:maxTau-1] &= ~(yinBuffers[:, minTau+2:maxTau] < yinBuffers[:, minTau+1:maxTau-1])
+
+    peakProb[isPeak] = tailProb[np.searchsorted(thresholds, yinBuffers[isPeak], side='right')]
+    sumProb = np.cumsum(peakProb, axis=1)[:, yinBufferSize-1]
+
+    # mininum d' among the dips
+    isMinCandidate = isPeak.copy()
+    isMinCandidate[:, :3] = False
+    minInd = np.argmin(np.where(isMinCandidate, yinBuffers, np.inf), axis=1)
+    minInd[~isMinCandidate.any(axis=1)] = 0
+
+    iFrames = np.arange(nFrame)
+    minPeakProb = peakProb[iFrames, minInd]
+    for iFrame in np.nonzero(minPeakProb > 1)[0]:
         print "WARNING: yin has prob > 1 ??? I'm returning all zeros instead."
-        return np.zeros((yinBufferSize,), dtype=np.float64)
-
-    nonPeakProb = 1.0
-    if sumProb > 0:
-        for i in range(minTau, maxTau):
-            # nomalization, the max prob will be peakProb[minInd]
-            peakProb[i] = peakProb[i] / sumProb * peakProb[minInd]
-            nonPeakProb -= peakProb[i]
-    if minInd > 0:
-        # adds nonPeakProb only for the prob with minimum d(tau)
-        # because here we have a small threshold s, for all tau d'(tau) > s
-        # we choose tau as the index of global minimum of d'
-        peakProb[minInd] += nonPeakProb * minWeight
+        peakProb[iFrame] = 0
+        sumProb[iFrame] = 0
+        minInd[iFrame] = 0
+
+    nonPeakProb = np.ones((nFrame,), dtype=np.float64)
+    isScaled = sumProb > 0
+    if np.any(isScaled):
+        # nomalization, the max prob will be peakProb[minInd]
+        # as in the sequential version, the taus after minInd are scaled by the already normalised peakProb[minInd]
+        scaled = peakProb[isScaled, minTau:maxTau]
+        scaledSum = sumProb[isScaled, np.newaxis]
+        scaledMin = minPeakProb[isScaled, np.newaxis]
+        factor = np.where(np.arange(minTau, maxTau) > minInd[isScaled, np.newaxis], scaledMin / scaledSum * scaledMin, scaledMin)
+        scaled = scaled / scaledSum * factor
+        peakProb[isScaled, minTau:maxTau] = scaled
+
+        nonPeak = np.ones((scaled.shape[0], scaled.shape[1]+1), dtype=np.float64)
+        nonPeak[:, 1:] = scaled
+        nonPeakProb[isScaled] = np.subtract.accumulate(nonPeak, axis=1)[:, scaled.shape[1]]
+
+    # adds nonPeakProb only for the prob with minimum d(tau)
+    # because here we have a small threshold s, for all tau d'(tau) > s
+    # we choose tau as the index of global minimum of d'
+    hasMin = minInd > 0
+    peakProb[iFrames[hasMin], minInd[hasMin]] += nonPeakProb[hasMin] * minWeight
 
     return peakProb
 
@@ -178,20 +260,28 @@ def parabolicInterpolation(yinBuffer, tau, yinBufferSize):
     if tau == yinBufferSize: # not valid anyway.
         return tau
 
-    betterTau = 0.0
-    if tau > 0 and tau < yinBufferSize-1:
-        s0 = yinBuffer[tau-1]
-        s1 = yinBuffer[tau]
-        s2 = yinBuffer[tau+1]
+    return parabolicInterpolationFrames(yinBuffer[np.newaxis, :yinBufferSize], np.array([0]), np.array([tau]))[0]
+
+def parabolicInterpolationFrames(yinBuffers, iFrame, tau):
+
+    # batched parabolicInterpolation of the taus tau[i] in the rows iFrame[i] of yinBuffers
+    yinBufferSize = yinBuffers.shape[1]
+    betterTau = np.array(tau, dtype=np.float64)
+
+    isInner = (tau > 0) & (tau < yinBufferSize-1)
+    for edgeTau in tau[~isInner]:
+        print "WARNING: can't do interpolation at the edge (tau = " + str(edgeTau) + "), will return un-interpolated value.\n"
+
+    s0 = yinBuffers[iFrame[isInner], tau[isInner]-1]
+    s1 = yinBuffers[iFrame[isInner], tau[isInner]]
+    s2 = yinBuffers[iFrame[isInner], tau[isInner]+1]
 
+    with np.errstate(divide='ignore', invalid='ignore'):
         adjustment = (s2 - s0) / (2 * (2 * s1 - s2 - s0))
 
-        if np.fabs(adjustment)>1: adjustment = 0
+    adjustment[np.fabs(adjustment)>1] = 0
 
-        betterTau = tau + adjustment
-    else:
-        print "WARNING: can't do interpolation at the edge (tau = " + str(tau) + "), will return un-interpolated value.\n"
-        betterTau = tau
+    betterTau[isInner] = tau[isInner] + adjustment
 
     return betterTau
 
@@ -211,3 +301,24 @@ def RMS(inputBuffers, blockSize):
     rms = sqrt(rms)
 
     return rms
+
+def frameSignal(audio, frameSize, hopSize, startFromZero = False):
+
+    # cut audio into a 2-D strided view, one frame per row, without copying the frames
+    # startFromZero False: frames are centred on multiples of hopSize, the first one on sample 0,
+    # zero padded at both ends, like the default of ess.FrameGenerator
+    # startFromZero True: frames start on multiples of hopSize, only complete frames are returned
+    audio = np.ascontiguousarray(audio)
+    if not startFromZero:
+        nFrame = (len(audio) + hopSize - 1) // hopSize
+        padded = np.zeros((len(audio) + 2*frameSize,), dtype=audio.dtype)
+        padded[frameSize//2:frameSize//2+len(audio)] = audio
+        audio = padded
+    else:
+        nFrame = max(0, (len(audio) - frameSize) // hopSize + 1)
+
+    frames = np.lib.stride_tricks.as_strided(audio, shape=(nFrame, frameSize),
+                                             strides=(audio.strides[0]*hopSize, audio.strides[0]))
+    frames.flags.writeable = False
+
+    return frames
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+'''
+ * Copyright (C) 2015  Music Technology Group - Universitat Pompeu Fabra
+ *
+ * This file is part of pypYIN
+ *
+ * pypYIN is free software: you can redistribute it and/or modify it under
+ * the terms of the GNU Affero General Public License as published by the Free
+ * Software Foundation (FSF), either version 3 of the License, or (at your
+ * option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but WITHOUT
+ * ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+ * FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+ * details.
+ *
+ * You should have received a copy of the Affero GNU General Public License
+ * version 3 along with this program.  If not, see http://www.gnu.org/licenses/
+ *
+ * If you have any problem about this python version code, please contact: Rong Gong
+ * rong.gong@upf.edu
+ *
+ * If you have any problem about this algorithm, I suggest you to contact: Matthias Mauch
+ * m.mauch@qmul.ac.uk who is the original C++ version author of this algorithm
+ *
+ * If you want to refer this code, please consider this article:
+ *
+ * M. Mauch and S. Dixon,
+ * “pYIN: A Fundamental Frequency Estimator Using Probabilistic Threshold Distributions”,
+ * in Proceedings of the IEEE International Conference on Acoustics,
+ * Speech, and Signal Processing (ICASSP 2014), 2014.
+ *
+ * M. Mauch, C. Cannam, R. Bittner, G. Fazekas, J. Salamon, J. Dai, J. Bello and S. Dixon,
+ * “Computer-aided Melody Note Transcription Using the Tony Software: Accuracy and Efficiency”,
+ * in Proceedings of the First International Conference on Technologies for
+ * Music Notation and Representation, 2015.
+'''
+
+import os, sys
+import glob
+import time
+import tempfile
+import argparse
+import traceback
+import multiprocessing
+import numpy as np
+import pYINmain
+import SparseHMM
+from pYINPtNote import pYINPtNoteFeatures
+
+# the PyinMain of a worker process, see initWorker
+workerInst = None
+workerParam = None
+
+def initWorker(param):
+
+    # one PyinMain per worker, reused (reset) for every file
+    global workerInst, workerParam
+    workerParam = param
+    if param['modelCacheDir'] is not None:
+        SparseHMM.setModelCacheDir(param['modelCacheDir'])
+    workerInst = pYINmain.PyinMain()
+    workerInst.initialise(channels = 1, inputSampleRate = param['fs'], stepSize = param['hopSize'],
+                          blockSize = param['frameSize'], lowAmp = param['lowAmp'],
+                          onsetSensitivity = param['onsetSensitivity'], pruneThresh = param['pruneThresh'],
+                          outputs = param['outputs'])
+
+def transcribeFile(job):
+
+    # analyses one file in a worker and writes its output; errors are returned, not raised,
+    # so that one bad file does not stop the batch
+    # returns (inputFile, outputFile, error message or None, number of frames, seconds of audio, seconds taken)
+    inputFile, outputFile = job
+    startTime = time.time()
+    try:
+        monoPitch, fs = pYINPtNoteFeatures(inputFile, workerParam['fs'], workerParam['frameSize'],
+                                           workerParam['hopSize'], workerInst)
+        writeFeatures(outputFile, monoPitch, fs, workerParam['format'])
+        nFrame = len(workerInst.m_level)
+        return inputFile, outputFile, None, nFrame, nFrame * workerParam['hopSize'] * 1.0 / workerParam['fs'], \
+            time.time() - startTime
+    except Exception:
+        return inputFile, outputFile, traceback.format_exc().strip().split('\n')[-1], 0, 0.0, time.time() - startTime
+
+def featureArrays(monoPitch, fs):
+
+    # the outputs written per file, one array per output (ragged ones as values and frameOffsets)
+    return dict(smoothedPitchTrack=np.asarray(monoPitch, dtype=np.float64),
+                noteFrameNumber=fs.m_oMonoNoteOut.frameNumber,
+                notePitch=fs.m_oMonoNoteOut.pitch,
+                noteState=fs.m_oMonoNoteOut.noteState,
+                notes=fs.m_oNotes.values,
+                notePitchTracks=fs.m_oNotePitchTracks.values,
+                notePitchTrackOffsets=fs.m_oNotePitchTracks.frameOffsets)
+
+def writeFeatures(outputFile, monoPitch, fs, format = 'npz'):
+
+    # npz: one array per output (ragged ones as values and frameOffsets), txt: the pYINPtNote printout.
+    # Written to a temporary file and renamed, an interrupted batch leaves no half written outputs
+    fd, tempName = tempfile.mkstemp(suffix='.' + format, dir=os.path.dirname(os.path.abspath(outputFile)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if format == 'npz':
+                np.savez(f, **featureArrays(monoPitch, fs))
+            else:
+                f.write('pitch track\n')
+                for value in fs.m_oSmoothedPitchTrack.values:
+                    f.write(repr(value) + '\n')
+                f.write('\nmono note decoded pitch\n')
+                for ii in fs.m_oMonoNoteOut:
+                    f.write('%d %r %d\n' % (ii.frameNumber, ii.pitch, ii.noteState))
+                f.write('\nnote pitch tracks\n')
+                for ii in fs.m_oNotePitchTracks:
+                    f.write(' '.join(repr(value) for value in ii) + '\n')
+                f.write('\nmedian note pitch\n')
+                for value in fs.m_oNotes.values:
+                    f.write(repr(value) + '\n')
+        os.rename(tempName, outputFile)
+    except:
+        if os.path.exists(tempName):
+            os.remove(tempName)
+        raise
+
+def expandInputs(patterns):
+
+    # file names and glob patterns to a sorted list of files, each file once
+    inputFiles = []
+    for pattern in patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        inputFiles += sorted(matches)
+    seen = set()
+    return [f for f in inputFiles if not (f in seen or seen.add(f))]
+
+def outputFileNames(inputFiles, outputDir, format):
+
+    # <outputDir>/<input name>.<format>, numbered if two inputs have the same name
+    outputFiles = []
+    used = set()
+    for inputFile in inputFiles:
+        name = os.path.splitext(os.path.basename(inputFile))[0]
+        outputFile = os.path.join(outputDir, name + '.' + format)
+        count = 1
+        while outputFile in used:
+            outputFile = os.path.join(outputDir, name + '_' + str(count) + '.' + format)
+            count += 1
+        used.add(outputFile)
+        outputFiles.append(outputFile)
+    return outputFiles
+
+def transcribeFiles(inputFiles, outputDir, jobs = None, fs = 44100, frameSize = 2048, hopSize = 256,
+                    format = 'npz', skipExisting = False, modelCacheDir = None, outputs = None, log = sys.stderr):
+
+    # transcribes the files on a pool of jobs processes (all cpus if None), returns the list of
+    # transcribeFile results, failed files included. outputs: see pYINmain.outputNames, the outputs
+    # not asked for are written empty
+    if not os.path.isdir(outputDir):
+        os.makedirs(outputDir)
+    param = dict(fs = fs, frameSize = frameSize, hopSize = hopSize, lowAmp = 0.25, onsetSensitivity = 0.7,
+                 pruneThresh = 0.1, format = format, modelCacheDir = modelCacheDir, outputs = outputs)
+
+    todo = [(inputFile, outputFile) for inputFile, outputFile
+            in zip(inputFiles, outputFileNames(inputFiles, outputDir, format))
+            if not (skipExisting and os.path.exists(outputFile))]
+    nSkipped = len(inputFiles) - len(todo)
+
+    startTime = time.time()
+    results = []
+    pool = multiprocessing.Pool(jobs, initWorker, (param,))
+    try:
+        for result in pool.imap_unordered(transcribeFile, todo):
+            results.append(result)
+            inputFile, outputFile, error, nFrame, audioTime, fileTime = result
+            log.write('[%d/%d] %s: %s (%.1f s audio in %.2f s)\n'
+                      % (len(results), len(todo), inputFile, 'failed, ' + error if error else 'ok', audioTime, fileTime))
+        pool.close()
+    except:
+        # any error (not only ctrl-c) while collecting, e.g. a failing log, must not leave
+        # join() waiting on workers that still have files to do
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    wallTime = time.time() - startTime
+
+    # summary
+    failed = [result for result in results if result[2] is not None]
+    audioTime = sum(result[4] for result in results)
+    log.write('\n%d files transcribed, %d failed, %d skipped in %.1f s\n'
+              % (len(results) - len(failed), len(failed), nSkipped, wallTime))
+    if wallTime > 0:
+        log.write('throughput: %.2f files/s, %.1f s of audio in %.1f s (%.1fx real time)\n'
+                  % (len(results) / wallTime, audioTime, wallTime, audioTime / wallTime))
+    for result in failed:
+        log.write('failed: %s: %s\n' % (result[0], result[2]))
+
+    return results
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='pYIN pitch track and note transcription of many audio files')
+    parser.add_argument('inputs', nargs='+', help='audio files or glob patterns (quoted)')
+    parser.add_argument('-o', '--output-dir', default='.', help='directory of the output files')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes, default: number of cpus')
+    parser.add_argument('-f', '--format', choices=['npz', 'txt'], default='npz', help='output file format')
+    parser.add_argument('--fs', type=int, default=44100, help='sample rate the audio is loaded with')
+    parser.add_argument('--frame-size', type=int, default=2048)
+    parser.add_argument('--hop-size', type=int, default=256)
+    parser.add_argument('--skip-existing', action='store_true', help='skip the files whose output exists')
+    parser.add_argument('--model-cache', default=None, help='directory of the on-disk HMM model cache')
+    parser.add_argument('--outputs', default=None,
+                        help='comma separated outputs to compute, default: all; smoothedpitchtrack skips the notes')
+    args = parser.parse_args()
+
+    outputs = args.outputs.split(',') if args.outputs is not None else None
+    if outputs is not None and not set(outputs) <= set(pYINmain.outputNames):
+        parser.error('unknown outputs, choose from ' + ','.join(pYINmain.outputNames))
+
+    inputFiles = expandInputs(args.inputs)
+    results = transcribeFiles(inputFiles, args.output_dir, args.jobs, args.fs, args.frame_size, args.hop_size,
+                              args.format, args.skip_existing, args.model_cache, outputs)
+    sys.exit(1 if any(result[2] is not None for result in results) else 0)
\ No newline at end of file
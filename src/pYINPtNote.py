@@ -39,40 +39,63 @@
 
 import os, sys
 import pYINmain
-import essentia.standard as ess
 import numpy as np
+from AudioStream import WavReader
 from YinUtil import RMS
 
-def pYINPtNote(filename1,fs=44100,frameSize=2048,hopSize=256):
+def pYINPtNoteFeatures(filename1,fs=44100,frameSize=2048,hopSize=256,pYinInst=None,outputs=None):
 
     '''
-    Given filename, return pitchtrack and note transcription track
+    Given filename, return the smoothed pitch track and the FeatureSet with the note transcription
     :param filename1:
     :param fs:
     :param frameSize:
     :param hopSize:
-    :return:
+    :param pYinInst: PyinMain initialised with fs, frameSize and hopSize to reuse, a new one if None
+    :param outputs: outputs of the new PyinMain, see pYINmain.outputNames (None: the default ones)
+    :return: monoPitch, featureSet
     '''
     # initialise
-    pYinInst = pYINmain.PyinMain()
-    pYinInst.initialise(channels = 1, inputSampleRate = fs, stepSize = hopSize, blockSize = frameSize,
-                   lowAmp = 0.25, onsetSensitivity = 0.7, pruneThresh = 0.1)
+    if pYinInst is None:
+        pYinInst = pYINmain.PyinMain()
+        pYinInst.initialise(channels = 1, inputSampleRate = fs, stepSize = hopSize, blockSize = frameSize,
+                       lowAmp = 0.25, onsetSensitivity = 0.7, pruneThresh = 0.1, outputs = outputs)
+    else:
+        pYinInst.reset()
 
-    # frame-wise calculation
-    audio = ess.MonoLoader(filename = filename1, sampleRate = fs)()
+    # frame-wise calculation, all the frames of the file (framed like ess.FrameGenerator). WAV files at the
+    # analysis sample rate are streamed from disk, other files are decoded and resampled by ess.MonoLoader
+    reader = None
+    if filename1.lower().endswith('.wav'):
+        try:
+            reader = WavReader(filename1)
+        except ValueError:
+            reader = None
 
-    # rms mean
-    # rms = []
-    # for frame in ess.FrameGenerator(audio, frameSize=frameSize, hopSize=hopSize):
-    #     rms.append(RMS(frame, frameSize))
-    # rmsMean = np.mean(rms)
-    # print 'rmsMean', rmsMean
-
-    for frame in ess.FrameGenerator(audio, frameSize=frameSize, hopSize=hopSize):
-        fs = pYinInst.process(frame)
+    if reader is not None and reader.sampleRate == fs:
+        fs = pYinInst.processStream(reader.blocks())
+    else:
+        import essentia.standard as ess
+        audio = ess.MonoLoader(filename = filename1, sampleRate = fs)()
+        fs = pYinInst.processSignal(audio)
 
     # calculate smoothed pitch and mono note
     monoPitch = pYinInst.getSmoothedPitchTrack()
+    fs = pYinInst.getRemainingFeatures(monoPitch)
+
+    return monoPitch, fs
+
+def pYINPtNote(filename1,fs=44100,frameSize=2048,hopSize=256):
+
+    '''
+    Given filename, return pitchtrack and note transcription track
+    :param filename1:
+    :param fs:
+    :param frameSize:
+    :param hopSize:
+    :return:
+    '''
+    monoPitch, fs = pYINPtNoteFeatures(filename1, fs, frameSize, hopSize)
 
     # output smoothed pitch track
     print 'pitch track'
@@ -80,8 +103,6 @@ def pYINPtNote(filename1,fs=44100,frameSize=2048,hopSize=256):
         print ii.values
     print '\n'
 
-    fs = pYinInst.getRemainingFeatures(monoPitch)
-
     # output of mono notes,
     # column 0: frame number,
     # column 1: pitch in midi numuber, this is the decoded pitch
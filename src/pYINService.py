@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+
+'''
+ * Copyright (C) 2015  Music Technology Group - Universitat Pompeu Fabra
+ *
+ * This file is part of pypYIN
+ *
+ * pypYIN is free software: you can redistribute it and/or modify it under
+ * the terms of the GNU Affero General Public License as published by the Free
+ * Software Foundation (FSF), either version 3 of the License, or (at your
+ * option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful, but WITHOUT
+ * ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+ * FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+ * details.
+ *
+ * You should have received a copy of the Affero GNU General Public License
+ * version 3 along with this program.  If not, see http://www.gnu.org/licenses/
+ *
+ * If you have any problem about this python version code, please contact: Rong Gong
+ * rong.gong@upf.edu
+ *
+ * If you have any problem about this algorithm, I suggest you to contact: Matthias Mauch
+ * m.mauch@qmul.ac.uk who is the original C++ version author of this algorithm
+ *
+ * If you want to refer this code, please consider this article:
+ *
+ * M. Mauch and S. Dixon,
+ * “pYIN: A Fundamental Frequency Estimator Using Probabilistic Threshold Distributions”,
+ * in Proceedings of the IEEE International Conference on Acoustics,
+ * Speech, and Signal Processing (ICASSP 2014), 2014.
+ *
+ * M. Mauch, C. Cannam, R. Bittner, G. Fazekas, J. Salamon, J. Dai, J. Bello and S. Dixon,
+ * “Computer-aided Melody Note Transcription Using the Tony Software: Accuracy and Efficiency”,
+ * in Proceedings of the First International Conference on Technologies for
+ * Music Notation and Representation, 2015.
+'''
+
+import os, sys
+import json
+import time
+import argparse
+import threading
+import traceback
+import multiprocessing
+import BaseHTTPServer
+import SocketServer
+import urlparse
+import numpy as np
+import pYINmain
+import SparseHMM
+from MonoPitch import MonoPitch
+from MonoNote import MonoNote
+from pYINPtNote import pYINPtNoteFeatures
+from pYINBatch import featureArrays
+
+# the PyinMain of a worker process, see initWorker
+workerInst = None
+workerParam = None
+
+def initWorker(param):
+
+    # one PyinMain per worker, and the HMMs built once into the model cache, so that no request pays for them
+    global workerInst, workerParam
+    workerParam = param
+    if param['modelCacheDir'] is not None:
+        SparseHMM.setModelCacheDir(param['modelCacheDir'])
+    MonoPitch()
+    MonoNote()
+    workerInst = pYINmain.PyinMain()
+
+def analyseJob(job):
+
+    # analyses the file job['path'] or the samples job['samples'] in a worker; returns the outputs as
+    # lists (see pYINBatch.featureArrays) with the seconds taken and None, or None and the error message
+    startTime = time.time()
+    try:
+        workerInst.initialise(channels = 1, inputSampleRate = workerParam['fs'], stepSize = workerParam['hopSize'],
+                              blockSize = workerParam['frameSize'], lowAmp = 0.25, onsetSensitivity = 0.7,
+                              pruneThresh = 0.1, outputs = job.get('outputs'))
+        if job.get('path') is not None:
+            monoPitch, fs = pYINPtNoteFeatures(job['path'], workerParam['fs'], workerParam['frameSize'],
+                                               workerParam['hopSize'], workerInst)
+        else:
+            workerInst.processSignal(job['samples'])
+            monoPitch = workerInst.getSmoothedPitchTrack()
+            fs = workerInst.getRemainingFeatures(monoPitch)
+
+        result = dict((name, values.tolist()) for name, values in featureArrays(monoPitch, fs).items())
+        result['seconds'] = time.time() - startTime
+        return result, None
+    except Exception:
+        # returned rather than raised: the pool only calls back for jobs that return
+        return None, traceback.format_exc().strip().split('\n')[-1]
+
+class AnalysisService(object):
+
+    # pool of jobs warm worker processes and the table of the submitted jobs. At most jobs requests are
+    # analysed at once and maxQueued more wait; submit() refuses the ones after that (backpressure).
+    # Finished jobs are kept until their result is fetched, at most maxKept of them. Files are read with
+    # the rights of the service: with rootDir, only the files under rootDir can be analysed. Thread safe
+    def __init__(self, jobs = None, maxQueued = 16, maxKept = 256, fs = 44100, frameSize = 2048, hopSize = 256,
+                 modelCacheDir = None, rootDir = None):
+        self.jobs = jobs if jobs is not None else multiprocessing.cpu_count()
+        self.maxQueued = maxQueued
+        self.maxKept = maxKept
+        self.rootDir = os.path.realpath(rootDir) if rootDir is not None else None
+        self.param = dict(fs = fs, frameSize = frameSize, hopSize = hopSize, modelCacheDir = modelCacheDir)
+        self.pool = multiprocessing.Pool(self.jobs, initWorker, (self.param,))
+
+        self.lock = threading.Condition()
+        self.nextId = 0
+        self.pending = {}  # id -> AsyncResult
+        self.finished = {}  # id -> (result, error), in the order they finished
+        self.finishOrder = []
+
+    def resolvePath(self, path):
+
+        # the file to analyse for the path of a job: relative to rootDir and not outside it, if there is one
+        if self.rootDir is None:
+            return path
+        resolved = os.path.realpath(os.path.join(self.rootDir, path))
+        if not resolved.startswith(os.path.join(self.rootDir, '')):
+            raise ValueError('path outside the root directory: ' + path)
+        return resolved
+
+    def submit(self, job):
+
+        # returns the job id, or None if the queue is full
+        with self.lock:
+            self.collectFailed()
+            if len(self.pending) >= self.jobs + self.maxQueued:
+                return None
+            jobId = self.nextId
+            self.nextId += 1
+            self.pending[jobId] = self.pool.apply_async(analyseJob, (job,),
+                                                        callback=lambda output: self.finish(jobId, *output))
+            return jobId
+
+    def finish(self, jobId, result, error):
+
+        # called by the pool's result thread
+        with self.lock:
+            self.pending.pop(jobId, None)
+            self.finished[jobId] = (result, error)
+            self.finishOrder.append(jobId)
+            while len(self.finishOrder) > self.maxKept:
+                self.finished.pop(self.finishOrder.pop(0), None)
+            self.lock.notify_all()
+
+    def collectFailed(self):
+
+        # analyseJob returns its errors, but a job can still fail in the pool itself (its arguments or
+        # its result not pickled), and then there is no callback: such jobs are finished here, so that
+        # they do not hold a place in the queue. Called with the lock held
+        for jobId, asyncResult in self.pending.items():
+            if asyncResult.ready() and not asyncResult.successful():
+                try:
+                    asyncResult.get()
+                except Exception as e:
+                    self.finish(jobId, None, '%s: %s' % (type(e).__name__, e))
+
+    def status(self, jobId, timeout = 0):
+
+        # ('pending', None), ('done', result), ('failed', error message) or ('unknown', None); waits up to
+        # timeout seconds for a pending job. A finished job is forgotten once its status has been returned
+        deadline = time.time() + timeout
+        with self.lock:
+            while True:
+                self.collectFailed()
+                if jobId in self.finished:
+                    result, error = self.finished.pop(jobId)
+                    self.finishOrder.remove(jobId)
+                    return ('failed', error) if error is not None else ('done', result)
+                if jobId not in self.pending:
+                    return 'unknown', None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return 'pending', None
+                self.lock.wait(min(remaining, 0.1))
+
+    def load(self):
+        with self.lock:
+            return dict(workers = self.jobs, pending = len(self.pending), maxQueued = self.maxQueued,
+                        finished = len(self.finished))
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+class ServiceRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # POST /jobs                       JSON {"path": ..., "outputs": [...]}, or the raw float32 samples
+    #                                  (Content-Type application/octet-stream, ?sampleRate=&outputs=a,b)
+    #                                  202 {"id": ...}, 503 if the queue is full; ?wait=seconds answers like GET
+    # GET /jobs/<id>?wait=seconds      200 the outputs, 202 still pending, 404 unknown, 500 failed
+    # GET /status                      the load of the service
+    # There is no authentication and a path job reads any file the service can read (see rootDir):
+    # serve on localhost or on a unix socket only
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        if url.path != '/jobs':
+            return self.reply(404, {'error': 'unknown path ' + url.path})
+
+        body = self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        try:
+            if self.headers.getheader('Content-Type', '').startswith('application/octet-stream'):
+                sampleRate = int(query.get('sampleRate', [self.server.service.param['fs']])[0])
+                if sampleRate != self.server.service.param['fs']:
+                    raise ValueError('samples must be at %d Hz' % self.server.service.param['fs'])
+                job = dict(samples = np.frombuffer(body, dtype='<f4'))
+                if 'outputs' in query:
+                    job['outputs'] = query['outputs'][0].split(',')
+            else:
+                request = json.loads(body)
+                job = dict(path = self.server.service.resolvePath(request['path']), outputs = request.get('outputs'))
+            if job.get('outputs') is not None and not set(job['outputs']) <= set(pYINmain.outputNames):
+                raise ValueError('unknown outputs, choose from ' + ','.join(pYINmain.outputNames))
+            wait = self.parseWait(query)
+        except KeyError as e:
+            return self.reply(400, {'error': 'missing %s' % e})
+        except (ValueError, TypeError) as e:
+            return self.reply(400, {'error': str(e)})
+
+        jobId = self.server.service.submit(job)
+        if jobId is None:
+            return self.reply(503, {'error': 'too many pending requests'}, {'Retry-After': '1'})
+        if wait is not None:
+            return self.replyStatus(jobId, wait)
+        self.reply(202, {'id': jobId})
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+        if parts == ['status']:
+            return self.reply(200, self.server.service.load())
+        if len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+            try:
+                wait = self.parseWait(query)
+            except ValueError as e:
+                return self.reply(400, {'error': str(e)})
+            return self.replyStatus(int(parts[1]), wait or 0)
+        self.reply(404, {'error': 'unknown path ' + url.path})
+
+    def parseWait(self, query):
+        # the seconds of ?wait=, None without it
+        if 'wait' not in query:
+            return None
+        try:
+            wait = float(query['wait'][0])
+        except ValueError:
+            wait = -1
+        if not 0 <= wait < float('inf'):
+            raise ValueError('wait must be a number of seconds')
+        return wait
+
+    def replyStatus(self, jobId, wait):
+        status, result = self.server.service.status(jobId, wait)
+        if status == 'done':
+            self.reply(200, result)
+        elif status == 'pending':
+            self.reply(202, {'id': jobId, 'status': status})
+        elif status == 'failed':
+            self.reply(500, {'id': jobId, 'error': result})
+        else:
+            self.reply(404, {'id': jobId, 'error': 'unknown job'})
+
+    def reply(self, code, content, headers = {}):
+        body = json.dumps(content)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # the client address of a unix socket is not a (host, port) pair
+        client = self.client_address[0] if isinstance(self.client_address, tuple) else 'unix socket'
+        sys.stderr.write('%s - - [%s] %s\n' % (client, self.log_date_time_string(), format % args))
+
+class ServiceHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class ServiceUnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # BaseHTTPRequestHandler wants these
+        SocketServer.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+def serve(service, host = 'localhost', port = 8020, socketPath = None):
+
+    # serves the service on host:port, or on the unix socket socketPath, until interrupted. Not meant to be
+    # reachable from other machines, see ServiceRequestHandler
+    if socketPath is not None:
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+        server = ServiceUnixServer(socketPath, ServiceRequestHandler)
+    else:
+        server = ServiceHTTPServer((host, port), ServiceRequestHandler)
+    server.service = service
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if socketPath is not None and os.path.exists(socketPath):
+            os.remove(socketPath)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='pYIN pitch track and note transcription service with warm workers')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8020)
+    parser.add_argument('--socket', default=None, help='serve on this unix socket instead of host:port')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes, default: number of cpus')
+    parser.add_argument('--max-queued', type=int, default=16, help='requests waiting for a worker before 503')
+    parser.add_argument('--fs', type=int, default=44100, help='sample rate of the analysis')
+    parser.add_argument('--frame-size', type=int, default=2048)
+    parser.add_argument('--hop-size', type=int, default=256)
+    parser.add_argument('--model-cache', default=None, help='directory of the on-disk HMM model cache')
+    parser.add_argument('--root', default=None, help='only analyse the files under this directory, paths relative to it')
+    args = parser.parse_args()
+
+    service = AnalysisService(args.jobs, args.max_queued, fs = args.fs, frameSize = args.frame_size,
+                              hopSize = args.hop_size, modelCacheDir = args.model_cache, rootDir = args.root)
+    serve(service, args.host, args.port, args.socket)
\ No newline at end of file
@@ -38,30 +38,211 @@
 '''
 
 import numpy as np
-import copy
+import tempfile
 from math import *
 from Yin import *
-from YinUtil import RMS
+from YinUtil import frameSignal
+from AudioStream import streamFrames
 from MonoPitch import MonoPitch
-from MonoNote import MonoNote
+from MonoNote import MonoNote, FrameOutputs
+import ParallelYin
+
+# the outputs PyinMain.initialise can be asked for, the FeatureSet columns m_oF0Candidates, m_oF0Probs,
+# m_oVoicedProb, m_oCandidateSalience, m_oSmoothedPitchTrack, m_oMonoNoteOut, m_oNotes and m_oNotePitchTracks;
+# all but the salience by default
+outputNames = ('f0candidates', 'f0probs', 'voicedprob', 'candidatesalience', 'smoothedpitchtrack',
+               'mononotes', 'notes', 'notepitchtracks')
+defaultOutputs = ('f0candidates', 'f0probs', 'voicedprob', 'smoothedpitchtrack', 'mononotes', 'notes',
+                  'notepitchtracks')
 
 class Feature(object):
-    def __init__(self):
-        self.values = np.array([], dtype=np.float64)
+    def __init__(self, values = None):
+        self.values = np.array([], dtype=np.float64) if values is None else values
 
     def resetValues(self):
         self.values = np.array([], dtype=np.float64)
 
+class GrowingArray(object):
+
+    # 1d array growing by append/extend in amortised constant time, values is the filled part;
+    # len(), indexing and np.asarray() work on values, like on the array it replaces
+    def __init__(self, dtype = np.float64):
+        self.data = np.zeros((16,), dtype=dtype)
+        self.size = 0
+
+    @property
+    def values(self):
+        return self.data[:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def __array__(self, dtype = None):
+        return self.values if dtype is None else self.values.astype(dtype)
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype).ravel()
+        if self.size + len(values) > len(self.data):
+            self.reserve(max(2*len(self.data), self.size + len(values)))
+        self.data[self.size:self.size+len(values)] = values
+        self.size += len(values)
+
+    def append(self, value):
+        self.extend([value])
+
+    def reserve(self, capacity):
+        data = np.zeros((capacity,), dtype=self.data.dtype)
+        data[:self.size] = self.data[:self.size]
+        self.data = data
+
+class MappedGrowingArray(GrowingArray):
+
+    # GrowingArray memory mapped to an anonymous temporary file in directory, the system can write
+    # its pages out instead of keeping them in memory; the file is gone once the array is
+    def __init__(self, dtype = np.float64, directory = None):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.data = np.zeros((0,), dtype=dtype)
+        self.size = 0
+        self.reserve(4096)
+
+    def reserve(self, capacity):
+        # growing the file keeps its content, the old map is dropped
+        self.file.truncate(capacity * self.data.dtype.itemsize)
+        self.data = np.memmap(self.file, dtype=self.data.dtype, mode='r+', shape=(capacity,))
+
+class FeatureColumn(object):
+
+    # one value per frame (or note) in one array; indexing and iterating give the legacy Feature objects
+    def __init__(self, dtype = np.float64):
+        self.array = GrowingArray(dtype)
+
+    @property
+    def values(self):
+        return self.array.values
+
+    def append(self, value):
+        self.array.append(value)
+
+    def extend(self, values):
+        self.array.extend(values)
+
+    def __len__(self):
+        return self.array.size
+
+    def getItem(self, i):
+        return self.values[i:i+1]
+
+    def __getitem__(self, i):
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError(i)
+        return Feature(self.getItem(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+class RaggedFeatureColumn(FeatureColumn):
+
+    # a variable number of values per frame: the values of frame i are values[frameOffsets[i]:frameOffsets[i+1]]
+    def __init__(self, dtype = np.float64):
+        FeatureColumn.__init__(self, dtype)
+        self.offsets = GrowingArray(np.intp)
+        self.offsets.append(0)
+
+    @property
+    def frameOffsets(self):
+        return self.offsets.values
+
+    def append(self, frameValues):
+        self.array.extend(frameValues)
+        self.offsets.append(self.array.size)
+
+    def extend(self, values, frameOffsets):
+        # several frames at once, frame i is values[frameOffsets[i]:frameOffsets[i+1]]
+        self.array.extend(values[frameOffsets[0]:frameOffsets[-1]])
+        self.offsets.extend(np.asarray(frameOffsets[1:]) - frameOffsets[0] + self.offsets.values[-1])
+
+    def __len__(self):
+        return self.offsets.size - 1
+
+    def getItem(self, i):
+        return self.values[self.frameOffsets[i]:self.frameOffsets[i+1]]
+
+class RaggedColumn(RaggedFeatureColumn):
+
+    # RaggedFeatureColumn whose items are the arrays themselves
+    def __getitem__(self, i):
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError(i)
+        return self.getItem(i)
+
+class SalienceColumn(RaggedFeatureColumn):
+
+    # one salience row (a value per lag) per frame. format: 'dense' keeps the rows as they are, 'float16'
+    # rounds them to float16, 'sparse' only keeps the lags with a non-zero value (and those values, exact).
+    # directory: the values (and lags) go to memory mapped temporary files there instead of memory.
+    # Indexing gives a Feature like the other columns, its values the row with all the lags (float16 for
+    # 'float16'); rows(start, end) gives the rows of several frames as one array
+    def __init__(self, format = 'sparse', directory = None):
+        if format not in ('dense', 'float16', 'sparse'):
+            raise ValueError('unknown salience format ' + str(format))
+        if directory is not None:
+            newArray = lambda dtype: MappedGrowingArray(dtype, directory)
+        else:
+            newArray = GrowingArray
+        self.format = format
+        self.nLag = 0
+        self.array = newArray(np.float16 if format == 'float16' else np.float64)
+        self.lags = newArray(np.intp) if format == 'sparse' else None
+        self.offsets = GrowingArray(np.intp)
+        self.offsets.append(0)
+
+    def extend(self, salience):
+        # salience: one row per frame
+        self.nLag = salience.shape[1]
+        if self.format == 'sparse':
+            iFrame, iLag = np.nonzero(salience)
+            self.array.extend(salience[iFrame, iLag])
+            self.lags.extend(iLag)
+            self.offsets.extend(np.cumsum(np.bincount(iFrame, minlength=salience.shape[0])) + self.offsets.values[-1])
+        else:
+            self.array.extend(salience)
+            self.offsets.extend(np.arange(1, salience.shape[0]+1) * self.nLag + self.offsets.values[-1])
+
+    def append(self, frameSalience):
+        self.extend(np.reshape(frameSalience, (1, -1)))
+
+    def rows(self, start, end):
+        # salience of frames start..end-1, one row per frame
+        if self.format != 'sparse':
+            return self.values[self.frameOffsets[start]:self.frameOffsets[end]].reshape((end-start, self.nLag))
+        out = np.zeros((end-start, self.nLag), dtype=np.float64)
+        nValue = np.diff(self.frameOffsets[start:end+1])
+        iValue = slice(self.frameOffsets[start], self.frameOffsets[end])
+        out[np.repeat(np.arange(end-start), nValue), self.lags.values[iValue]] = self.values[iValue]
+        return out
+
+    def getItem(self, i):
+        return self.rows(i, i+1)[0]
+
 class FeatureSet(object):
-    def __init__(self):
-        self.m_oF0Candidates = []
-        self.m_oF0Probs = []
-        self.m_oVoicedProb = []
-        self.m_oCandidateSalience = []
-        self.m_oSmoothedPitchTrack = []
-        self.m_oMonoNoteOut = []
-        self.m_oNotes = []
-        self.m_oNotePitchTracks = []
+
+    # columnar outputs, m_oVoicedProb, m_oSmoothedPitchTrack and m_oNotes have one value per frame or note,
+    # the other ones a variable number (see RaggedFeatureColumn); the frame by frame decoded notes are
+    # arrays too (MonoNote.FrameOutputs). Indexing any of them still gives the legacy per frame objects.
+    # m_oCandidateSalience stays empty unless PyinMain is asked for it, see SalienceColumn
+    def __init__(self, salienceFormat = 'sparse', salienceDirectory = None):
+        self.m_oF0Candidates = RaggedFeatureColumn()
+        self.m_oF0Probs = RaggedFeatureColumn()
+        self.m_oVoicedProb = FeatureColumn()
+        self.m_oCandidateSalience = SalienceColumn(salienceFormat, salienceDirectory)
+        self.m_oSmoothedPitchTrack = FeatureColumn()
+        self.m_oMonoNoteOut = FrameOutputs()
+        self.m_oNotes = FeatureColumn()
+        self.m_oNotePitchTracks = RaggedColumn()
 
 class PyinMain(object):
 
@@ -83,12 +264,35 @@ class PyinMain(object):
         self.m_pruneThresh = 0.1
 
         self.m_pitchProb = []
-        self.m_level = np.array([], dtype=np.float32)
+        self.m_level = GrowingArray()  # rms of every frame
+
+        # number of frames analysed together by processSignal/processFrames
+        self.m_frameBatchSize = 256
+
+        # format of the salience output (see SalienceColumn), None for no salience output,
+        # and the directory to spill it to (None: in memory)
+        self.m_salienceFormat = None
+        self.m_salienceDirectory = None
+
+        # the outputs computed and stored, see outputNames
+        self.m_outputs = set(defaultOutputs)
+
+        # worker processes of the segment-parallel Viterbi decoding of the pitch track, None decodes
+        # sequentially; the SegmentReport of the last decoding, see SparseHMM.decodeViterbiSegments.
+        # The note track is always decoded sequentially, see MonoNote
+        self.m_decodeJobs = None
+        self.m_pitchSegmentReport = None
+
+        # log-domain decoding and the float type of its delta, transitions and observations (np.float32
+        # halves the memory traffic), see SparseHMM.decodeViterbi
+        self.m_logDomain = False
+        self.m_decodeDtype = np.float64
 
         self.fs = FeatureSet()
 
     def initialise(self, channels = 1, inputSampleRate = 44100, stepSize = 256, blockSize = 2048,
-                   lowAmp = 0.1, onsetSensitivity = 0.7, pruneThresh = 0.1 ):
+                   lowAmp = 0.1, onsetSensitivity = 0.7, pruneThresh = 0.1, fmin = 40, fmax = 1600,
+                   salience = None, salienceDirectory = None, outputs = None):
 
         if channels != 1:
             return False
@@ -97,11 +301,25 @@ class PyinMain(object):
         self.m_inputSampleRate = inputSampleRate
         self.m_stepSize = stepSize
         self.m_blockSize = blockSize
+        self.m_fmin = fmin
+        self.m_fmax = fmax
 
         self.m_lowAmp = lowAmp
         self.m_onsetSensitivity = onsetSensitivity
         self.m_pruneThresh = pruneThresh
 
+        # outputs: names of outputNames, nothing is computed only for the others (no note decoding without
+        # note outputs, no pitch probabilities without any pitch track); salience: its format, implies it
+        self.m_outputs = set(defaultOutputs if outputs is None else outputs)
+        if not self.m_outputs <= set(outputNames):
+            raise ValueError('unknown outputs ' + ', '.join(sorted(self.m_outputs - set(outputNames))))
+        if salience is not None:
+            self.m_outputs.add('candidatesalience')
+        elif 'candidatesalience' in self.m_outputs:
+            salience = 'sparse'
+        self.m_salienceFormat = salience
+        self.m_salienceDirectory = salienceDirectory
+
         self.reset()
 
         return True
@@ -111,102 +329,181 @@ class PyinMain(object):
         self.m_yin.setThresholdDistr(self.m_threshDistr)
         self.m_yin.setFrameSize(self.m_blockSize)
         self.m_yin.setFast(not self.m_preciseTime)
+        self.m_yin.setInputSampleRate(self.m_inputSampleRate)
+        self.m_yin.setFrequencyRange(self.m_fmin, self.m_fmax)
 
         self.m_pitchProb = np.array([], dtype=np.float64)
-        self.m_level = np.array([], dtype=np.float32)
+        self.m_level = GrowingArray()
+
+        if self.m_salienceFormat is not None:
+            self.fs = FeatureSet(self.m_salienceFormat, self.m_salienceDirectory)
+        else:
+            self.fs = FeatureSet()
 
     def process(self, inputBuffers):
 
-        dInputBuffers = np.zeros((self.m_blockSize,), dtype=np.float64)
-        for i in range(self.m_blockSize):
-            dInputBuffers[i] = inputBuffers[i]
+        # float32/float64 frames (views too) are analysed as they are, anything else is converted once
+        inputBuffers = np.asarray(inputBuffers)
+        if inputBuffers.dtype != np.float32 and inputBuffers.dtype != np.float64:
+            inputBuffers = inputBuffers.astype(np.float64)
 
-        rms = RMS(inputBuffers, self.m_blockSize)
+        yo = self.m_yin.processProbabilisticYin(inputBuffers[:self.m_blockSize])
 
-        isLowAmplitude = rms < self.m_lowAmp
+        # the energy of the frame comes with the yin output
+        rms = sqrt(yo.frameEnergy/self.m_blockSize)
+
+        self.m_level.append(yo.rms)
+
+        return self.storeYinOutput(yo, rms)
+
+    def processSignal(self, audio):
+
+        # analyse a whole signal at once, framed like ess.FrameGenerator(audio, blockSize, stepSize)
+        return self.processFrames(frameSignal(audio, self.m_blockSize, self.m_stepSize))
+
+    def processFrames(self, frames):
+
+        # same state as calling process() on every row of frames, but the yin analysis of
+        # m_frameBatchSize frames is done at once
+        for iStart in range(0, len(frames), self.m_frameBatchSize):
+            # float32 frames stay float32, like in process(), for the same gate energy
+            batch = np.asarray(frames[iStart:iStart+self.m_frameBatchSize])
+            if batch.dtype != np.float32 and batch.dtype != np.float64:
+                batch = batch.astype(np.float64)
+
+            self.storeYinFrames(self.m_yin.processProbabilisticYinFrames(batch))
+
+        return self.fs
+
+    def processStream(self, blocks):
+
+        # processSignal of the concatenated blocks of samples (like AudioStream.WavReader.blocks()),
+        # framed as they come in: the signal is never in memory as a whole
+        for frames in streamFrames(blocks, self.m_blockSize, self.m_stepSize):
+            self.processFrames(frames)
+
+        return self.fs
+
+    def processSignalParallel(self, audio, jobs = None, chunkSize = None):
+
+        # processSignal with the yin analysis spread over jobs processes (default: one per cpu), chunkSize
+        # frames per task. The state is the same as processSignal's. Forks worker processes, so it
+        # cannot be called from a daemonic process such as a pYINBatch worker
+        if jobs == 1:
+            return self.processSignal(audio)
+
+        for yos in ParallelYin.analyseSignal(self.m_yin, audio, self.m_blockSize, self.m_stepSize,
+                                             jobs, chunkSize, self.m_frameBatchSize,
+                                             salience=self.m_salienceFormat is not None):
+            self.storeYinFrames(yos)
+
+        return self.fs
+
+    def storeYinFrames(self, yos):
+
+        rms = np.sqrt(yos.frameEnergy/self.m_blockSize)
+
+        self.m_level.extend(yos.rms)
+
+        if self.wantsPitchProb():
+            for iFrame in range(len(yos.rms)):
+                self.storePitchProb(yos.freqProb[yos.frameOffsets[iFrame]:yos.frameOffsets[iFrame+1]], rms[iFrame])
+        self.storeFeatures(yos.freqProb, yos.frameOffsets, yos.salience)
+
+        return self.fs
+
+    def storeYinOutput(self, yo, rms):
+
+        freqProb = np.reshape(yo.freqProb, (-1, 2))
+        if self.wantsPitchProb():
+            self.storePitchProb(freqProb, rms)
+        self.storeFeatures(freqProb, np.array([0, len(freqProb)]), yo.salience)
+
+        return self.fs
+
+    def wantsOutput(self, *names):
+        return any(name in self.m_outputs for name in names)
 
-        yo = self.m_yin.processProbabilisticYin(dInputBuffers)
+    def wantsPitchProb(self):
+        # the pitch probabilities are only decoded, into the smoothed pitch track and the notes
+        return self.wantsOutput('smoothedpitchtrack', 'mononotes', 'notes', 'notepitchtracks')
 
-        self.m_level = np.append(self.m_level, yo.rms)
+    def storePitchProb(self, freqProb, rms):
+
+        tempPitchProb = self.framePitchProb(freqProb, rms)
+        if len(self.m_pitchProb) < 1 and len(tempPitchProb) > 0:
+            self.m_pitchProb = [tempPitchProb,]
+        elif len(self.m_pitchProb) >= 1:
+            self.m_pitchProb.append(tempPitchProb)
+
+    def framePitchProb(self, freqProb, rms):
+
+        # the (midi pitch, probability) pairs of the candidates of one frame, as decoded by MonoPitch
+        isLowAmplitude = rms < self.m_lowAmp
 
         '''
         First, get the things out of the way that we don't want to output
         immediately, but instead save for later
         '''
-        tempPitchProb = np.array([], dtype=np.float32)
-        firstStack = False
-        for iCandidate in range(yo.freqProb.shape[0]):
-            tempPitch = 12.0 * log(yo.freqProb[iCandidate][0]/440.0)/log(2.0) + 69.0
+        tempPitchProb = []
+        for iCandidate in range(freqProb.shape[0]):
+            tempPitch = 12.0 * log(freqProb[iCandidate][0]/440.0)/log(2.0) + 69.0
             if not isLowAmplitude:
-                if firstStack == False:
-                    tempPitchProb = np.array([np.array([tempPitch, yo.freqProb[iCandidate][1]], dtype=np.float64),])
-                    firstStack = True
-                else:
-                    tempPitchProb = np.vstack((tempPitchProb, np.array([tempPitch, yo.freqProb[iCandidate][1]], dtype=np.float64)))
+                tempPitchProb.append([tempPitch, freqProb[iCandidate][1]])
             else:
                 factor = ((rms+0.01*self.m_lowAmp)/(1.01*self.m_lowAmp))
-                if firstStack == False:
-                    tempPitchProb = np.array([np.array([tempPitch, yo.freqProb[iCandidate][1]*factor], dtype=np.float64),])
-                    firstStack = True
-                else:
-                    tempPitchProb = np.vstack((tempPitchProb, np.array([tempPitch, yo.freqProb[iCandidate][1]*factor], dtype=np.float64)))
-        if len(self.m_pitchProb) < 1 and len(tempPitchProb) > 0:
-            self.m_pitchProb = [tempPitchProb,]
-        elif len(self.m_pitchProb) >= 1:
-            self.m_pitchProb = self.m_pitchProb + [tempPitchProb]
-
-        # f0 CANDIDATES
-        f = Feature()
-        for i in range(yo.freqProb.shape[0]):
-            f.values = np.append(f.values, yo.freqProb[i][0])
-        self.fs.m_oF0Candidates.append(copy.copy(f))
-
-        f.resetValues()
-        voicedProb = 0.0
-        for i in range(yo.freqProb.shape[0]):
-            f.values = np.append(f.values, yo.freqProb[i][1])
-            voicedProb += yo.freqProb[i][1]
-        self.fs.m_oF0Probs.append(copy.copy(f))
-
-        f.values = np.append(f.values, voicedProb)
-        self.fs.m_oVoicedProb.append(copy.copy(f))
-
-        # SALIENCE -- maybe this should eventually disappear
-        f.resetValues()
-        salienceSum = 0.0
-        for iBin in range(yo.salience.shape[0]):
-            f.values = np.append(f.values, yo.salience[iBin])
-            salienceSum += yo.salience[iBin]
-        self.fs.m_oCandidateSalience.append(copy.copy(f))
-
-        return self.fs
+                tempPitchProb.append([tempPitch, freqProb[iCandidate][1]*factor])
+        if len(tempPitchProb) > 0:
+            return np.array(tempPitchProb, dtype=np.float64)
+        else:
+            return np.array([], dtype=np.float32)
+
+    def storeFeatures(self, freqProb, frameOffsets, salience):
+
+        # f0 CANDIDATES and their probabilities of the frames, the candidates of frame i are
+        # frameOffsets[i] to frameOffsets[i+1] of freqProb; one salience row per frame
+        if self.wantsOutput('f0candidates'):
+            self.fs.m_oF0Candidates.extend(freqProb[:, 0], frameOffsets)
+        if self.wantsOutput('f0probs'):
+            self.fs.m_oF0Probs.extend(freqProb[:, 1], frameOffsets)
+
+        # voiced probability: the sum of the candidate probabilities, in candidate order
+        nCandidate = np.diff(frameOffsets)
+        if self.wantsOutput('voicedprob'):
+            candProb = np.zeros((len(nCandidate), max(np.max(nCandidate), 1)), dtype=np.float64)
+            iCandidate = np.arange(frameOffsets[-1]-frameOffsets[0]) - np.repeat(frameOffsets[:-1]-frameOffsets[0], nCandidate)
+            candProb[np.repeat(np.arange(len(nCandidate)), nCandidate), iCandidate] = freqProb[frameOffsets[0]:frameOffsets[-1], 1]
+            self.fs.m_oVoicedProb.extend(np.cumsum(candProb, axis=1)[:, -1])
+
+        # SALIENCE, only if asked for
+        if self.m_salienceFormat is not None:
+            self.fs.m_oCandidateSalience.extend(np.reshape(salience, (len(nCandidate), -1)))
 
     def getSmoothedPitchTrack(self):
-        f = Feature()
 
         if len(self.m_pitchProb) == 0:
-            return self.fs
+            return np.array([], dtype=np.float64)  # no pitched frame, nothing to smooth
 
         # MONO-PITCH STUFF
         mp = MonoPitch()
+        mp.decodeJobs = self.m_decodeJobs
+        mp.logDomain = self.m_logDomain
+        mp.decodeDtype = self.m_decodeDtype
         mpOut = mp.process(self.m_pitchProb)
-        for iFrame in range(len(mpOut)):
-            if mpOut[iFrame] < 0 and self.m_outputUnvoiced == 0:
-                continue
-            f.resetValues()
-            if self.m_outputUnvoiced == 1:
-                f.values = np.append(f.values, np.fabs(mpOut[iFrame]))
+        self.m_pitchSegmentReport = mp.segmentReport
+        if self.wantsOutput('smoothedpitchtrack'):
+            if self.m_outputUnvoiced == 0:
+                self.fs.m_oSmoothedPitchTrack.extend(mpOut[mpOut >= 0])
+            elif self.m_outputUnvoiced == 1:
+                self.fs.m_oSmoothedPitchTrack.extend(np.fabs(mpOut))
             else:
-                f.values = np.append(f.values, mpOut[iFrame])
-
-            self.fs.m_oSmoothedPitchTrack.append(copy.copy(f))
+                self.fs.m_oSmoothedPitchTrack.extend(mpOut)
 
         return mpOut
 
     def getRemainingFeatures(self,mpOut):
-        f = Feature()
 
-        if len(mpOut) == 0:
+        if len(mpOut) == 0 or not self.wantsOutput('mononotes', 'notes', 'notepitchtracks'):
             return self.fs
 
         # if len(self.m_pitchProb) == 0:
@@ -236,43 +533,45 @@ class PyinMain(object):
                 temp += [[tempPitch, 0.9]]
             smoothedPitch += [temp]
 
+        mn.logDomain = self.m_logDomain
+        mn.decodeDtype = self.m_decodeDtype
         mnOut = mn.process(smoothedPitch)
 
-        self.fs.m_oMonoNoteOut = mnOut
+        if self.wantsOutput('mononotes'):
+            self.fs.m_oMonoNoteOut = mnOut
 
         # turning feature into a note feature
 
-        f.resetValues()
-
         onsetFrame = 0
         isVoiced = 0
         oldIsVoiced = 0
         nFrame = len(self.m_pitchProb)
 
         minNoteFrames = (self.m_inputSampleRate*self.m_pruneThresh)/self.m_stepSize
+        level = self.m_level.values
 
-        notePitchTrack = np.array([], dtype=np.float32) # collects pitches for one note at a time
+        notePitchTrack = [] # collects pitches for one note at a time
         for iFrame in range(nFrame):
-            isVoiced = mnOut[iFrame].noteState < 3 \
+            isVoiced = mnOut.noteState[iFrame] < 3 \
             and len(smoothedPitch[iFrame]) > 0 \
-            and (iFrame >= nFrame-2 or (self.m_level[iFrame]/self.m_level[iFrame+2]>self.m_onsetSensitivity))
+            and (iFrame >= nFrame-2 or (level[iFrame]/level[iFrame+2]>self.m_onsetSensitivity))
 
             if isVoiced and iFrame != nFrame-1:
                 if oldIsVoiced == 0: # beginning of the note
                     onsetFrame = iFrame
                 pitch = smoothedPitch[iFrame][0][0]
-                notePitchTrack = np.append(notePitchTrack, pitch) # add to the note's pitch
+                notePitchTrack.append(pitch) # add to the note's pitch
             else: # not currently voiced
                 if oldIsVoiced == 1: # end of the note
                     if len(notePitchTrack) >= minNoteFrames:
-                        notePitchTrack = np.sort(notePitchTrack)
+                        notePitchTrack = np.sort(np.array(notePitchTrack, dtype=np.float64))
                         medianPitch = notePitchTrack[int(len(notePitchTrack)/2)]
                         medianFreq = pow(2, (medianPitch-69)/12)*440
-                        f.resetValues()
-                        f.values = np.append(f.values, np.double(medianFreq))
-                        self.fs.m_oNotes.append(copy.copy(f))
-                        self.fs.m_oNotePitchTracks.append(copy.copy(notePitchTrack))
-                    notePitchTrack = np.array([], dtype=np.float32)
+                        if self.wantsOutput('notes'):
+                            self.fs.m_oNotes.append(np.double(medianFreq))
+                        if self.wantsOutput('notepitchtracks'):
+                            self.fs.m_oNotePitchTracks.append(notePitchTrack)
+                    notePitchTrack = []
             oldIsVoiced = isVoiced
 
         return self.fs
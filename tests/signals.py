@@ -0,0 +1,24 @@
+# test signals for the unit tests, and src on the path
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import numpy as np
+
+def tone(f0, duration, amplitude = 0.5, fs = 44100):
+
+    # five harmonics with a 5 Hz vibrato, 20 ms fade in and out
+    t = np.arange(int(duration*fs)) / float(fs)
+    phase = 2*np.pi*f0*t + 0.3*np.sin(2*np.pi*5*t)
+    x = sum((amplitude/h) * np.sin(h*phase) for h in range(1, 6))
+    return x * np.minimum(1, np.minimum(t/0.02, (duration-t)/0.02))
+
+def melody(fs = 44100, seed = 0):
+
+    # a few notes separated by silence and noise, float32 like the output of an audio decoder
+    rng = np.random.RandomState(seed)
+    parts = [np.zeros(int(0.15*fs)), tone(220, 0.4), np.zeros(int(0.1*fs)), tone(330, 0.35, 0.3),
+             tone(294, 0.3, 0.4), 0.01*rng.randn(int(0.1*fs)), tone(110, 0.4, 0.6), tone(523, 0.25, 0.2),
+             np.zeros(int(0.12*fs))]
+    x = np.concatenate(parts)
+    return (x + 0.002*rng.randn(len(x))).astype(np.float32)
@@ -0,0 +1,110 @@
+import os
+import struct
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import scipy.io.wavfile
+from signals import melody
+from AudioStream import WavReader
+
+def wavBytes(format, sampleWidth, channels, data, sampleRate = 44100, extensible = False, extraChunk = None):
+    # a WAV file of the raw sample bytes data, format 1 (PCM) or 3 (float); extraChunk: (id, bytes) of a chunk
+    # put between fmt and data, padded to an even size
+    bits = 8 * sampleWidth
+    fmt = struct.pack('<HHIIHH', 0xFFFE if extensible else format, channels, sampleRate,
+                      sampleRate * channels * sampleWidth, channels * sampleWidth, bits)
+    if extensible:
+        fmt += struct.pack('<HHIH14s', 22, bits, 0, format, '\x00\x00\x00\x00\x10\x00\x80\x00\x00\xAA\x00\x38\x9B\x71')
+    chunks = struct.pack('<4sI', 'fmt ', len(fmt)) + fmt
+    if extraChunk is not None:
+        chunkId, content = extraChunk
+        chunks += struct.pack('<4sI', chunkId, len(content)) + content + '\x00' * (len(content) % 2)
+    chunks += struct.pack('<4sI', 'data', len(data)) + data
+    return 'RIFF' + struct.pack('<I', 4 + len(chunks)) + 'WAVE' + chunks
+
+class WavReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # a stereo test signal: the melody and its quieter inverse, in [-1, 1)
+        audio = melody()
+        self.stereo = np.column_stack([audio, -0.5 * audio]) * np.float32(0.9)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fileName(self, name):
+        return os.path.join(self.directory, name)
+
+    def writeBytes(self, name, content):
+        with open(self.fileName(name), 'wb') as f:
+            f.write(content)
+        return self.fileName(name)
+
+    def expected(self, samples, scale, offset = 0):
+        # the float32 mono mix of integer or float samples, like ess.MonoLoader
+        return np.mean((samples.astype(np.float32) - offset) / np.float32(scale), axis=1, dtype=np.float32)
+
+    def testScipyFormats(self):
+        # PCM 8, 16 and 32 bit and float 32 and 64 bit files written by scipy
+        formats = [(np.round(self.stereo * 127 + 128).astype(np.uint8), 128, 128),
+                   (np.round(self.stereo * 32767).astype(np.int16), 32768, 0),
+                   (np.round(self.stereo.astype(np.float64) * 2147483647).astype(np.int32), 2147483648, 0),
+                   (self.stereo.astype(np.float32), 1, 0),
+                   (self.stereo.astype(np.float64), 1, 0)]
+        for samples, scale, offset in formats:
+            fileName = self.fileName('%s.wav' % samples.dtype)
+            scipy.io.wavfile.write(fileName, 44100, samples)
+            sampleRate, written = scipy.io.wavfile.read(fileName)
+            reader = WavReader(fileName)
+            self.assertEqual((reader.sampleRate, reader.channels, len(reader)), (44100, 2, len(samples)))
+            self.assertTrue(np.array_equal(reader.read(), self.expected(written, scale, offset)), str(samples.dtype))
+
+    def test24Bit(self):
+        samples = np.round(self.stereo.astype(np.float64) * 8388607).astype(np.int32)
+        data = samples.astype('<i4').view(np.uint8).reshape((-1, 4))[:, :3].tostring()
+        reader = WavReader(self.writeBytes('24.wav', wavBytes(1, 3, 2, data)))
+        self.assertTrue(np.array_equal(reader.read(), self.expected(samples, 8388608)))
+
+    def testExtensible(self):
+        samples = np.round(self.stereo * 32767).astype('<i2')
+        plain = WavReader(self.writeBytes('plain.wav', wavBytes(1, 2, 2, samples.tostring())))
+        for format, content in [(1, samples.tostring()), (3, self.stereo.astype('<f4').tostring())]:
+            sampleWidth = 2 if format == 1 else 4
+            reader = WavReader(self.writeBytes('extensible.wav', wavBytes(format, sampleWidth, 2, content, extensible=True)))
+            self.assertEqual(reader.isFloat, format == 3)
+            expected = plain.read() if format == 1 else self.expected(self.stereo, 1)
+            self.assertTrue(np.array_equal(reader.read(), expected))
+
+    def testOddChunk(self):
+        # an odd sized chunk before the data is followed by a pad byte
+        samples = np.round(self.stereo * 32767).astype('<i2')
+        plain = WavReader(self.writeBytes('plain.wav', wavBytes(1, 2, 2, samples.tostring())))
+        for content in ['abc', 'abcd', 'x' * 101]:
+            reader = WavReader(self.writeBytes('list.wav', wavBytes(1, 2, 2, samples.tostring(),
+                                                                    extraChunk=('LIST', content))))
+            self.assertEqual(len(reader), len(samples))
+            self.assertTrue(np.array_equal(reader.read(), plain.read()))
+
+    def testBlocks(self):
+        # block sizes that do not divide the data, the last block is shorter
+        samples = np.round(self.stereo * 32767).astype('<i2')
+        reader = WavReader(self.writeBytes('blocks.wav', wavBytes(1, 2, 2, samples.tostring())))
+        audio = reader.read()
+        for blockLength in [1000, 4097, len(samples) - 1, len(samples) + 1]:
+            blocks = list(reader.blocks(blockLength))
+            self.assertTrue(all(len(block) == blockLength for block in blocks[:-1]))
+            self.assertEqual(len(blocks[-1]), len(samples) - blockLength * (len(blocks) - 1))
+            self.assertTrue(np.array_equal(np.concatenate(blocks), audio))
+
+    def testTruncated(self):
+        # the data size of an unfinished recording is too large, the samples in the file are read
+        samples = np.round(self.stereo * 32767).astype('<i2')
+        content = wavBytes(1, 2, 2, samples.tostring())
+        reader = WavReader(self.writeBytes('truncated.wav', content[:-1001]))
+        self.assertEqual(len(reader), len(samples) - 251)
+        self.assertTrue(np.array_equal(reader.read(), self.expected(samples[:-251], 32768)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import numpy as np
+from signals import melody
+from RealTimePyin import RealTimePyin
+from test_pYINmain import newPyin
+
+def runStream(audio, blockSizes, **options):
+    # pushes audio in blocks of the sizes blockSizes (cycled), returns the RealTimePyin and its outputs
+    rt = RealTimePyin(newPyin(), **options)
+    rawPitch, provisionalPitch, level = [], [], []
+    iSample = 0
+    iBlock = 0
+    while iSample <= len(audio):
+        blockSize = blockSizes[iBlock % len(blockSizes)]
+        raw, provisional = rt.push(audio[iSample:iSample+blockSize])
+        rawPitch.extend(raw)
+        provisionalPitch.extend(provisional)
+        level.extend(rt.level[:len(raw)])
+        iSample += blockSize
+        iBlock += 1
+    raw, provisional = rt.finalise()
+    rawPitch.extend(raw)
+    provisionalPitch.extend(provisional)
+    level.extend(rt.level[:len(raw)])
+    return rt, np.array(rawPitch), np.array(provisionalPitch), np.array(level)
+
+class RealTimePyinTest(unittest.TestCase):
+
+    def testPushSize(self):
+        # the outputs do not depend on how the stream is cut into blocks, blocks larger than
+        # maxHops frames included
+        audio = melody()
+        rt, rawPitch, provisionalPitch, level = runStream(audio, [len(audio)])
+        for blockSizes in [[256], [1000], [1, 7, 3000, 0, 513], [70000]]:
+            other, otherRaw, otherProvisional, otherLevel = runStream(audio, blockSizes, maxHops = 16)
+            self.assertEqual(other.nFrame, rt.nFrame)
+            self.assertTrue(np.array_equal(otherRaw, rawPitch))
+            self.assertTrue(np.array_equal(otherProvisional, provisionalPitch))
+            self.assertTrue(np.array_equal(otherLevel, level))
+            self.assertTrue(np.array_equal(other.smoothedPitch.values, rt.smoothedPitch.values))
+
+    def testSameAsOffline(self):
+        # one frame per hop of processSignal, the smoothed pitch is the offline one (without maxLag)
+        # on the frames processSignal keeps
+        audio = melody()
+        rt, rawPitch, provisionalPitch, level = runStream(audio, [1000], maxLag = None)
+        pyin = newPyin()
+        pyin.processSignal(audio)
+        self.assertEqual(rt.nFrame, len(pyin.m_level))
+        self.assertTrue(np.array_equal(level, pyin.m_level))
+        smoothedPitch = pyin.getSmoothedPitchTrack()
+        self.assertTrue(np.array_equal(rt.smoothedPitch.values[-len(smoothedPitch):], smoothedPitch))
+
+    def testBudget(self):
+        audio = melody()
+        rt = runStream(audio, [1000], hopBudget = 0.0)[0]
+        self.assertEqual(rt.overBudget, rt.nFrame)
+        rt = runStream(audio, [1000], hopBudget = 1000.0)[0]
+        self.assertEqual(rt.overBudget, 0)
+        self.assertGreater(rt.maxHopTime, 0.0)
+        self.assertGreaterEqual(rt.maxHopTime, rt.meanHopTime())
+        rt = runStream(audio, [1000])[0]
+        self.assertEqual(rt.overBudget, 0)
+
+if __name__ == '__main__':
+    unittest.main()
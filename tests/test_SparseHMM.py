@@ -0,0 +1,258 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from signals import melody
+import pYINmain
+import SparseHMM
+from MonoPitch import MonoPitch
+from MonoNote import MonoNote
+from MonoPitchHMM import MonoPitchHMM
+from MonoNoteHMM import MonoNoteHMM
+from AudioStream import WavReader
+from test_pYINmain import newPyin
+
+def melodyPitchProb():
+    pyin = newPyin()
+    pyin.processSignal(melody())
+    return pyin.m_pitchProb
+
+class LogDomainTest(unittest.TestCase):
+
+    def testSameProbability(self):
+        # the log-domain decoders find a path as likely as the linear one (ties can be broken otherwise)
+        mp = MonoPitch()
+        pitchProb = melodyPitchProb()
+        candidateBins = mp.hmm.binCandidates(pitchProb)
+        obsProb = mp.hmm.calculatedSparseObsProb(pitchProb, candidateBins)
+        path, scale = mp.hmm.decodeViterbi(obsProb)
+        for dtype, places in [(np.float64, 9), (np.float32, 3)]:
+            logPath, scale = mp.hmm.decodeViterbi(obsProb, logDomain=True, dtype=dtype)
+            self.assertAlmostEqual(mp.hmm.pathLogProb(obsProb, logPath), mp.hmm.pathLogProb(obsProb, path), places)
+
+    def testTieBreak(self):
+        # not interchangeable with the linear decoding: on the melody, the two pick different ones of
+        # equally likely paths, and the pitch tracks differ on 4 frames
+        pitchProb = melodyPitchProb()
+        linear = MonoPitch()
+        log = MonoPitch()
+        log.logDomain = True
+        self.assertEqual(list(np.nonzero(log.process(pitchProb) != linear.process(pitchProb))[0]), [106, 107, 108, 110])
+
+    def testObservationType(self):
+        # decodeDtype applies to the observations too, and they decode to a most likely path as well
+        mp = MonoPitch()
+        pitchProb = melodyPitchProb()
+        candidateBins = mp.hmm.binCandidates(pitchProb)
+        obsProb = mp.hmm.calculatedSparseObsProb(pitchProb, candidateBins)
+        obsProb32 = mp.hmm.calculatedSparseObsProb(pitchProb, candidateBins, np.float32)
+        self.assertEqual(obsProb32.value.dtype, np.float32)
+        self.assertEqual(obsProb32.background.dtype, np.float32)
+        self.assertTrue(np.array_equal(obsProb32.value, obsProb.value.astype(np.float32)))
+        path, scale = mp.hmm.decodeViterbi(obsProb)
+        path32, scale = mp.hmm.decodeViterbi(obsProb32, logDomain=True, dtype=np.float32)
+        self.assertAlmostEqual(mp.hmm.pathLogProb(obsProb, path32), mp.hmm.pathLogProb(obsProb, path), 3)
+
+        mn = MonoNote()
+        noteObsProb = mn.hmm.calculatedSparseObsProb(pitchProb[:300], np.float32)
+        self.assertEqual(noteObsProb.value.dtype, np.float32)
+        self.assertEqual(noteObsProb.background.dtype, np.float32)
+
+    def testPyinMain(self):
+        # m_logDomain and m_decodeDtype reach both decoders of PyinMain, with the results of the linear decoding
+        # on testAudioLong.wav
+        audio = WavReader(os.path.join(os.path.dirname(pYINmain.__file__), 'testAudioLong.wav')).read()
+        decodeViterbiLog = SparseHMM.SparseHMM.decodeViterbiLog
+        dtypes = []
+        def recordingDecodeViterbiLog(hmm, obsProb, storeScale = True, dtype = np.float64):
+            dtypes.append(dtype)
+            return decodeViterbiLog(hmm, obsProb, storeScale, dtype)
+
+        outputs = []
+        SparseHMM.SparseHMM.decodeViterbiLog = recordingDecodeViterbiLog
+        try:
+            for logDomain, dtype in [(False, np.float64), (True, np.float32)]:
+                pyin = newPyin()
+                pyin.m_logDomain = logDomain
+                pyin.m_decodeDtype = dtype
+                pyin.processSignal(audio)
+                smoothedPitch = pyin.getSmoothedPitchTrack()
+                fs = pyin.getRemainingFeatures(smoothedPitch)
+                outputs.append((smoothedPitch, fs.m_oMonoNoteOut.pitch, fs.m_oMonoNoteOut.noteState))
+        finally:
+            SparseHMM.SparseHMM.decodeViterbiLog = decodeViterbiLog
+
+        self.assertEqual(dtypes, [np.float32, np.float32])
+        for a, b in zip(*outputs):
+            self.assertTrue(np.array_equal(a, b))
+
+class SegmentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mp = MonoPitch()
+        pitchProb = melodyPitchProb()
+        self.obsProb = self.mp.hmm.calculatedSparseObsProb(pitchProb)
+        self.path, scale = self.mp.hmm.decodeViterbi(self.obsProb, storeScale=False)
+
+    def testConverged(self):
+        # at these boundaries the true delta joins the segment's own one, its back pointers are kept
+        path, report = self.mp.hmm.decodeViterbiSegments(self.obsProb, [0, 120, 250], jobs=2)
+        self.assertTrue(np.array_equal(path, self.path))
+        self.assertEqual(list(report.boundaries), [120, 250])
+        self.assertTrue(np.all(report.convergedAfter >= 0))
+        self.assertFalse(np.any(report.repaired))
+        self.assertTrue(report.isExact)
+
+    def testRepaired(self):
+        # the segments from 200 on are too short to converge and are decoded again
+        path, report = self.mp.hmm.decodeViterbiSegments(self.obsProb, [0, 100, 200, 300], jobs=2)
+        self.assertTrue(np.array_equal(path, self.path))
+        self.assertTrue(np.array_equal(report.repaired, report.convergedAfter < 0))
+        self.assertTrue(report.repaired[-1])
+        self.assertTrue(report.isExact)
+
+        # without repair the report tells from where on the path can be wrong
+        path, report = self.mp.hmm.decodeViterbiSegments(self.obsProb, [0, 100, 200, 300], jobs=2, repair=False)
+        self.assertFalse(report.isExact)
+        firstInexact = report.inexactBoundaries[0]
+        self.assertEqual(list(report.inexactBoundaries), list(report.boundaries[report.boundaries >= firstInexact]))
+        self.assertTrue(np.array_equal(path[:firstInexact], self.path[:firstInexact]))
+
+    def testMonoPitch(self):
+        self.mp.decodeJobs = 2
+        self.assertTrue(np.array_equal(self.mp.process(melodyPitchProb()), MonoPitch().process(melodyPitchProb())))
+        self.assertTrue(self.mp.segmentReport.isExact)
+
+class OnlineViterbiTest(unittest.TestCase):
+
+    def decodeOnline(self, model, frames, maxLag):
+        # the outputs of processOnline and finaliseOnline, and the most frames any processOnline left undecided
+        model.initialiseOnline(maxLag)
+        out = []
+        latency = 0
+        for iFrame, frame in enumerate(frames):
+            out.extend(model.processOnline(frame))
+            latency = max(latency, iFrame + 1 - len(out))
+        out.extend(model.finaliseOnline())
+        return out, latency
+
+    def testPitch(self):
+        # without maxLag a frame is only returned once it is on the offline path: the same path, bitwise
+        pitchProb = melodyPitchProb()
+        offline = MonoPitch().process(pitchProb)
+        online, latency = self.decodeOnline(MonoPitch(), pitchProb, None)
+        self.assertTrue(np.array_equal(online, offline))
+
+    def testNote(self):
+        pyin = newPyin()
+        pyin.processSignal(melody())
+        smoothedPitch = [[[12*np.log2(f/440.0) + 69, 0.9]] if f > 0 else [] for f in pyin.getSmoothedPitchTrack()]
+        offline = MonoNote().process(smoothedPitch)
+        online, latency = self.decodeOnline(MonoNote(), smoothedPitch, None)
+        self.assertEqual([frame.frameNumber for frame in online], list(offline.frameNumber))
+        self.assertTrue(np.array_equal([frame.pitch for frame in online], offline.pitch))
+        self.assertTrue(np.array_equal([frame.noteState for frame in online], offline.noteState))
+
+    def testMaxLag(self):
+        # with maxLag no frame waits longer than maxLag frames, every frame is returned once
+        pitchProb = melodyPitchProb()
+        for maxLag in [0, 1, 8, 32]:
+            online, latency = self.decodeOnline(MonoPitch(), pitchProb, maxLag)
+            self.assertLessEqual(latency, maxLag)
+            self.assertEqual(len(online), len(pitchProb))
+
+class SparseObsTest(unittest.TestCase):
+
+    def checkSameDecoding(self, hmm, dense, sparse):
+        # same observations, and bitwise the same path and scale in both domains
+        nState = len(hmm.init)
+        for iFrame in range(len(dense)):
+            self.assertTrue(np.array_equal(sparse.getFrame(iFrame, nState), dense[iFrame][:nState]))
+        for logDomain in [False, True]:
+            densePath, denseScale = hmm.decodeViterbi(dense, logDomain=logDomain)
+            sparsePath, sparseScale = hmm.decodeViterbi(sparse, logDomain=logDomain)
+            self.assertTrue(np.array_equal(sparsePath, densePath))
+            self.assertTrue(np.array_equal(sparseScale, denseScale))
+
+    def testPitch(self):
+        hmm = MonoPitch().hmm
+        pitchProb = melodyPitchProb()
+        self.checkSameDecoding(hmm, hmm.calculatedObsProbFrames(pitchProb), hmm.calculatedSparseObsProb(pitchProb))
+
+    def testNote(self):
+        pyin = newPyin()
+        pyin.processSignal(melody())
+        smoothedPitch = [[[12*np.log2(f/440.0) + 69, 0.9]] if f > 0 else [] for f in pyin.getSmoothedPitchTrack()]
+        hmm = MonoNote().hmm
+        dense = hmm.calculatedObsProbFrames(smoothedPitch)
+        self.checkSameDecoding(hmm, dense, hmm.calculatedSparseObsProb(smoothedPitch))
+        self.checkSameDecoding(hmm, dense, SparseHMM.sparseObsFromDense(dense, hmm.obsClassStates()))
+
+class ModelCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.savedCache = dict(SparseHMM.modelCache)
+        self.savedCacheDir = SparseHMM.modelCacheDir
+        SparseHMM.modelCache.clear()
+        self.cacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        SparseHMM.modelCache.clear()
+        SparseHMM.modelCache.update(self.savedCache)
+        SparseHMM.modelCacheDir = self.savedCacheDir
+        shutil.rmtree(self.cacheDir)
+
+    def built(self, hmmClass, **parameters):
+        # the tables of a model built from scratch, with parameters set (on par for a MonoNoteHMM)
+        hmm = hmmClass()
+        for name, value in parameters.items():
+            setattr(hmm.par if hasattr(hmm, 'par') else hmm, name, value)
+        hmm.build()
+        return hmm
+
+    def assertSameTables(self, hmm, other):
+        for name in hmm.modelTables():
+            self.assertEqual(getattr(hmm, name).dtype, getattr(other, name).dtype)
+            self.assertTrue(np.array_equal(getattr(hmm, name), getattr(other, name)), name)
+
+    def testInProcess(self):
+        for hmmClass in [MonoPitchHMM, MonoNoteHMM]:
+            first = hmmClass()
+            second = hmmClass()
+            self.assertIs(second.transProb, first.transProb)
+            self.assertFalse(second.transProb.flags.writeable)
+            self.assertSameTables(second, self.built(hmmClass))
+
+    def testOnDisk(self):
+        SparseHMM.setModelCacheDir(self.cacheDir)
+        for hmmClass in [MonoPitchHMM, MonoNoteHMM]:
+            hmmClass()
+        self.assertEqual(len(os.listdir(self.cacheDir)), 2)
+        # a new process: only the files are left
+        SparseHMM.modelCache.clear()
+        for hmmClass in [MonoPitchHMM, MonoNoteHMM]:
+            self.assertSameTables(hmmClass(), self.built(hmmClass))
+        self.assertEqual(len(os.listdir(self.cacheDir)), 2)
+
+    def testStaleKey(self):
+        # changed parameters make another key, the tables of the old one are not reused
+        SparseHMM.setModelCacheDir(self.cacheDir)
+        default = MonoPitchHMM()
+        hmm = MonoPitchHMM()
+        hmm.m_selfTrans = 0.9
+        hmm.buildCached()
+        self.assertFalse(np.array_equal(hmm.transProb, default.transProb))
+        self.assertSameTables(hmm, self.built(MonoPitchHMM, m_selfTrans = 0.9))
+
+        default = MonoNoteHMM()
+        hmm = MonoNoteHMM()
+        hmm.par.pAttackSelftrans = 0.8
+        SparseHMM.modelCache.clear()
+        hmm.buildCached()
+        self.assertFalse(np.array_equal(hmm.transProb, default.transProb))
+        self.assertSameTables(hmm, self.built(MonoNoteHMM, pAttackSelftrans = 0.8))
+        self.assertEqual(len(os.listdir(self.cacheDir)), 4)
+
+if __name__ == '__main__':
+    unittest.main()
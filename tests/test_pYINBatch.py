@@ -0,0 +1,32 @@
+import shutil
+import tempfile
+import unittest
+import signals  # puts src on the path
+from pYINBatch import transcribeFiles
+
+class FailingLog(object):
+
+    def write(self, text):
+        raise IOError('log closed')
+
+class TranscribeFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.outputDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outputDir)
+
+    def testFailedFiles(self):
+        results = transcribeFiles(['/nonexistent/a.wav', '/nonexistent/b.wav'], self.outputDir, jobs = 1,
+                                  log = open('/dev/null', 'w'))
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(result[2] is not None for result in results))
+
+    def testErrorTerminatesPool(self):
+        # an error other than ctrl-c while collecting stops the pool and reaches the caller unchanged
+        self.assertRaises(IOError, transcribeFiles, ['/nonexistent/%d.wav' % i for i in range(8)],
+                          self.outputDir, jobs = 1, log = FailingLog())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import httplib
+import tempfile
+import threading
+import unittest
+import numpy as np
+from signals import melody
+from pYINService import AnalysisService, ServiceHTTPServer, ServiceRequestHandler
+from test_pYINmain import newPyin
+
+class AnalysisServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = AnalysisService(jobs = 1, maxQueued = 1)
+
+    def tearDown(self):
+        self.service.close()
+
+    def waitIdle(self, timeout = 60):
+        deadline = time.time() + timeout
+        while self.service.load()['pending'] > 0 and time.time() < deadline:
+            time.sleep(0.05)
+
+    def testFailedJobsFreeTheQueue(self):
+        # failed jobs that nobody asks about do not hold places in the queue
+        for i in range(5):
+            jobId = self.service.submit(dict(path = '/nonexistent/take%d.wav' % i))
+            if jobId is None:
+                self.waitIdle()
+        self.waitIdle()
+        self.assertEqual(self.service.load()['pending'], 0)
+
+        jobId = self.service.submit(dict(samples = melody(), outputs = ['smoothedpitchtrack']))
+        self.assertIsNotNone(jobId)
+        status, result = self.service.status(jobId, 60)
+        self.assertEqual(status, 'done')
+
+        pyin = newPyin()
+        pyin.processSignal(melody())
+        self.assertTrue(np.array_equal(result['smoothedPitchTrack'], pyin.getSmoothedPitchTrack()))
+
+    def testFailedJob(self):
+        jobId = self.service.submit(dict(path = '/nonexistent/take.wav'))
+        status, error = self.service.status(jobId, 60)
+        self.assertEqual(status, 'failed')
+        self.assertIn('IOError', error)
+        self.assertEqual(self.service.status(jobId), ('unknown', None))
+
+class ServiceRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rootDir = tempfile.mkdtemp()
+        self.server = ServiceHTTPServer(('localhost', 0), ServiceRequestHandler)
+        self.server.service = AnalysisService(jobs = 1, rootDir = self.rootDir)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.server.service.close()
+        os.rmdir(self.rootDir)
+
+    def request(self, method, path, body = None, headers = {}):
+        connection = httplib.HTTPConnection('localhost', self.server.server_port)
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        content = json.loads(response.read())
+        connection.close()
+        return response.status, content
+
+    def testBadWait(self):
+        samples = melody()[:44100].tostring()
+        for wait in ['soon', 'nan', 'inf', '-1']:
+            status, content = self.request('POST', '/jobs?wait=' + wait, samples,
+                                           {'Content-Type': 'application/octet-stream'})
+            self.assertEqual(status, 400)
+            status, content = self.request('GET', '/jobs/0?wait=' + wait)
+            self.assertEqual(status, 400)
+        self.assertEqual(self.server.service.load()['pending'], 0)
+
+    def testRootDir(self):
+        for path in ['/etc/passwd', '../take.wav', 'takes/../../take.wav']:
+            status, content = self.request('POST', '/jobs', json.dumps({'path': path}))
+            self.assertEqual(status, 400)
+            self.assertIn('outside the root directory', content['error'])
+        self.assertEqual(self.server.service.resolvePath('takes/take.wav'),
+                         os.path.join(os.path.realpath(self.rootDir), 'takes', 'take.wav'))
+
+if __name__ == '__main__':
+    unittest.main()
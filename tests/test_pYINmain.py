@@ -0,0 +1,154 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from signals import melody
+import pYINmain
+from YinUtil import frameSignal
+
+def newPyin():
+    pyin = pYINmain.PyinMain()
+    pyin.initialise(channels = 1, inputSampleRate = 44100, stepSize = 256, blockSize = 2048,
+                    lowAmp = 0.25, onsetSensitivity = 0.7, pruneThresh = 0.1)
+    return pyin
+
+class ProcessSignalTest(unittest.TestCase):
+
+    def assertSameState(self, a, b):
+        self.assertEqual(len(a.m_pitchProb), len(b.m_pitchProb))
+        for pitchProbA, pitchProbB in zip(a.m_pitchProb, b.m_pitchProb):
+            self.assertTrue(np.array_equal(pitchProbA, pitchProbB))
+        self.assertTrue(np.array_equal(a.m_level, b.m_level))
+        self.assertTrue(np.array_equal(a.getSmoothedPitchTrack(), b.getSmoothedPitchTrack()))
+
+    def checkSameAsProcess(self, audio):
+        # processSignal leaves exactly the state of process() called on every frame
+        perFrame = newPyin()
+        for frame in frameSignal(audio, 2048, 256):
+            perFrame.process(frame)
+        batch = newPyin()
+        batch.processSignal(audio)
+        self.assertSameState(perFrame, batch)
+
+    def testFloat32(self):
+        self.checkSameAsProcess(melody())
+
+    def testFloat64(self):
+        self.checkSameAsProcess(melody().astype(np.float64))
+
+    def testStream(self):
+        audio = melody()
+        batch = newPyin()
+        batch.processSignal(audio)
+        stream = newPyin()
+        stream.processStream(audio[i:i+1000] for i in range(0, len(audio), 1000))
+        self.assertSameState(batch, stream)
+
+def outputColumns(fs):
+    # the arrays of every output of a FeatureSet, by output name
+    return dict(f0candidates=[fs.m_oF0Candidates.values, fs.m_oF0Candidates.frameOffsets[1:]],
+                f0probs=[fs.m_oF0Probs.values, fs.m_oF0Probs.frameOffsets[1:]],
+                voicedprob=[fs.m_oVoicedProb.values],
+                candidatesalience=[fs.m_oCandidateSalience.values, fs.m_oCandidateSalience.frameOffsets[1:]],
+                smoothedpitchtrack=[fs.m_oSmoothedPitchTrack.values],
+                mononotes=[fs.m_oMonoNoteOut.frameNumber, fs.m_oMonoNoteOut.pitch, fs.m_oMonoNoteOut.noteState],
+                notes=[fs.m_oNotes.values],
+                notepitchtracks=[fs.m_oNotePitchTracks.values, fs.m_oNotePitchTracks.frameOffsets[1:]])
+
+class OutputsTest(unittest.TestCase):
+
+    def analyse(self, outputs):
+        pyin = pYINmain.PyinMain()
+        pyin.initialise(channels = 1, inputSampleRate = 44100, stepSize = 256, blockSize = 2048,
+                        lowAmp = 0.25, onsetSensitivity = 0.7, pruneThresh = 0.1, outputs = outputs)
+        pyin.processSignal(melody())
+        smoothedPitch = pyin.getSmoothedPitchTrack()
+        return smoothedPitch, outputColumns(pyin.getRemainingFeatures(smoothedPitch))
+
+    def testOutputs(self):
+        # the outputs asked for are those of computing everything, the others stay empty
+        allPitch, allColumns = self.analyse(pYINmain.outputNames)
+        for name, arrays in allColumns.items():
+            self.assertGreater(len(arrays[0]), 0, name)
+        for outputs in [[name] for name in pYINmain.outputNames] + [[], ['voicedprob', 'notes'], None]:
+            smoothedPitch, columns = self.analyse(outputs)
+            wanted = set(pYINmain.defaultOutputs if outputs is None else outputs)
+            for name, arrays in columns.items():
+                if name in wanted:
+                    for array, allArray in zip(arrays, allColumns[name]):
+                        self.assertTrue(np.array_equal(array, allArray), name)
+                else:
+                    self.assertTrue(all(len(array) == 0 for array in arrays), name)
+            # the pitch track is only decoded for the outputs made from it
+            if wanted & set(['smoothedpitchtrack', 'mononotes', 'notes', 'notepitchtracks']):
+                self.assertTrue(np.array_equal(smoothedPitch, allPitch))
+            else:
+                self.assertEqual(len(smoothedPitch), 0)
+
+class GrowingArrayTest(unittest.TestCase):
+
+    def testArrayInterface(self):
+        # m_level used to be an ndarray, len/indexing/np.asarray keep working on the filled part
+        level = pYINmain.GrowingArray()
+        values = np.arange(100, dtype=np.float64)
+        level.extend(values[:40])
+        for value in values[40:]:
+            level.append(value)
+        self.assertEqual(len(level), 100)
+        self.assertEqual(level[-1], 99)
+        self.assertTrue(np.array_equal(level[10:20], values[10:20]))
+        self.assertTrue(np.array_equal(np.asarray(level), values))
+        self.assertEqual(np.asarray(level, dtype=np.float32).dtype, np.float32)
+
+class SalienceColumnTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def salience(self, format, directory = None):
+        pyin = pYINmain.PyinMain()
+        pyin.initialise(channels = 1, inputSampleRate = 44100, stepSize = 256, blockSize = 2048,
+                        lowAmp = 0.25, onsetSensitivity = 0.7, pruneThresh = 0.1,
+                        salience = format, salienceDirectory = directory)
+        return pyin.processSignal(melody()).m_oCandidateSalience
+
+    def checkRows(self, column, expected):
+        nFrame = len(expected)
+        self.assertEqual(len(column), nFrame)
+        self.assertTrue(np.array_equal(column.rows(0, nFrame), expected))
+        self.assertTrue(np.array_equal(column.rows(10, 20), expected[10:20]))
+        for i in [0, 1, nFrame//2, nFrame-1, -1]:
+            feature = column[i]
+            self.assertIsInstance(feature, pYINmain.Feature)
+            self.assertTrue(np.array_equal(feature.values, expected[i]))
+        self.assertRaises(IndexError, column.__getitem__, nFrame)
+        self.assertEqual(len(list(column)), nFrame)
+
+    def testFormats(self):
+        dense = self.salience('dense')
+        expected = dense.rows(0, len(dense))
+        self.assertEqual(expected.shape[1], 1024)
+        self.assertTrue(np.any(expected > 0))
+        self.checkRows(dense, expected)
+
+        sparse = self.salience('sparse')
+        self.checkRows(sparse, expected)
+        self.assertEqual(len(sparse.values), np.count_nonzero(expected))
+
+        float16 = self.salience('float16')
+        self.checkRows(float16, expected.astype(np.float16))
+        self.assertEqual(float16.rows(0, 1).dtype, np.float16)
+
+    def testDirectory(self):
+        # memory mapped columns hold the same rows
+        for format in ['dense', 'sparse', 'float16']:
+            inMemory = self.salience(format)
+            mapped = self.salience(format, self.directory)
+            self.assertIsInstance(mapped.array, pYINmain.MappedGrowingArray)
+            self.checkRows(mapped, inMemory.rows(0, len(inMemory)))
+
+if __name__ == '__main__':
+    unittest.main()